@@ -556,8 +556,9 @@ class DecodableAmNnetSpoofIter: public DecodableInterface {
     CuMatrix<BaseFloat> keep_original_mag(feats);
     CuMatrix<BaseFloat> log_probs_updated(log_probs);
 
-    std::string dir_utt_updated = path + "/utterances/" + utt + "/adversarial.csv";
-    ReadCuMatrixBaseFloat(dir_utt_updated, &updated_feats, false);
+    // adversarial signal of the previous iteration (binary, @ synthesize.py)
+    std::string dir_utt_updated = path + "/utterances/" + utt + "/adversarial.npy";
+    ReadMatrixNpy(dir_utt_updated, &updated_feats);
 
     // read in original
     std::string dir_utt_original = path + "/utterances/" + utt + "/original.csv";
@@ -678,7 +679,7 @@ class DecodableAmNnetSpoofIter: public DecodableInterface {
     //updated_feats.Scale(max_val);
 
     std::string path_adv = path +  + "/utterances/";
-    saveMatrix(updated_feats, utt, path_adv, "adversarial");
+    saveMatrix(updated_feats, utt, path_adv, "adversarial", true);
 
     // write original magnitude on disc
     std::string path_original = path +  + "/utterances/";
@@ -716,7 +717,7 @@ class DecodableAmNnetSpoofIter: public DecodableInterface {
     return (frame == NumFramesReady() - 1);
   }
 
-  void saveMatrix(CuMatrix<BaseFloat> &input, std::string num_utterance, std::string dir, std::string iter){
+  void saveMatrix(CuMatrix<BaseFloat> &input, std::string num_utterance, std::string dir, std::string iter, bool npy = false){
 
     std::string dir_utt = dir + "/" + num_utterance;
     std::string mk_string = "mkdir -p " + dir_utt;
@@ -725,6 +726,11 @@ class DecodableAmNnetSpoofIter: public DecodableInterface {
     if (-1 == dir_err)
       KALDI_ERR << "Error creating directory!\n";
 
+    if (npy) {
+      WriteMatrixNpy(input, dir_utt + "/" + iter + ".npy");
+      return;
+    }
+
     std::string file = dir_utt + "/" + iter  + ".csv";
 
     WriteCuMatrixBaseFloat(file,input);
@@ -23,6 +23,9 @@
 
 #include <iterator>
 #include <sstream>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <unistd.h>
 #include "nnet2/nnet-component.h"
 #include "nnet2/nnet-precondition.h"
 #include "nnet2/nnet-precondition-online.h"
@@ -980,6 +983,78 @@ void PytorchComponent::InitFromString(std::string args) {
   Init(input_dim);
 }
 
+// The psychoacoustic filter is evaluated by a long-lived python worker
+// (psycho/pytorch_worker.py). It is started once per process on first use and
+// loads python and torch only once, instead of once per Propagate/Backprop.
+static int psycho_worker_fd = -1;
+
+static int ConnectPsychoWorker() {
+  if (psycho_worker_fd >= 0)
+    return psycho_worker_fd;
+
+  std::stringstream socket_file;
+  socket_file << "/tmp/dompteur_psycho." << getpid() << ".sock";
+
+  // start worker in background
+  std::stringstream cmd_line;
+  cmd_line << "/usr/bin/python3 /root/kaldi/wsj_recipe/psycho/pytorch_worker.py"
+           << " --socket_file " << socket_file.str()
+           << " --threshs_file_id " << getpid() << " &";
+  KALDI_LOG << cmd_line.str();
+  unlink(socket_file.str().c_str());
+  if (system(cmd_line.str().c_str()) != 0)
+    KALDI_ERR << "Could not start psycho worker";
+
+  struct sockaddr_un addr;
+  memset(&addr, 0, sizeof(addr));
+  addr.sun_family = AF_UNIX;
+  strncpy(addr.sun_path, socket_file.str().c_str(), sizeof(addr.sun_path) - 1);
+
+  // wait until the worker listens (importing torch takes a few seconds)
+  for (int32 i = 0; i < 6000; i++) {
+    int fd = socket(AF_UNIX, SOCK_STREAM, 0);
+    if (fd < 0)
+      KALDI_ERR << "Could not create socket for psycho worker";
+    if (connect(fd, reinterpret_cast<struct sockaddr*>(&addr), sizeof(addr)) == 0) {
+      psycho_worker_fd = fd;
+      return psycho_worker_fd;
+    }
+    close(fd);
+    usleep(100000);
+  }
+  KALDI_ERR << "Could not connect to psycho worker @ " << socket_file.str();
+  return -1;
+}
+
+static void RequestPsychoWorker(const std::string &request) {
+  int fd = ConnectPsychoWorker();
+  KALDI_LOG << request;
+
+  std::string line = request + "\n";
+  const char *buffer = line.c_str();
+  size_t to_write = line.size();
+  while (to_write > 0) {
+    ssize_t written = write(fd, buffer, to_write);
+    if (written <= 0)
+      KALDI_ERR << "Lost connection to psycho worker";
+    buffer += written;
+    to_write -= written;
+  }
+
+  // response is a single line: "ok" or "error <msg>"
+  std::string response;
+  char c;
+  while (true) {
+    if (read(fd, &c, 1) != 1)
+      KALDI_ERR << "Lost connection to psycho worker";
+    if (c == '\n')
+      break;
+    response += c;
+  }
+  if (response != "ok")
+    KALDI_ERR << "Psycho worker failed for \"" << request << "\": " << response;
+}
+
 void PytorchComponent::Propagate(const ChunkInfo &in_info,
                                const ChunkInfo &out_info,
                                const CuMatrixBase<BaseFloat> &in,
@@ -987,15 +1062,12 @@ void PytorchComponent::Propagate(const ChunkInfo &in_info,
 
   // out->CopyFromMat(in);
 
-  std::string data_file = DumpMatrixIntoTempFile(in);
+  std::string data_file = DumpMatrixIntoNpyTempFile(in);
 
   // invoke python
-  std::stringstream cmd_line;
-  cmd_line << "/usr/bin/python3 /root/kaldi/wsj_recipe/psycho/pytorch_propagate.py --data_file " << data_file << " --threshs_file_id " << getpid();
-  KALDI_LOG << cmd_line.str();
-  system(cmd_line.str().c_str());
+  RequestPsychoWorker("propagate " + data_file);
 
-  CuMatrix<BaseFloat> tmp = ReadMatrixFromTempFile(data_file, in.NumRows(), in.NumCols());
+  CuMatrix<BaseFloat> tmp = ReadMatrixFromNpyTempFile(data_file, in.NumRows(), in.NumCols());
   out->CopyFromMat(tmp);
 
 }
@@ -1011,26 +1083,20 @@ void PytorchComponent::Backprop(const ChunkInfo &,  // in_info,
 
   // in_deriv->CopyFromMat(out_deriv);
 
-  std::string data_in_file = DumpMatrixIntoTempFile(in_value);
-  std::string data_out_file = DumpMatrixIntoTempFile(out_value);
-  std::string grad_file = DumpMatrixIntoTempFile(out_deriv);
+  std::string data_in_file = DumpMatrixIntoNpyTempFile(in_value);
+  std::string data_out_file = DumpMatrixIntoNpyTempFile(out_value);
+  std::string grad_file = DumpMatrixIntoNpyTempFile(out_deriv);
   KALDI_LOG << data_in_file;
   KALDI_LOG << data_out_file;
   KALDI_LOG << grad_file;
 
   // invoke python
-  std::stringstream cmd_line;
-  cmd_line << "/usr/bin/python3 /root/kaldi/wsj_recipe/psycho/pytorch_backprop.py --data_in_file " << data_in_file << " --data_out_file " << data_out_file << " --grad_file " << grad_file << " --threshs_file_id " << getpid();
-  KALDI_LOG << cmd_line.str();
-  system(cmd_line.str().c_str());
-
-  std::string cmd_line_rm = "rm " + data_in_file;
-  system(cmd_line_rm.c_str());
+  RequestPsychoWorker("backprop " + data_in_file + " " + data_out_file + " " + grad_file);
 
-  cmd_line_rm = "rm " + data_out_file;
-  system(cmd_line_rm.c_str());
+  unlink(data_in_file.c_str());
+  unlink(data_out_file.c_str());
 
-  CuMatrix<BaseFloat> tmp = ReadMatrixFromTempFile(grad_file, out_deriv.NumRows(), out_deriv.NumCols());
+  CuMatrix<BaseFloat> tmp = ReadMatrixFromNpyTempFile(grad_file, out_deriv.NumRows(), out_deriv.NumCols());
   in_deriv->CopyFromMat(tmp);
 
 }
@@ -19,6 +19,8 @@
 
 #include "nnet2/nnet-print-csv.h"
 
+#include <unistd.h>
+
 namespace kaldi {
 namespace nnet2 {
 
@@ -299,6 +301,109 @@ CuMatrix<BaseFloat> ReadMatrixFromTempFile(std::string tmp_file, uint16 rows, ui
 }
 
 
+void WriteMatrixNpy(const CuMatrixBase<BaseFloat> &in, std::string file_name) {
+  // npy header (version 1.0): magic, header length, python dict padded to 64 bytes
+  std::stringstream header;
+  header << "{'descr': '<f4', 'fortran_order': False, 'shape': ("
+         << in.NumRows() << ", " << in.NumCols() << "), }";
+  std::string header_str = header.str();
+  size_t padding = 64 - (10 + header_str.size() + 1) % 64;
+  header_str += std::string(padding % 64, ' ') + "\n";
+  uint16 header_len = header_str.size();
+
+  // write input (row-major float32)
+  Matrix<BaseFloat> temp(in);
+  std::vector<float> row(in.NumCols());
+  std::ofstream outfile(file_name.c_str(), std::ios::binary);
+  outfile.write("\x93NUMPY\x01\x00", 8);
+  outfile.put(header_len & 0xff);
+  outfile.put(header_len >> 8);
+  outfile.write(header_str.c_str(), header_len);
+  for (int32 i = 0; i < temp.NumRows(); i++) {
+    for (int32 j = 0; j < temp.NumCols(); j++)
+      row[j] = temp(i, j);
+    outfile.write(reinterpret_cast<const char*>(&row[0]), sizeof(float) * row.size());
+  }
+  outfile.close();
+  if (outfile.fail())
+    KALDI_ERR << "Could not write " << file_name;
+}
+
+
+bool ReadMatrixNpy(std::string file_name, CuMatrix<BaseFloat> *matrix) {
+  std::ifstream infile(file_name.c_str(), std::ios::binary);
+  if (!infile.is_open())
+    return false;
+
+  // parse npy header (version 1.0), only float32 in C order is supported
+  char preamble[10];
+  infile.read(preamble, 10);
+  if (!infile || std::string(preamble + 1, 5) != "NUMPY" || preamble[6] != 1)
+    KALDI_ERR << "Expected npy (version 1.0) file " << file_name;
+  uint16 header_len = static_cast<unsigned char>(preamble[8]) |
+                      (static_cast<unsigned char>(preamble[9]) << 8);
+  std::string header(header_len, ' ');
+  infile.read(&header[0], header_len);
+  if (header.find("'<f4'") == std::string::npos ||
+      header.find("'fortran_order': False") == std::string::npos)
+    KALDI_ERR << "Expected float32 matrix in C order " << file_name;
+  int32 rows = 0, cols = 1;
+  size_t shape = header.find("'shape': (");
+  if (shape == std::string::npos ||
+      sscanf(header.c_str() + shape + 10, "%d, %d", &rows, &cols) < 1)
+    KALDI_ERR << "Could not parse shape of " << file_name;
+
+  // read data (row-major float32)
+  Matrix<BaseFloat> temp(rows, cols);
+  std::vector<float> row(cols);
+  for (int32 i = 0; i < rows; i++) {
+    infile.read(reinterpret_cast<char*>(&row[0]), sizeof(float) * cols);
+    if (!infile)
+      KALDI_ERR << "Unexpected end of file " << file_name;
+    for (int32 j = 0; j < cols; j++)
+      temp(i, j) = row[j];
+  }
+  infile.close();
+
+  matrix->Resize(rows, cols);
+  matrix->CopyFromMat(temp);
+  return true;
+}
+
+
+std::string DumpMatrixIntoNpyTempFile(const CuMatrixBase<BaseFloat> &in) {
+  // create a tmp file, preferably in shared memory
+  std::string tmp_dir = access("/dev/shm", W_OK) == 0 ? "/dev/shm" : "/tmp";
+  std::string tmp_template = tmp_dir + "/kaldi_matrix.XXXXXX.npy";
+  std::vector<char> tmp_file_buffer(tmp_template.begin(), tmp_template.end());
+  tmp_file_buffer.push_back('\0');
+  int fd = mkstemps(&tmp_file_buffer[0], 4);
+  if (fd < 0)
+    KALDI_ERR << "Could not create tmp file " << tmp_template;
+  close(fd);
+  std::string tmp_file(&tmp_file_buffer[0]);
+  KALDI_LOG << tmp_file;
+
+  WriteMatrixNpy(in, tmp_file);
+
+  return tmp_file;
+}
+
+
+CuMatrix<BaseFloat> ReadMatrixFromNpyTempFile(std::string tmp_file, int32 rows, int32 cols) {
+  // read from tmp_file (same header checks as any npy file)
+  CuMatrix<BaseFloat> matrix;
+  if (!ReadMatrixNpy(tmp_file, &matrix))
+    KALDI_ERR << "Error opening " << tmp_file;
+  KALDI_ASSERT(matrix.NumRows() == rows && matrix.NumCols() == cols);
+
+  // finally, delete tmp file
+  unlink(tmp_file.c_str());
+
+  return matrix;
+}
+
+
 } // namespace nnet2
 } // namespace kaldi
 
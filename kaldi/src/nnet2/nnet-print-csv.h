@@ -46,6 +46,12 @@ std::string DumpMatrixIntoTempFile(const CuMatrixBase<BaseFloat> &in);
 
 CuMatrix<BaseFloat> ReadMatrixFromTempFile(std::string tmp_file, uint16 rows, uint16 cols);
 
+// binary exchange with python: float32 .npy files (@ /dev/shm if available)
+void WriteMatrixNpy(const CuMatrixBase<BaseFloat> &in, std::string file_name);
+bool ReadMatrixNpy(std::string file_name, CuMatrix<BaseFloat> *matrix);
+std::string DumpMatrixIntoNpyTempFile(const CuMatrixBase<BaseFloat> &in);
+CuMatrix<BaseFloat> ReadMatrixFromNpyTempFile(std::string tmp_file, int32 rows, int32 cols);
+
 } // namespace nnet2
 } // namespace kaldi
 
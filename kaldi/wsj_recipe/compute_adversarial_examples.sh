@@ -45,7 +45,8 @@ mv ${dataset_decode_dir}/utterances ${adversarial_dir}
 ## Step 2: compute hearing thresholds
 if [ $thresh != -1 ]; then
     mkdir -p ${adversarial_dir}/thresholds
-    /root/hearing_thresholds/run_calc_threshold.sh /usr/local/MATLAB/MATLAB_Runtime/v96 ${dataset_dir}/wav.scp 512 256 ${adversarial_dir}/thresholds/
+    # NumPy port of /root/hearing_thresholds/run_calc_threshold.sh (same arguments and outputs)
+    python3 psycho/hearing_thresholds.py ${dataset_dir}/wav.scp 512 256 ${adversarial_dir}/thresholds/ || exit 1;
 else
     echo "skip hearing thresholds"  
 fi
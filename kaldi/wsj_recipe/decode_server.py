@@ -0,0 +1,280 @@
+import argparse
+import io
+import json
+import os
+import queue
+import re
+import socketserver
+import struct
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from subprocess import PIPE, Popen
+
+import numpy as np
+import torch
+from scipy.io import wavfile
+
+from psycho import threshold_cache
+from psycho.psycho import Psycho
+
+#
+# Resident decoder for `Kaldi` instances (@ src/decode_server.py).
+#
+# `decode_wavs.sh` runs the pre-processing, the feature extraction and the
+# decoding (incl. loading final.mdl and HCLG.fst) from scratch for each call.
+# The server keeps one pipeline alive instead:
+#
+#   psychoacoustic filter -> compute-time-feats -> cmvn -> nnet-latgen-faster
+#       -> lattice-scale -> lattice-add-penalty -> lattice-best-path
+#
+# The filter and the cmvn (one speaker per utterance, cf. `Dataset.dump_as_kaldi_dataset`)
+# run in-process, the Kaldi binaries read and write archives via stdin / stdout and
+# flush after each utterance. Concurrent requests are queued and decoded as one batch.
+#
+# Protocol (unix socket, one request per connection)
+#   request : {"utts": [{"name": <utt>, "samples": <n>, "ref": <text>}, ...]}\n
+#             followed by the int16 samples (little endian) of all utterances
+#             or {"cmd": "shutdown"}\n
+#   response: {"utts": [{"wav_name", "ref", "hyp", "wer"}, ...]}\n | {"error": <msg>}\n
+#
+# In contrast to `local/score.sh`, the hypotheses are the best paths for a fixed
+# LM weight and word insertion penalty (--lmwt, --wip) as no references are needed.
+#
+
+PHI = int(os.environ["PHI"]) if os.environ.get("PHI", "None") != "None" else None
+
+BATCH_SIZE = 16
+
+# @ local/wer_hyp_filter
+WER_FILTER = [ (r'<NOISE>', ''), (r'<SPOKEN_NOISE>', ''), (r'<UNK>', ''), (r':', ''), (r'\*', ''),
+               (r'-HOLDER', 'HOLDER'), (r'COMPAIGN', 'CAMPAIGN'), (r'APPROACHES-', 'APPROACHES'),
+               (r'RESEACHERS', 'RESEARCHERS') ]
+
+def wer_filter(text):
+    for pattern, replacement in WER_FILTER:
+        text = re.sub(pattern, replacement, text)
+    return text.split()
+
+def word_errors(ref, hyp):
+    # levenshtein distance of words (substitutions + insertions + deletions)
+    distances = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        previous, distances[0] = distances[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            previous, distances[j] = distances[j], min(distances[j] + 1, distances[j-1] + 1,
+                                                      previous + (ref_word != hyp_word))
+    return distances[-1]
+
+def read_token(stream):
+    token = bytearray()
+    while True:
+        c = stream.read(1)
+        if not c:
+            raise EOFError('unexpected end of stream')
+        if c == b' ':
+            return token.decode()
+        token += c
+
+def read_matrix(stream):
+    # kaldi binary archive entry: <key> \0B FM \4 <rows> \4 <cols> <float32 data>
+    key = read_token(stream)
+    assert stream.read(2) == b'\0B'
+    assert read_token(stream) == 'FM'
+    _, rows, _, cols = struct.unpack('<bibi', stream.read(10))
+    matrix = np.frombuffer(stream.read(4 * rows * cols), dtype='<f4').reshape(rows, cols)
+    return key, matrix
+
+def write_matrix(stream, key, matrix):
+    rows, cols = matrix.shape
+    stream.write(f'{key} '.encode() + b'\0BFM ' + struct.pack('<bibi', 4, rows, 4, cols))
+    stream.write(np.ascontiguousarray(matrix, dtype='<f4').tobytes())
+
+
+class Decoder:
+
+    def __init__(self, phi, model_dir, graph_dir, lmwt, wip):
+        self.psycho = Psycho(phi)
+        cmvn_opts = model_dir.joinpath('cmvn_opts').read_text()
+        self.norm_means = '--norm-means=false' not in cmvn_opts
+        self.norm_vars = '--norm-vars=true' in cmvn_opts
+        self.words = dict(line.split()[::-1] for line in graph_dir.joinpath('words.txt').read_text().splitlines())
+        # per-utterance outputs of nnet-latgen-faster (@ decoder-wrappers.cc) are not needed
+        self.scratch_dir = Path(tempfile.mkdtemp(dir='/dev/shm' if os.access('/dev/shm', os.W_OK) else None))
+        self.scratch_dir.joinpath('utterances').mkdir()
+        # features (@ steps/make_time.sh)
+        self.feats = Popen(['compute-time-feats', '--config=conf/time.conf', 'ark:-', 'ark,f:-'],
+                           stdin=PIPE, stdout=PIPE)
+        # decoding (@ steps/nnet2/decode.sh) and best path (@ local/score.sh)
+        feats_rspecifier = 'ark:-'
+        if model_dir.joinpath('final.mat').is_file():
+            splice_opts = model_dir.joinpath('splice_opts').read_text().strip()
+            feats_rspecifier = f'ark:splice-feats {splice_opts} ark:- ark,f:- | ' \
+                               f'transform-feats {model_dir}/final.mat ark:- ark,f:- |'
+        self.decoder = Popen(
+            f'nnet-latgen-faster --minimize=false --max-active=7000 --min-active=200 --beam=15.0 '
+            f'--lattice-beam=8.0 --acoustic-scale=0.1 --allow-partial=true '
+            f'--word-symbol-table={graph_dir}/words.txt {model_dir}/final.mdl {graph_dir}/HCLG.fst '
+            f'"{feats_rspecifier}" ark,f:- {self.scratch_dir} | '
+            f'lattice-scale --inv-acoustic-scale={lmwt} ark:- ark,f:- | '
+            f'lattice-add-penalty --word-ins-penalty={wip} ark:- ark,f:- | '
+            f'lattice-best-path ark:- ark,t,f:-',
+            shell=True, executable='/bin/bash', stdin=PIPE, stdout=PIPE)
+        self.hyps = queue.Queue()
+        threading.Thread(target=self._read_hyps, daemon=True).start()
+        self.num_utts = 0
+
+    def _read_hyps(self):
+        for line in self.decoder.stdout:
+            key, *word_ids = line.decode().split()
+            self.hyps.put((key, ' '.join(self.words[word_id] for word_id in word_ids)))
+        self.hyps.put((None, None))
+
+    def _filter(self, audios):
+        # as `Psycho.convert_wavs` (torchaudio scaling)
+        signals = [ torch.round(torch.from_numpy(audio.astype(np.float32)) / 32768 * 32767) for audio in audios ]
+        lengths = [ len(signal) for signal in signals ]
+        batch = torch.zeros((len(signals), max(lengths)))
+        for b, signal in enumerate(signals):
+            batch[b,:len(signal)] = signal
+        thresholds = [ threshold_cache.thresholds_of_audio(audio) if self.psycho.phi is not None else None
+                       for audio in audios ]
+        signals_out = self.psycho.forward_batch(batch, lengths, thresholds)
+        return [ torch.round(signal_out).detach().numpy().astype('int16') for signal_out in signals_out ]
+
+    def _cmvn(self, feats):
+        # @ apply-cmvn (stats of the utterance itself)
+        feats = feats.astype(np.float64)
+        mean = feats.mean(axis=0)
+        if self.norm_vars:
+            var = np.maximum(np.square(feats).mean(axis=0) - np.square(mean), 1e-20)
+            return ((feats - mean) / np.sqrt(var)).astype(np.float32)
+        return (feats - mean).astype(np.float32) if self.norm_means else feats.astype(np.float32)
+
+    def decode(self, utts):
+        """ utts: list of (name, int16 audio) -> list of hypotheses """
+        # filter batches of similar length
+        order = sorted(range(len(utts)), key=lambda idx: len(utts[idx][1]))
+        audios = [None] * len(utts)
+        for i in range(0, len(order), BATCH_SIZE):
+            batch = [ idx for idx in order[i:i+BATCH_SIZE] if len(utts[idx][1]) > 0 ]
+            if batch:
+                for idx, audio in zip(batch, self._filter([ utts[idx][1] for idx in batch ])):
+                    audios[idx] = audio
+        # features -> decoder (decoding runs while the next features are computed)
+        keys = {}
+        for idx, audio in enumerate(audios):
+            if audio is None or len(audio) < self.psycho.hop_length:
+                continue
+            key = f'utt{self.num_utts:08d}'
+            self.num_utts += 1
+            wav = io.BytesIO()
+            wavfile.write(wav, self.psycho.sampling_rate, audio)
+            self.feats.stdin.write(f'{key} '.encode() + wav.getvalue())
+            self.feats.stdin.flush()
+            _, feats = read_matrix(self.feats.stdout)
+            write_matrix(self.decoder.stdin, key, self._cmvn(feats))
+            self.decoder.stdin.flush()
+            keys[key] = idx
+        # too short utterances => no hypothesis
+        hyps = [''] * len(utts)
+        while keys:
+            key, hyp = self.hyps.get()
+            if key is None:
+                raise RuntimeError('decoder terminated')
+            hyps[keys.pop(key)] = hyp
+        for utterance_file in self.scratch_dir.joinpath('utterances').glob('*'):
+            utterance_file.unlink()
+        return hyps
+
+    def close(self):
+        for process in [ self.feats, self.decoder ]:
+            process.stdin.close()
+            process.wait()
+        for utterance_file in self.scratch_dir.joinpath('utterances').glob('*'):
+            utterance_file.unlink()
+        self.scratch_dir.joinpath('utterances').rmdir()
+        self.scratch_dir.rmdir()
+
+
+def decode_loop(decoder, jobs):
+    while True:
+        # all queued requests => one batch
+        batch = [ jobs.get() ]
+        while not jobs.empty():
+            batch.append(jobs.get())
+        utts = [ utt for job in batch for utt in job['utts'] ]
+        try:
+            hyps = decoder.decode([ (utt['name'], utt['audio']) for utt in utts ])
+            for utt, hyp in zip(utts, hyps):
+                ref = wer_filter(utt['ref'])
+                hyp = wer_filter(hyp)
+                utt['result'] = { 'wav_name': utt['name'], 'ref': ' '.join(ref), 'hyp': ' '.join(hyp),
+                                  'wer': word_errors(ref, hyp) / max(1, len(ref)) }
+            error = None
+        except Exception as e:
+            traceback.print_exc()
+            error = f'{type(e).__name__}: {e}'
+        print(f'[+] decoded {len(utts)} utterances ({len(batch)} requests)', flush=True)
+        for job in batch:
+            job['error'] = error
+            job['done'].set()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if request.get('cmd') == 'shutdown':
+            self.wfile.write(b'{}\n')
+            threading.Thread(target=self.server.shutdown).start()
+            return
+        for utt in request['utts']:
+            utt['audio'] = np.frombuffer(self.rfile.read(2 * utt['samples']), dtype='<i2')
+        job = { 'utts': request['utts'], 'done': threading.Event() }
+        self.server.jobs.put(job)
+        job['done'].wait()
+        if job['error']:
+            response = { 'error': job['error'] }
+        else:
+            response = { 'utts': [ utt['result'] for utt in job['utts'] ] }
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+def main(socket_file, lmwt, wip, model_dir, graph_dir):
+    print(f'[+] decode server')
+    print(f'    -> phi   : {PHI}')
+    print(f'    -> model : {model_dir}')
+    print(f'    -> graph : {graph_dir}')
+    print(f'    -> lmwt  : {lmwt}')
+    print(f'    -> wip   : {wip}')
+    print(f'    -> socket: {socket_file}', flush=True)
+
+    # resolved paths => the model is not affected by the symlinks of later commands (local backend)
+    decoder = Decoder(PHI, model_dir.resolve(), graph_dir.resolve(), lmwt, wip)
+    # the socket only appears once it is accessible for the (non-root) client
+    tmp_socket_file = socket_file.with_name(f'.{socket_file.name}.tmp')
+    for path in [ socket_file, tmp_socket_file ]:
+        if path.exists(): path.unlink()
+    with socketserver.ThreadingUnixStreamServer(str(tmp_socket_file), RequestHandler) as server:
+        server.daemon_threads = True
+        server.jobs = queue.Queue()
+        threading.Thread(target=decode_loop, args=(decoder, server.jobs), daemon=True).start()
+        os.chmod(tmp_socket_file, 0o777)
+        tmp_socket_file.rename(socket_file)
+        try:
+            server.serve_forever()
+        finally:
+            socket_file.unlink()
+    decoder.close()
+    print(f'[+] decode server stopped ({decoder.num_utts} utterances)')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket_file', type=Path, required=True)
+    parser.add_argument('--lmwt', type=int, default=10, help='LM weight (inverse acoustic scale)')
+    parser.add_argument('--wip', type=float, default=0.0, help='word insertion penalty')
+    parser.add_argument('--model_dir', type=Path, default=Path('exp/nnet5d_gpu_time'))
+    parser.add_argument('--graph_dir', type=Path, default=Path('exp/tri4b/graph_bd_tgpr'))
+    main(**vars(parser.parse_args()))
@@ -3,6 +3,8 @@
 . ./path.sh
 
 decode_dir=$1
+# optional: additional reference dirs (<dir>/text), scored with the same lattices
+reference_dirs="${@:2}"
 
 # preprocess wavs
 python3 psycho/pre-processing.py --encoding_dir ${decode_dir}/wavs
@@ -19,5 +21,17 @@ steps/compute_cmvn_stats.sh ${decode_dir}
 steps/nnet2/decode.sh --cmd "$decode_cmd" --nj ${NUMJOBS} \
     exp/tri4b/graph_bd_tgpr ${decode_dir} ${decode_dir}
 
+# score additional references
+for reference_dir in ${reference_dirs}; do
+    cp ${decode_dir}/utt2spk ${reference_dir}/utt2spk
+    for lat in ${decode_dir}/lat.*.gz; do
+        ln -sf ../$(basename ${lat}) ${reference_dir}/$(basename ${lat})
+    done
+    local/score.sh --cmd "$decode_cmd" ${reference_dir} exp/tri4b/graph_bd_tgpr ${reference_dir}
+done
+
 # print results
-cat ${decode_dir}/scoring_kaldi/best_wer
\ No newline at end of file
+cat ${decode_dir}/scoring_kaldi/best_wer
+for reference_dir in ${reference_dirs}; do
+    cat ${reference_dir}/scoring_kaldi/best_wer
+done
\ No newline at end of file
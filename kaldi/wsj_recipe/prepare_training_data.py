@@ -1,43 +1,121 @@
 from pathlib import Path
-from subprocess import run
+from subprocess import run, PIPE
+from threading import Thread
+from collections import deque
+from queue import Queue
+import io
 import os
+import shlex
 
+import numpy as np
+from scipy.io import wavfile
 from tqdm import tqdm
 import shutil
 from psycho.psycho import Psycho
-from multiprocessing import Pool, cpu_count
+from multiprocessing import Pool
 
 PHI = int(os.environ["PHI"]) if os.environ["PHI"] != "None" else None
 NUMJOBS = int(os.environ["NUMJOBS"])
+BATCH_SIZE = 16
+# decoded utterances waiting for a batch / batches waiting for the filter (=> bounded memory)
+QUEUE_SIZE = 4 * BATCH_SIZE
+MAX_IN_FLIGHT = 2 * NUMJOBS
+# utterances are sorted by length within a window (batches of similar length => little padding)
+WINDOW = 8 * BATCH_SIZE
 
-def process_entry(entry):
-    # assert that wav is send to stdout
-    assert entry.endswith('|')
-    # parse entry
-    utterance = entry.split(' ')[0]    # extract utterance 
-    wav_cmd = entry[len(utterance)+1:] # extract path to wav
-    # convert wav
-    wav_path = dataset_data_dir.joinpath(utterance).with_suffix(".wav")
-    run(f'{wav_cmd[:-1]} > {wav_path}', shell=True)
-    # convert
-    if PHI is not None:
-        threshs_file = Path(f'/root/WSJ_threshs/{utterance}.csv')
-        out_file = Path(wav_path)
-        in_file = wav_path.with_suffix('.original.wav')
-        wav_path.rename(in_file)
-        Psycho(PHI).convert_wav(in_file, threshs_file, out_file)
+def read_sphere(sph_file):
+    # uncompressed NIST SPHERE (16 bit, mono) -> (sampling rate, samples); None if sph2pipe is needed (e.g., shorten)
+    with open(sph_file, 'rb') as f:
+        if f.read(8) != b'NIST_1A\n':
+            return None
+        header_size = int(f.read(8))
+        header = f.read(header_size - 16).decode('ascii', errors='replace')
+        fields = {}
+        for line in header.splitlines():
+            if line.startswith('end_head'): break
+            field = line.split(None, 2)
+            if len(field) == 3: fields[field[0]] = field[2].strip()
+        if fields.get('sample_coding', 'pcm') != 'pcm' or fields.get('sample_n_bytes') != '2' \
+            or fields.get('channel_count', '1') != '1' or fields.get('sample_byte_format') not in ['01', '10']:
+            return None
+        dtype = '<i2' if fields['sample_byte_format'] == '01' else '>i2'
+        audio = np.frombuffer(f.read(), dtype=dtype)
+    if 'sample_count' in fields:
+        audio = audio[:int(fields['sample_count'])]
+    return int(fields['sample_rate']), audio.astype(np.int16)
+
+def read_audio(wav_cmd):
+    # entry of a 'wav.scp' (path or command that sends the wav to stdout) -> (sampling rate, samples)
+    if not wav_cmd.endswith('|'):
+        return wavfile.read(wav_cmd)
+    wav_cmd = wav_cmd[:-1].strip()
+    args = shlex.split(wav_cmd)
+    if len(args) == 4 and Path(args[0]).name == 'sph2pipe' and args[1:3] == ['-f', 'wav']:
+        audio = read_sphere(args[3])
+        if audio is not None: return audio
+    # e.g., shorten compressed WSJ files => decode via pipe (still w/o intermediate file)
+    wav = run(wav_cmd, shell=True, stdout=PIPE, check=True).stdout
+    return wavfile.read(io.BytesIO(wav))
+
+def read_entries(entries, utterances):
+    # producer: decode wavs in NUMJOBS threads (disk / sph2pipe) into the bounded queue, None marks a finished thread
+    def reader(shard):
+        try:
+            for entry in shard:
+                utterance, wav_cmd = entry.split(' ', 1)
+                utterances.put((utterance, *read_audio(wav_cmd.strip())))
+        except Exception as e:
+            utterances.put(e)
+        finally:
+            utterances.put(None)
+    readers = [ Thread(target=reader, args=(entries[idx::NUMJOBS],), daemon=True) for idx in range(NUMJOBS) ]
+    for thread in readers: thread.start()
+    return len(readers)
+
+def batches(entries):
+    # consumer: decoded utterances -> batches of similar length
+    utterances = Queue(QUEUE_SIZE)
+    running = read_entries(entries, utterances)
+    window = []
+    while running > 0:
+        utterance = utterances.get()
+        if utterance is None:
+            running -= 1
+            continue
+        if isinstance(utterance, Exception):
+            raise utterance
+        window.append(utterance)
+        if len(window) == WINDOW:
+            yield from split(window)
+            window = []
+    yield from split(window)
 
-    # return updated entry
-    return f"{utterance} {wav_path} \n"
+def split(window):
+    window.sort(key=lambda utterance: len(utterance[2]))
+    for i in range(0, len(window), BATCH_SIZE):
+        yield window[i:i+BATCH_SIZE]
+
+def filter_batch(batch, out_dir):
+    # psychoacoustic filtering in memory + final wav (one write per utterance)
+    utterances, sampling_rates, audios = zip(*batch)
+    if PHI is not None:
+        threshs_files = [ Path(f'/root/WSJ_threshs/{utterance}.csv') for utterance in utterances ]
+        audios = Psycho(PHI).filter_signals(audios, threshs_files)
+    wav_paths = []
+    for utterance, sampling_rate, audio in zip(utterances, sampling_rates, audios):
+        wav_path = out_dir.joinpath(utterance).with_suffix(".wav")
+        wavfile.write(wav_path, sampling_rate, audio)
+        wav_paths.append((utterance, wav_path))
+    return wav_paths
 
 if __name__ == "__main__":
     print(f'PREPARE TRAINING DATA')
     print(f"[+] parsed arguments")
     print(f"    -> phi     : {PHI}")
     print(f"    -> numjobs : {NUMJOBS}")
-    
+
     # first, get paths of the datasets wav lists
-    # -> for each dataset (e.g., test_dev93, train_si284, ...), 
+    # -> for each dataset (e.g., test_dev93, train_si284, ...),
     #    speech files are accessed via path stored in 'wav.scp'
     # -> skip 'local/*' as these are not further used
     data_dir = Path('data')
@@ -50,8 +128,20 @@ if __name__ == "__main__":
         dataset_data_dir.mkdir()
         entries = [ entry.strip() for entry in dataset.read_text().splitlines() if entry.strip() ]
         print(f'({len(entries)} wavs) ')
-        with Pool(NUMJOBS) as p:
-            updated_entries = [ e for e in tqdm(p.imap(process_entry, entries)) ]
+        # decoding (threads) and filtering (processes) overlap, at most MAX_IN_FLIGHT batches are pending
+        wav_paths = {}
+        with Pool(NUMJOBS) as p, tqdm(total=len(entries)) as progress:
+            pending = deque()
+            for batch in batches(entries):
+                pending.append(p.apply_async(filter_batch, (batch, dataset_data_dir)))
+                while len(pending) >= MAX_IN_FLIGHT or (pending and pending[0].ready()):
+                    converted = pending.popleft().get()
+                    wav_paths.update(converted)
+                    progress.update(len(converted))
+            for result in pending:
+                converted = result.get()
+                wav_paths.update(converted)
+                progress.update(len(converted))
         # update wav.scp
-        dataset.write_text("".join(updated_entries))
-
+        dataset.write_text("".join([ f"{utterance} {wav_paths[utterance]} \n"
+                                     for utterance in [ entry.split(' ')[0] for entry in entries ] ]))
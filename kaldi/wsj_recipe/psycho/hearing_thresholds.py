@@ -0,0 +1,332 @@
+import argparse
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import scipy.signal
+from scipy.io import wavfile
+
+#
+# NumPy port of the MPEG-1 (layer 1) psychoacoustic model that is used to
+# calculate the hearing thresholds (@ hearing_thresholds/). It reproduces
+# `calc_threshold.m` without starting the MATLAB Runtime, all 384-sample
+# blocks of an utterance are evaluated at once.
+#
+# Unless noted otherwise, spectra and tables use the 1-based indices of the
+# MATLAB implementation, i.e., column 0 is unused.
+#
+
+FFT_SHIFT   = 384
+FFT_SIZE    = 512
+FFT_OVERLAP = (FFT_SIZE - FFT_SHIFT) // 2
+N_SUBBAND   = 32
+
+NOT_EXAMINED = 0
+TONAL        = 1
+NON_TONAL    = 2
+IRRELEVANT   = 3
+
+MIN_POWER = -200
+
+# Table_absolute_threshold (layer 1, 44100Hz): frequency [Hz], critical band rate [Bark], threshold in quiet [dB]
+ABSOLUTE_THRESHOLD = [
+    (   86.13,  0.850,  25.87),  (  172.27,  1.694,  14.85),
+    (  258.40,  2.525,  10.72),  (  344.53,  3.337,   8.50),
+    (  430.66,  4.124,   7.10),  (  516.80,  4.882,   6.11),
+    (  602.93,  5.608,   5.37),  (  689.06,  6.301,   4.79),
+    (  775.20,  6.959,   4.32),  (  861.33,  7.581,   3.92),
+    (  947.46,  8.169,   3.57),  ( 1033.59,  8.723,   3.25),
+    ( 1119.73,  9.244,   2.95),  ( 1205.86,  9.734,   2.67),
+    ( 1291.99, 10.195,   2.39),  ( 1378.13, 10.629,   2.11),
+    ( 1464.26, 11.037,   1.83),  ( 1550.39, 11.421,   1.53),
+    ( 1636.52, 11.783,   1.23),  ( 1722.66, 12.125,   0.90),
+    ( 1808.79, 12.448,   0.56),  ( 1894.92, 12.753,   0.21),
+    ( 1981.05, 13.042,  -0.17),  ( 2067.19, 13.317,  -0.56),
+    ( 2153.32, 13.577,  -0.96),  ( 2239.45, 13.825,  -1.37),
+    ( 2325.59, 14.062,  -1.79),  ( 2411.72, 14.288,  -2.21),
+    ( 2497.85, 14.504,  -2.63),  ( 2583.98, 14.711,  -3.03),
+    ( 2670.12, 14.909,  -3.41),  ( 2756.25, 15.100,  -3.77),
+    ( 2842.38, 15.283,  -4.09),  ( 2928.52, 15.460,  -4.37),
+    ( 3014.65, 15.631,  -4.60),  ( 3100.78, 15.795,  -4.78),
+    ( 3186.91, 15.955,  -4.91),  ( 3273.05, 16.110,  -4.97),
+    ( 3359.18, 16.260,  -4.98),  ( 3445.31, 16.405,  -4.92),
+    ( 3531.45, 16.547,  -4.81),  ( 3617.58, 16.685,  -4.65),
+    ( 3703.71, 16.820,  -4.43),  ( 3789.84, 16.951,  -4.17),
+    ( 3875.98, 17.079,  -3.87),  ( 3962.11, 17.204,  -3.54),
+    ( 4048.24, 17.327,  -3.19),  ( 4134.38, 17.447,  -2.82),
+    ( 4306.64, 17.680,  -2.06),  ( 4478.91, 17.904,  -1.33),
+    ( 4651.17, 18.121,  -0.64),  ( 4823.44, 18.331,  -0.04),
+    ( 4995.70, 18.534,   0.47),  ( 5167.97, 18.730,   0.89),
+    ( 5340.23, 18.922,   1.23),  ( 5512.50, 19.108,   1.51),
+    ( 5684.77, 19.288,   1.74),  ( 5857.03, 19.464,   1.93),
+    ( 6029.30, 19.635,   2.11),  ( 6201.56, 19.801,   2.28),
+    ( 6373.83, 19.963,   2.45),  ( 6546.09, 20.120,   2.63),
+    ( 6718.36, 20.273,   2.82),  ( 6890.63, 20.421,   3.03),
+    ( 7062.89, 20.565,   3.25),  ( 7235.16, 20.705,   3.49),
+    ( 7407.42, 20.840,   3.74),  ( 7579.69, 20.971,   4.02),
+    ( 7751.95, 21.099,   4.32),  ( 7924.22, 21.222,   4.64),
+    ( 8096.48, 21.341,   4.98),  ( 8268.75, 21.457,   5.35),
+    ( 8613.28, 21.676,   6.15),  ( 8957.81, 21.882,   7.07),
+    ( 9302.34, 22.074,   8.10),  ( 9646.88, 22.253,   9.25),
+    ( 9991.41, 22.420,  10.54),  (10335.94, 22.575,  11.97),
+    (10680.47, 22.721,  13.56),  (11025.00, 22.857,  15.30),
+    (11369.53, 22.984,  17.23),  (11714.06, 23.102,  19.33),
+    (12058.59, 23.213,  21.64),  (12403.13, 23.317,  24.15),
+    (12747.66, 23.414,  26.88),  (13092.19, 23.506,  29.84),
+    (13436.72, 23.592,  33.05),  (13781.25, 23.673,  36.51),
+    (14125.78, 23.749,  40.24),  (14470.31, 23.821,  44.26),
+    (14814.84, 23.888,  48.58),  (15159.38, 23.952,  53.21),
+    (15503.91, 24.013,  58.17),  (15848.44, 24.070,  63.48),
+    (16192.97, 24.124,  68.00),  (16537.50, 24.176,  68.00),
+    (16882.03, 24.225,  68.00),  (17226.56, 24.271,  68.00),
+    (17571.09, 24.316,  68.00),  (17915.63, 24.358,  68.00),
+    (18260.16, 24.398,  68.00),  (18604.69, 24.436,  68.00),
+    (18949.22, 24.473,  68.00),  (19293.75, 24.508,  68.00),
+    (19638.28, 24.541,  68.00),  (19982.81, 24.573,  68.00),
+]
+
+# Table_critical_band_boundaries (layer 1, 44100Hz): rows of ABSOLUTE_THRESHOLD
+CRITICAL_BAND_BOUNDARIES = [1, 2, 3, 5, 6, 8, 9, 11, 13, 15, 17, 20, 23, 27, 32, 37, 45, 50, 55, 61, 68, 75, 81, 93, 106]
+
+
+def matlab_round(x):
+    # MATLAB rounds half away from zero, numpy half to even
+    return (np.sign(x) * np.floor(np.abs(x) + 0.5)).astype(int)
+
+@lru_cache(maxsize=None)
+def tables():
+    """
+    Returns the tables of the absolute threshold (bitrate >= 96)
+        freq:  frequency of the threshold entries
+        index: FFT index of the threshold entries
+        bark:  critical band rate of the threshold entries
+        LTq:   threshold in quiet of the threshold entries
+        Map:   FFT index -> threshold entry
+        CB:    critical band boundaries (threshold entries)
+    """
+    table = np.array(ABSOLUTE_THRESHOLD)
+    N = len(table)
+    freq, bark, LTq = np.pad(table, ((1, 0), (0, 0))).T
+    index = matlab_round(freq / 44100 * FFT_SIZE)
+    LTq = LTq - 12
+    # later assignments win, i.e., Map(index(N)) = N - 1
+    Map = np.zeros(FFT_SIZE // 2 + 1, dtype=int)
+    Map[1:index[1] + 1] = 1
+    Map[index[N]:] = N
+    for i in range(2, N):
+        Map[index[i]:index[i + 1] + 1] = i
+    CB = np.array(CRITICAL_BAND_BOUNDARIES)
+    return freq, index, bark, LTq, Map, CB
+
+
+@lru_cache(maxsize=None)
+def resampling_filter(p, q, n=10, beta=5):
+    # firls(2*n*max(p, q), [0 2*fc 2*fc 1], [1 1 0 0]) .* kaiser(L, beta) of MATLAB's `resample`.
+    # Without a transition band the least-squares design is the truncated ideal lowpass.
+    pqmax = max(p, q)
+    L = 2 * n * pqmax + 1
+    h = np.sinc((np.arange(L) - (L - 1) / 2) / pqmax) * np.kaiser(L, beta)
+    return p * h / h.sum()
+
+def resample(x, fs_in, fs_out=44100):
+    """ MATLAB's `resample(x, P, Q)` with `[P, Q] = rat(fs_out / fs_in)` """
+    gcd = np.gcd(fs_out, fs_in)
+    p, q = fs_out // gcd, fs_in // gcd
+    if p == q:
+        return x
+    h = resampling_filter(p, q)
+    Lhalf = (len(h) - 1) // 2
+    Lx, Ly = len(x), int(np.ceil(len(x) * p / q))
+    # delay the output such that downsampling by q hits the center tap of the filter
+    nz = q - Lhalf % q
+    h = np.pad(h, (nz, 0))
+    delay = (Lhalf + nz) // q
+    # pad the filter such that the output has ceil(Lx * p / q) samples
+    nz1 = 0
+    while int(np.ceil(((Lx - 1) * p + len(h) + nz1) / q)) - delay < Ly:
+        nz1 += 1
+    h = np.pad(h, (0, nz1))
+    return scipy.signal.upfirdn(h, x, p, q)[delay:delay + Ly]
+
+
+def fft_analysis(x):
+    """ FFT_Analysis of the blocks at 1:384:length(x)-384 -> [blocks, 1 + 512] """
+    num_blocks = (len(x) - FFT_SHIFT - 1) // FFT_SHIFT + 1
+    if num_blocks < 1:
+        raise ValueError('Input too short: not enough samples to compute the FFT.')
+    padded = np.zeros(FFT_OVERLAP + (num_blocks - 1) * FFT_SHIFT + FFT_SIZE)
+    samples = x[:len(padded) - FFT_OVERLAP]
+    padded[FFT_OVERLAP:FFT_OVERLAP + len(samples)] = samples
+    # (`sliding_window_view` needs numpy >= 1.20)
+    frames = np.lib.stride_tricks.as_strided(padded, shape=(num_blocks, FFT_SIZE),
+                                             strides=(padded.strides[0] * FFT_SHIFT, padded.strides[0]), writeable=False)
+    return block_spectra(frames)
+
+def block_spectra(frames):
+    """ FFT_Analysis of [blocks, 512] frames (samples n - 64, ..., n + 447 of the blocks) """
+    # MATLAB's `hanning` does not include the zero end points
+    h = np.sqrt(8 / 3) * 0.5 * (1 - np.cos(2 * np.pi * np.arange(1, FFT_SIZE + 1) / (FFT_SIZE + 1)))
+    with np.errstate(divide='ignore'):
+        X = np.maximum(20 * np.log10(np.abs(np.fft.fft(frames * h, axis=1)) / FFT_SIZE), MIN_POWER)
+    return np.pad(X, ((0, 0), (1, 0)))
+
+def find_tonal_components(X):
+    """ Find_tonal_components of all blocks """
+    _, index, bark, _, Map, CB = tables()
+    num_blocks = X.shape[0]
+    # local maxima (k = 3, ..., 250) that exceed their neighbourhood (k - j, k + j) by 7dB
+    ks = np.arange(3, 251)
+    max_j = np.select([ks < 63, ks < 127, ks < 250], [2, 3, 6], 0)
+    is_tonal = (X[:, ks] > X[:, ks - 1]) & (X[:, ks] >= X[:, ks + 1]) & (max_j > 0)
+    for j in range(2, 7):
+        is_tonal &= (max_j < j) | ((X[:, ks] - X[:, ks + j] >= 7) & (X[:, ks] - X[:, ks - j] >= 7))
+    tonal = np.zeros((num_blocks, FFT_SIZE // 2 + 1), dtype=bool)
+    tonal[:, ks] = is_tonal
+    tonal_spl = np.zeros(tonal.shape)
+    tonal_spl[:, 1:] = 10 * np.log10(10**(X[:, :-2] / 10) + 10**(X[:, 1:-1] / 10) + 10**(X[:, 2:] / 10))[:, :FFT_SIZE // 2]
+
+    # tonal components are processed in ascending order and mark (k - max_j, ..., k + max_j)
+    # as irrelevant, i.e., the flag of an index is set by the last component that covers it
+    last = np.zeros((num_blocks, FFT_SIZE // 2 + 3), dtype=int)
+    for d in range(-6, 7):
+        src = ks[max_j >= max(abs(d), 1)]
+        last[:, src + d] = np.maximum(last[:, src + d], tonal[:, src] * src)
+    flags = np.where(last > 0, IRRELEVANT, NOT_EXAMINED)
+    flags[(last > 0) & (last == np.arange(last.shape[1]))] = TONAL
+
+    # one non-tonal component per critical band
+    blocks = np.arange(num_blocks)
+    non_tonal_index = np.zeros((num_blocks, len(CB) - 1), dtype=int)
+    non_tonal_spl = np.zeros((num_blocks, len(CB) - 1))
+    for i in range(1, len(CB)):
+        lower, upper = index[CB[i - 1]], index[CB[i]]
+        band = np.arange(lower, upper)
+        examined = flags[:, band] == NOT_EXAMINED
+        power_k = np.where(examined, 10**(X[:, band] / 10), 0)
+        power = np.where(examined.any(axis=1), 10 * np.log10(10**(MIN_POWER / 10) + power_k.sum(axis=1)), MIN_POWER)
+        weight = (power_k * (bark[Map[band]] - i)).sum(axis=1)
+        flags[:, lower:upper][examined] = IRRELEVANT
+        # sic: `round(mean(lower + upper))`
+        k = np.where(power <= MIN_POWER, lower + upper,
+                     lower + matlab_round(weight / 10**(power / 10) * (upper - lower)))
+        k = np.clip(k, 1, FFT_SIZE // 2)
+        # two tonal components cannot be consecutive
+        k += flags[blocks, k] == TONAL
+        flags[blocks, k] = NON_TONAL
+        non_tonal_index[:, i - 1] = k
+        non_tonal_spl[:, i - 1] = power
+    return tonal, tonal_spl, non_tonal_index, non_tonal_spl
+
+def decimation(tonal, tonal_spl, non_tonal_index, non_tonal_spl):
+    """ Decimation of all blocks -> list of (tonal indices, non-tonal indices) """
+    _, _, bark, LTq, Map, _ = tables()
+    tonal = tonal & (tonal_spl >= LTq[Map])
+    non_tonal = non_tonal_spl >= LTq[Map[non_tonal_index]]
+    maskers = []
+    for b in range(tonal.shape[0]):
+        # tonal components within 0.5 Bark, the weaker one is removed
+        tonal_index = list(np.flatnonzero(tonal[b]))
+        i = 0
+        while i < len(tonal_index) - 1:
+            k, k_next = tonal_index[i], tonal_index[i + 1]
+            if bark[Map[k_next]] - bark[Map[k]] < 0.5:
+                del tonal_index[i if tonal_spl[b, k] < tonal_spl[b, k_next] else i + 1]
+            i += 1
+        maskers.append((np.array(tonal_index, dtype=int), non_tonal_index[b, non_tonal[b]]))
+    return maskers
+
+def masking_threshold(X, maskers):
+    """ Individual_masking_thresholds, Global_masking_threshold and Minimum_masking_threshold -> [blocks, 32] """
+    _, _, bark, LTq, Map, _ = tables()
+    num_blocks = X.shape[0]
+    # maskers of all blocks as padded [blocks, M] arrays
+    M = max(len(t) + len(n) for t, n in maskers)
+    j = np.ones((num_blocks, M), dtype=int)
+    av_offset = np.zeros((num_blocks, M))
+    av_slope = np.zeros((num_blocks, M))
+    valid = np.zeros((num_blocks, M), dtype=bool)
+    for b, (tonal_index, non_tonal_index) in enumerate(maskers):
+        t, n = len(tonal_index), len(non_tonal_index)
+        j[b, :t + n] = np.concatenate((tonal_index, non_tonal_index))
+        av_offset[b, :t + n] = [-1.525 - 4.5] * t + [-1.525 - 0.5] * n
+        av_slope[b, :t + n] = [-0.275] * t + [-0.175] * n
+        valid[b, :t + n] = True
+    Xj = np.take_along_axis(X, j, axis=1)[..., None]
+    zj = bark[Map[j]][..., None]
+    dz = bark[None, None, 1:] - zj
+    vf = np.select([dz < -1, dz < 0, dz < 1],
+                   [17 * (dz + 1) - (0.4 * Xj + 6), (0.4 * Xj + 6) * dz, -17 * dz],
+                   -(dz - 1) * (17 - 0.15 * Xj) - 17)
+    LT = np.where((dz >= -3) & (dz < 8), Xj + (av_offset + av_slope * zj[..., 0])[..., None] + vf, MIN_POWER)
+    LTg = 10 * np.log10(10**(LTq[1:] / 10) + (valid[..., None] * 10**(LT / 10)).sum(axis=1))
+    LTg = np.pad(LTg, ((0, 0), (1, 0)))
+    subband_size = FFT_SIZE // 2 // N_SUBBAND
+    return LTg[:, Map[1:]].reshape(num_blocks, N_SUBBAND, subband_size).min(axis=2)
+
+def raw_thresholds(x):
+    """ raw_thresholds (44100Hz) -> minimum masking threshold per block and subband """
+    X = fft_analysis(x)
+    X = X + 96 - X[:, 1:].max()
+    X[:, 0] = 0
+    maskers = decimation(*find_tonal_components(X))
+    return masking_threshold(X, maskers)
+
+def remap_columns(fs, win_len):
+    """ subband of each of the win_len / 2 frequency bins (as in remap_hearing_thresholds) """
+    freq, _, _, _, Map, _ = tables()
+    # subband of each frequency (1Hz resolution up to 22050Hz)
+    subband = np.full(22050 + 1, N_SUBBAND - 1)
+    bounds = np.floor(freq[Map[8::8]]).astype(int)
+    for n, (start, end) in enumerate(zip(np.concatenate(([0], bounds[:-1])), bounds)):
+        subband[start + 1:end + 1] = n
+    return subband[matlab_round(np.linspace(1, fs / 2, win_len // 2))]
+
+def remap_hearing_thresholds(LTmin_all, num_frames, fs, win_len):
+    """ remap_hearing_thresholds -> [num_frames, win_len / 2] (dB) """
+    columns = remap_columns(fs, win_len)
+    rows = matlab_round(np.linspace(1, LTmin_all.shape[0], num_frames) if num_frames > 1 else [LTmin_all.shape[0]]) - 1
+    return LTmin_all[rows][:, columns]
+
+def calculate_hearing_threshold(audio, fs, win_len, overlap):
+    """
+    calculate_hearing_threshold.m
+
+    audio: samples in [-1, 1)
+    Returns the normalized and the absolute (dB) hearing thresholds, [num_frames, win_len / 2]
+    """
+    _, _, _, LTq, _, _ = tables()
+    LTmin_all = raw_thresholds(resample(audio, fs))
+    num_frames = len(audio) // (win_len - overlap)
+    thresholds_dB = remap_hearing_thresholds(LTmin_all, num_frames, fs, win_len)
+    thresholds = (thresholds_dB - LTq[1:].min()) / (LTmin_all.max() - LTq[1:].min())
+    return thresholds, thresholds_dB
+
+def write_thresholds(out_file, thresholds):
+    """ csvwrite of the thresholds as expected by the recipe (4 frames padding, duplicated columns) """
+    thresholds = np.pad(thresholds, ((4, 4), (0, 0)), mode='edge')
+    np.savetxt(out_file, np.tile(thresholds, 2), fmt='%.5g', delimiter=',')
+
+def read_wav(wav_file):
+    fs, audio = wavfile.read(wav_file)
+    assert audio.dtype == np.int16, f'{wav_file}: expected 16-bit PCM'
+    return audio / 32768, fs
+
+def calc_threshold(wav_files, win_len, overlap, destination):
+    """ calc_threshold.m: thresholds of all utterances of a wav.scp """
+    destination.mkdir(parents=True, exist_ok=True)
+    for line in Path(wav_files).read_text().splitlines():
+        if not line.strip(): continue
+        utt_id, wav_file = line.split()[:2]
+        print(f'Calculates Hearing Thresholds for: {wav_file}')
+        thresholds, thresholds_dB = calculate_hearing_threshold(*read_wav(wav_file), win_len, overlap)
+        write_thresholds(destination.joinpath(f'{utt_id}.csv'), thresholds)
+        write_thresholds(destination.joinpath(f'{utt_id}_dB.csv'), thresholds_dB)
+
+if __name__ == "__main__":
+    # same interface as `run_calc_threshold.sh <mcr> <wav_files> <win_len> <overlap> <destination>`
+    parser = argparse.ArgumentParser()
+    parser.add_argument('wav_files', type=Path)
+    parser.add_argument('win_len', type=int)
+    parser.add_argument('overlap', type=int)
+    parser.add_argument('destination', type=Path)
+    calc_threshold(**vars(parser.parse_args()))
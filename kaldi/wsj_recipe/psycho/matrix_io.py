@@ -0,0 +1,20 @@
+import numpy as np
+import torch
+
+#
+# Matrices are exchanged with the `PytorchComponent` (@ kaldi/src/nnet2/nnet-print-csv.cc)
+# as float32 .npy files. Both directions are memory-mapped, i.e., there is
+# no text parsing and the data is not copied before it is handed to torch.
+#
+
+def load_matrix(matrix_file):
+    # copy-on-write mapping: the tensor is writable without touching the file
+    matrix = np.load(matrix_file, mmap_mode='c')
+    return torch.from_numpy(matrix)
+
+def store_matrix(matrix_file, matrix):
+    # results are written back in place, the component reads them with
+    # the shape of the original matrix
+    out = np.lib.format.open_memmap(matrix_file, mode='r+')
+    out[:] = np.asarray(matrix, dtype=np.float32).reshape(out.shape)
+    out.flush()
@@ -0,0 +1,164 @@
+import argparse
+import time
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+from scipy.io import wavfile
+
+try:
+    from . import hearing_thresholds
+except ImportError:
+    import hearing_thresholds
+
+#
+# Online version of the psychoacoustic filter (@ psycho/psycho.py) for live audio.
+#
+# Audio is consumed in hops of 256 samples (16kHz). The hearing thresholds are
+# estimated incrementally with the MPEG-1 model (@ psycho/hearing_thresholds.py):
+# each 384-sample block (44.1kHz) is analysed once as soon as its samples are
+# available. Instead of the maxima of the whole utterance, the normalization of
+# the model (96dB) and of the spectrum (m_max) use the maxima of a look-back
+# window.
+#
+# Latency: the STFT frame k covers the samples of hop k-1 and hop k, i.e., the
+# output of hop k is complete once hop k+1 has arrived. `process` returns the
+# filtered hop k-1 for the input hop k, the algorithmic latency is one hop
+# (256 samples = 16ms) plus the hop itself, in total 512 samples (32ms).
+#
+
+class OnlinePsycho:
+
+    def __init__(self, phi, lookback=1.0):
+        self.phi = phi
+        self.sampling_rate = 16000
+        self.win_length = 512
+        self.hop_length = 256
+        # torch.hamming_window (periodic)
+        self.window = 0.54 - 0.46 * np.cos(2 * np.pi * np.arange(self.win_length) / self.win_length)
+        self.envelope = self.window[:self.hop_length]**2 + self.window[self.hop_length:]**2
+        self.columns = hearing_thresholds.remap_columns(self.sampling_rate, self.win_length)
+        # look-back window of the maxima
+        self.frame_max = deque(maxlen=max(1, int(lookback * self.sampling_rate / self.hop_length)))
+        self.block_max = deque(maxlen=max(1, int(lookback * 44100 / hearing_thresholds.FFT_SHIFT)))
+        self.block_spectra = {}
+        self.next_block = 0
+        # received samples [audio_offset, audio_offset + len(audio))
+        self.audio = np.zeros(0)
+        self.audio_offset = 0
+        self.frame = 0
+        self.overlap = np.zeros(self.hop_length)
+        self.timings = deque(maxlen=100000)
+
+    def _samples(self, start, end):
+        # zeros before the first and after the last received sample
+        samples = np.zeros(end - start)
+        lo, hi = max(start, self.audio_offset), min(end, self.audio_offset + len(self.audio))
+        if lo < hi:
+            samples[lo - start:hi - start] = self.audio[lo - self.audio_offset:hi - self.audio_offset]
+        return samples
+
+    def _analyse_block(self, block):
+        # 44.1kHz samples [384 * block - 64, 384 * block + 448) of the block,
+        # resampled from a segment with 11 samples margin (filter: +-10 samples)
+        FFT_SHIFT, FFT_OVERLAP, FFT_SIZE = hearing_thresholds.FFT_SHIFT, hearing_thresholds.FFT_OVERLAP, hearing_thresholds.FFT_SIZE
+        first, last = FFT_SHIFT * block - FFT_OVERLAP, FFT_SHIFT * block - FFT_OVERLAP + FFT_SIZE
+        # segment starts at a multiple of 160 => aligned with the 44.1kHz grid
+        start = (int(np.floor(first * 160 / 441)) - 11) // 160 * 160
+        end = int(np.ceil(last * 160 / 441)) + 11
+        resampled = hearing_thresholds.resample(self._samples(start, end) / 32768, self.sampling_rate)
+        offset = start * 441 // 160
+        X = hearing_thresholds.block_spectra(resampled[None, first - offset:last - offset])
+        self.block_spectra[block] = X
+        self.block_max.append(X[0, 1:].max())
+
+    def _thresholds(self, frame):
+        # block that corresponds to the frame (cf. remap_hearing_thresholds)
+        block = frame * self.hop_length * 441 // (160 * hearing_thresholds.FFT_SHIFT)
+        while self.next_block <= block:
+            self._analyse_block(self.next_block)
+            self.next_block += 1
+        for old_block in [ b for b in self.block_spectra if b < block ]:
+            del self.block_spectra[old_block]
+        X = self.block_spectra[block] + 96 - max(self.block_max)
+        X[:, 0] = 0
+        maskers = hearing_thresholds.decimation(*hearing_thresholds.find_tonal_components(X))
+        LTmin = hearing_thresholds.masking_threshold(X, maskers)[0]
+        return LTmin[self.columns]
+
+    def _filter_frame(self, frame):
+        start = frame * self.hop_length - self.win_length // 2
+        spectrum = np.fft.rfft(self._samples(start, start + self.win_length) * self.window)
+        # magnitude without offset (a_re == 0 => 1e-20, cf. Psycho.get_magnitude)
+        a_re = np.where(spectrum.real[1:] == 0, 1e-20, spectrum.real[1:])
+        magnitude = np.sqrt(np.square(a_re) + np.square(spectrum.imag[1:]))
+        self.frame_max.append(magnitude.max())
+        if self.phi is not None:
+            S = 20 * np.log10(magnitude / max(self.frame_max))
+            H_scaled = self._thresholds(frame) - 95 + self.phi
+            spectrum[1:][S <= H_scaled] = 0
+        # overlap-add, normalized by the window envelope (as torch.istft)
+        frame_out = np.fft.irfft(spectrum, self.win_length) * self.window
+        hop_out = (self.overlap + frame_out[:self.hop_length]) / self.envelope
+        self.overlap = frame_out[self.hop_length:]
+        return hop_out
+
+    def process(self, hop):
+        """ consumes the next 256 samples (int16 range), returns the filtered previous hop """
+        assert len(hop) == self.hop_length
+        start_time = time.perf_counter()
+        self.audio = np.concatenate((self.audio, np.asarray(hop, dtype=np.float64)))
+        hop_out = self._filter_frame(self.frame)
+        self.frame += 1
+        # keep the samples that are still needed (current frame and block)
+        keep_from = min((self.frame - 1) * self.hop_length,
+                        int(hearing_thresholds.FFT_SHIFT * self.next_block * 160 / 441)) - 2 * self.win_length
+        if keep_from > self.audio_offset:
+            self.audio = self.audio[keep_from - self.audio_offset:]
+            self.audio_offset = keep_from
+        self.timings.append(time.perf_counter() - start_time)
+        # the first frame only completes samples before the signal
+        return hop_out if self.frame > 1 else np.zeros(0)
+
+    def flush(self):
+        """ returns the filtered last hop (the stream is padded with zeros) """
+        return self._filter_frame(self.frame)
+
+    def report(self):
+        """ processing time per hop vs. real-time budget of a hop (16ms) """
+        timings = np.array(self.timings) * 1000
+        budget = self.hop_length / self.sampling_rate * 1000
+        return {
+            'hops': len(timings),
+            'mean_ms': timings.mean(),
+            'p99_ms': np.percentile(timings, 99),
+            'max_ms': timings.max(),
+            'budget_ms': budget,
+            'realtime_factor': timings.mean() / budget,
+            'latency_ms': (self.win_length / self.sampling_rate) * 1000,
+        }
+
+
+def main(wav_file, phi, out_file, lookback):
+    # simulates a live stream of the wav (hop by hop) and reports the processing time
+    fs, audio = wavfile.read(wav_file)
+    assert fs == 16000
+    psycho = OnlinePsycho(phi, lookback)
+    hop_length = psycho.hop_length
+    signal_out = [ psycho.process(audio[i:i+hop_length])
+                   for i in range(0, len(audio) - hop_length + 1, hop_length) ]
+    signal_out.append(psycho.flush())
+    if out_file:
+        signal_out = np.round(np.concatenate(signal_out)).astype('int16')
+        wavfile.write(out_file, fs, signal_out)
+    print(f'[+] online filter {wav_file}')
+    for key, value in psycho.report().items():
+        print(f'    -> {key:<15}: {value:.3f}' if isinstance(value, float) else f'    -> {key:<15}: {value}')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--wav_file', type=Path, required=True)
+    parser.add_argument('--phi', type=lambda phi: None if phi == 'None' else int(phi), required=True)
+    parser.add_argument('--out_file', type=Path)
+    parser.add_argument('--lookback', type=float, default=1.0, help='look-back window in seconds')
+    main(**vars(parser.parse_args()))
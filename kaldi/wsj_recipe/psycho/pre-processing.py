@@ -15,15 +15,16 @@ import os
 PHI = int(os.environ["PHI"]) if os.environ["PHI"] != "None" else None
 NUMJOBS = int(os.environ["NUMJOBS"])
 
-def preprocess_wav(in_file):
-    if PHI is not None:
-        Psycho.calc_thresholds(in_file)
-    threshs_file = in_file.with_suffix(".csv")
-    out_file = Path(in_file)
-    in_file.rename(in_file.with_suffix('.original.wav'))
-    in_file = in_file.with_suffix('.original.wav')
-    print(f"    convert {in_file.name} into {out_file.name}")
-    Psycho(PHI).convert_wav(in_file, threshs_file, out_file)
+BATCH_SIZE = 16
+
+def preprocess_wavs(in_files):
+    out_files = [ Path(in_file) for in_file in in_files ]
+    in_files = [ in_file.with_suffix('.original.wav') for in_file in out_files ]
+    for in_file, out_file in zip(in_files, out_files):
+        out_file.rename(in_file)
+        print(f"    convert {in_file.name} into {out_file.name}")
+    # thresholds are taken from the threshold cache (same audio as the .csv)
+    Psycho(PHI).convert_wavs(in_files, [None] * len(in_files), out_files)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -35,7 +36,12 @@ if __name__ == "__main__":
     print(f"    -> phi    : {PHI}")
     print(f"    -> numjobs: {NUMJOBS}")
 
+    wav_files = sorted(data_dir.glob("*.wav"))
     # get threshs
-    with Pool(NUMJOBS // 3) as p:
-        wav_files = list(data_dir.glob("*.wav"))
-        list(p.imap_unordered(preprocess_wav, wav_files))
+    if PHI is not None:
+        Psycho.calc_thresholds_batch(wav_files, data_dir, workers=max(1, NUMJOBS // 3))
+    # convert wavs (batches of similar length => little padding)
+    wav_files = sorted(wav_files, key=lambda wav_file: wav_file.stat().st_size)
+    batches = [ wav_files[i:i+BATCH_SIZE] for i in range(0, len(wav_files), BATCH_SIZE) ]
+    with Pool(max(1, NUMJOBS // 3)) as p:
+        list(p.imap_unordered(preprocess_wavs, batches))
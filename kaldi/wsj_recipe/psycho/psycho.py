@@ -3,12 +3,20 @@ import numpy as np
 from scipy.io import wavfile
 from tempfile import TemporaryDirectory
 from subprocess import run, DEVNULL
+from multiprocessing import Pool
+from functools import partial
 import shutil
+import wave
 import torch
 import torchaudio
 import torch.nn.functional as F
 torch.set_num_threads(1)
 
+try:
+    from . import hearing_thresholds, threshold_cache
+except ImportError:
+    import hearing_thresholds, threshold_cache
+
 class Psycho:
 
     def __init__(self, phi):
@@ -18,9 +26,17 @@ class Psycho:
         self.hop_length = 256
 
     @staticmethod
-    def calc_thresholds(in_file, out_file=None):
+    def calc_thresholds(in_file, out_file=None, backend='native'):
         in_file = Path(in_file)
         if not out_file: out_file = in_file.with_suffix(".csv")
+        if backend == 'native':
+            # NumPy port of the MATLAB implementation (@ psycho/hearing_thresholds.py),
+            # shared with all other users of the same audio via the threshold cache
+            fs, audio = wavfile.read(in_file)
+            thresholds = threshold_cache.thresholds_of_audio(audio, fs)
+            hearing_thresholds.write_thresholds(out_file, np.asarray(thresholds).T[:-1])
+            return
+        assert backend == 'matlab', f'unknown backend "{backend}"'
         with TemporaryDirectory() as tmp_dir:
             # copy wav in tmp dir
             tmp_wav_file = Path(tmp_dir).joinpath(in_file.name)
@@ -33,32 +49,84 @@ class Psycho:
                 stdout=DEVNULL, stderr=DEVNULL, shell=True)
             shutil.copyfile(Path(tmp_dir).joinpath('data_dB.csv'), out_file)
 
-    def get_psycho_mask(self, complex_spectrum, threshs_file):
-        tmp_complex_spectrum  = complex_spectrum.detach().clone()
-        # Step 1: remove offset
-        offset = tmp_complex_spectrum[0,:,:]
-        features = tmp_complex_spectrum[1:,:,:]
-        # Step 2: represent as phase and magnitude
-        a_re = features[:,:,0]; a_re[torch.where(a_re == 0)] = 1e-20
-        b_im = features[:,:,1]
-        # phase
-        phase = torch.atan( b_im / a_re )
-        phase[torch.where(a_re < 0)] += np.pi
-        # magnitude
-        magnitude = torch.sqrt( torch.square(a_re) + torch.square(b_im) )
-        # Step 3: get thresholds
+    @staticmethod
+    def calc_thresholds_batch(wav_files, out_dir, workers=1, backend='native'):
+        """
+        Thresholds of many wavs (-> <out_dir>/<wav name>.csv). The list is sharded 
+        across `workers` processes that each handle their whole shard, i.e., the 
+        MATLAB backend launches the runtime once per shard. Wavs whose thresholds 
+        already exist are skipped.
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        jobs = [ (Path(wav_file), out_dir.joinpath(Path(wav_file).with_suffix('.csv').name)) 
+                 for wav_file in wav_files ]
+        jobs = [ (wav_file, out_file) for wav_file, out_file in jobs if not out_file.is_file() ]
+        if not jobs: return
+        shards = [ jobs[i::workers] for i in range(min(workers, len(jobs))) ]
+        calc_shard = partial(Psycho._calc_thresholds_shard, backend=backend)
+        if len(shards) == 1:
+            calc_shard(shards[0])
+            return
+        with Pool(len(shards)) as p:
+            list(p.imap_unordered(calc_shard, shards))
+
+    @staticmethod
+    def _calc_thresholds_shard(jobs, backend):
+        if backend == 'native':
+            for wav_file, out_file in jobs:
+                # write via tmp file s.t. interrupted runs are not skipped later on
+                tmp_file = out_file.with_suffix('.csv.tmp')
+                Psycho.calc_thresholds(wav_file, tmp_file, backend='native')
+                tmp_file.replace(out_file)
+            return
+        assert backend == 'matlab', f'unknown backend "{backend}"'
+        with TemporaryDirectory() as tmp_dir:
+            # creat wav.scp for the whole shard
+            tmp_wav_scp = Path(tmp_dir).joinpath('wav.scp')
+            tmp_wav_scp.write_text(''.join(f'utt{i} {wav_file}\n' for i, (wav_file, _) in enumerate(jobs)))
+            # get hearing threshs
+            run(f"/root/hearing_thresholds/run_calc_threshold.sh /usr/local/MATLAB/MATLAB_Runtime/v96 {tmp_wav_scp} 512 256 {tmp_dir}/", 
+                stdout=DEVNULL, stderr=DEVNULL, shell=True)
+            for i, (_, out_file) in enumerate(jobs):
+                shutil.copyfile(Path(tmp_dir).joinpath(f'utt{i}_dB.csv'), out_file)
+
+    def _load_thresholds(self, thresholds):
+        # -> csv file or [256, frames + 1] array (@ psycho/threshold_cache.py)
+        if isinstance(thresholds, (str, Path)):
+            assert Path(thresholds).is_file()
+            thresholds = threshold_cache.thresholds_of_csv(thresholds)
+        return torch.tensor(np.asarray(thresholds), dtype=torch.float32)
+
+    def _open_thresholds(self, thresholds, audio):
+        # -> memory-mapped [256, frames + 1] array, only the slices of a chunk are loaded (@ `forward_chunked`)
+        # the thresholds of long recordings have to be precomputed: .npy file or threshold cache (None)
+        if thresholds is None:
+            thresholds = threshold_cache.thresholds_of_key(threshold_cache.audio_key(audio, self.sampling_rate))
+            assert thresholds is not None, 'thresholds not in the threshold cache'
+        elif isinstance(thresholds, (str, Path)):
+            assert Path(thresholds).suffix == '.npy', 'chunked mode requires thresholds as .npy file'
+            thresholds = np.load(thresholds, mmap_mode='r')
+        return thresholds
+
+    @staticmethod
+    def get_magnitude(complex_spectrum):
+        # magnitude of the features (i.e., without offset) of [..., 257, frames, 2] spectra
+        features = complex_spectrum.detach()[...,1:,:,:]
+        a_re = features[...,0]
+        a_re = torch.where(a_re == 0, torch.full_like(a_re, 1e-20), a_re)
+        b_im = features[...,1]
+        return torch.sqrt( torch.square(a_re) + torch.square(b_im) )
+
+    def get_psycho_mask(self, complex_spectrum, thresholds, m_max=None):
+        # Step 1: magnitude (w/o offset)
+        magnitude = self.get_magnitude(complex_spectrum)
+        # Step 2: get thresholds
         assert self.phi is not None
-        # import thresholds
-        assert threshs_file.is_file()
-        # read in hearing thresholds
-        thresholds = Path(threshs_file).read_text()
-        thresholds = [row.split(',') for row in thresholds.split('\n')]
-        # remove padded frames (copies frames at end and beginning)
-        thresholds = np.array(thresholds[4:-4], dtype=float)[:,:256]
-        thresholds = torch.tensor(thresholds, dtype=torch.float32)
-        thresholds = thresholds.permute((1,0))
-        # Step 4: calc mask
-        m_max = magnitude.max()
+        thresholds = self._load_thresholds(thresholds)
+        # Step 3: calc mask
+        # -> for a chunk of frames, m_max is the maximum of the whole signal
+        if m_max is None: m_max = magnitude.max()
         S = 20*torch.log10(magnitude / m_max) # magnitude in dB
         H = thresholds - 95
         # scale with phi
@@ -71,7 +139,29 @@ class Psycho:
         mask = torch.stack((mask, mask), dim=2)
         return mask
 
-    def forward(self, signal, threshs_file):
+    def get_psycho_mask_batch(self, complex_spectra, thresholds, num_frames):
+        """
+        `get_psycho_mask` for the spectra of a zero-padded batch [B, 257, frames, 2],
+        `num_frames` are the frames of each utterance (i.e., len(thresholds[b]))
+        """
+        assert self.phi is not None
+        magnitude = self.get_magnitude(complex_spectra)
+        # scaled thresholds, frames of the padding are never masked
+        H_scaled = torch.full(magnitude.shape, -np.inf)
+        m_max = torch.ones((magnitude.shape[0], 1, 1))
+        for b, (utt_thresholds, utt_frames) in enumerate(zip(thresholds, num_frames)):
+            H_scaled[b,:,:utt_frames] = self._load_thresholds(utt_thresholds) - 95 + self.phi
+            m_max[b] = magnitude[b,:,:utt_frames].max()
+        S = 20*torch.log10(magnitude / m_max) # magnitude in dB
+        # mask 
+        mask = torch.ones(S.shape)
+        mask[torch.where(S <= H_scaled)] = 0
+        mask_offset = torch.ones((mask.shape[0], 1, mask.shape[2]))
+        mask = torch.cat((mask_offset, mask), dim=1)
+        mask = torch.stack((mask, mask), dim=3)
+        return mask
+
+    def forward(self, signal, thresholds):
 
         if self.phi is None:
             return signal
@@ -86,7 +176,7 @@ class Psycho:
                             onesided=True)
 
         # mask signal with psychoacoustic thresholds 
-        mask = self.get_psycho_mask(complex_spectrum, threshs_file)
+        mask = self.get_psycho_mask(complex_spectrum, thresholds)
         complex_spectrum_masked = complex_spectrum * mask
         
         # ifft
@@ -99,9 +189,159 @@ class Psycho:
 
         return signal_out
 
+    def _stft_chunk(self, signal, first_frame, last_frame):
+        # frames [first_frame, last_frame] of `torch.stft(signal, center=True, pad_mode='constant')`
+        start = first_frame * self.hop_length - self.win_length // 2
+        end = last_frame * self.hop_length + self.win_length // 2
+        chunk = signal[max(start, 0):max(min(end, len(signal)), 0)]
+        chunk = F.pad(torch.as_tensor(chunk), (max(-start, 0), end - start - len(chunk) - max(-start, 0)))
+        return torch.stft(chunk, 
+                          n_fft=self.win_length, 
+                          hop_length=self.hop_length, 
+                          win_length=self.win_length,
+                          window=torch.hamming_window(self.win_length), 
+                          center=False,
+                          onesided=True)
+
+    def forward_chunked(self, signal, thresholds, chunk_frames=1024):
+        """
+        `forward` with bounded memory for long recordings, yields the filtered signal
+        in chunks of `chunk_frames * hop_length` samples (thresholds: [256, frames + 1]
+        array, e.g., memory-mapped, cf. `_open_thresholds`).
+
+        The signal is processed in chunks of STFT frames (overlap-add of the frames
+        that overlap a chunk, i.e., one frame of context) with the matching slice of
+        the thresholds. A first pass only determines the maximum magnitude of the
+        whole signal. The concatenated output is identical to `forward`.
+        """
+
+        if self.phi is None:
+            for i in range(0, len(signal), chunk_frames * self.hop_length):
+                yield signal[i:i + chunk_frames * self.hop_length]
+            return
+
+        last_frame = len(signal) // self.hop_length
+
+        # first pass: maximum magnitude (of all frames)
+        m_max = torch.tensor(0.)
+        for first in range(0, last_frame + 1, chunk_frames):
+            last = min(first + chunk_frames - 1, last_frame)
+            m_max = torch.max(m_max, self.get_magnitude(self._stft_chunk(signal, first, last)).max())
+
+        # second pass: output samples [first * hop_length, last * hop_length) 
+        # are the overlap-add of frames first, ..., last
+        for first in range(0, last_frame, chunk_frames):
+            last = min(first + chunk_frames, last_frame)
+            complex_spectrum = self._stft_chunk(signal, first, last)
+            mask = self.get_psycho_mask(complex_spectrum, thresholds[:,first:last+1], m_max)
+            signal_out = torch.istft(complex_spectrum * mask,
+                        n_fft=self.win_length, 
+                        hop_length=self.hop_length, 
+                        win_length=self.win_length,
+                        window=torch.hamming_window(self.win_length), 
+                        center=False,
+                        onesided=True)
+            yield signal_out[self.win_length // 2:-(self.win_length // 2)]
+
+    def forward_batch(self, signals, lengths, thresholds):
+        """
+        `forward` for many utterances at once
+            signals:    zero-padded batch [B, T]
+            lengths:    samples of each utterance
+            thresholds: thresholds of each utterance (cf. `forward`)
+        Returns the list of filtered signals (same lengths as `forward`)
+        """
+
+        if self.phi is None:
+            return [ signal[:length] for signal, length in zip(signals, lengths) ]
+
+        # fft (constant padding => the frames of an utterance do not depend on the padding)
+        complex_spectra = torch.stft(signals, 
+                            n_fft=self.win_length, 
+                            hop_length=self.hop_length, 
+                            win_length=self.win_length,
+                            window=torch.hamming_window(self.win_length), 
+                            pad_mode='constant', 
+                            onesided=True)
+
+        # mask signals with psychoacoustic thresholds 
+        num_frames = [ length // self.hop_length + 1 for length in lengths ]
+        mask = self.get_psycho_mask_batch(complex_spectra, thresholds, num_frames)
+        complex_spectra_masked = complex_spectra * mask
+
+        # ifft
+        signals_out = torch.istft(complex_spectra_masked,
+                    n_fft=self.win_length, 
+                    hop_length=self.hop_length, 
+                    win_length=self.win_length,
+                    window=torch.hamming_window(self.win_length), 
+                    onesided=True)
+
+        # => `forward` returns (frames - 1) * hop_length samples
+        return [ signal_out[:(frames - 1) * self.hop_length] for signal_out, frames in zip(signals_out, num_frames) ]
+
+    def _thresholds_of_wav(self, in_file):
+        # thresholds of the (int16) audio via the threshold cache
+        fs, audio = wavfile.read(in_file)
+        return threshold_cache.thresholds_of_audio(audio, fs)
+
     def convert_wav(self, in_file, threshs_file, out_file, device='cpu'):
         torch_signal, torch_sampling_rate = torchaudio.load(in_file)
         torch_signal = (torch.round(torch_signal*32767)).squeeze().to(device)
-        signal_out = self.forward(torch_signal, threshs_file)
+        thresholds = threshs_file
+        if threshs_file is None and self.phi is not None:
+            thresholds = self._thresholds_of_wav(in_file)
+        signal_out = self.forward(torch_signal, thresholds)
         signal_out = torch.round(signal_out).cpu().detach().numpy().astype('int16')
         wavfile.write(out_file, self.sampling_rate, signal_out)
+
+    def convert_wav_chunked(self, in_file, threshs_file, out_file, chunk_frames=1024):
+        """
+        `convert_wav` for long recordings (memory-mapped input and thresholds, output is written chunk by chunk)
+        threshs_file: precomputed thresholds as .npy file, None => threshold cache
+        """
+        fs, audio = wavfile.read(in_file, mmap=True)
+        thresholds = threshs_file
+        if self.phi is not None:
+            thresholds = self._open_thresholds(threshs_file, audio)
+        # same values as `convert_wav` (torchaudio normalizes by 32768)
+        signal = _ScaledSignal(audio)
+        with wave.open(str(out_file), 'wb') as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(self.sampling_rate)
+            for signal_out in self.forward_chunked(signal, thresholds, chunk_frames):
+                out.writeframes(torch.round(signal_out).detach().numpy().astype('<i2').tobytes())
+
+    def convert_wavs(self, in_files, threshs_files, out_files, device='cpu'):
+        """ batched `convert_wav` (threshs_files: csv files, None => threshold cache) """
+        audios = [ wavfile.read(in_file)[1] for in_file in in_files ]
+        for signal_out, out_file in zip(self.filter_signals(audios, threshs_files, device), out_files):
+            wavfile.write(out_file, self.sampling_rate, signal_out)
+
+    def filter_signals(self, audios, thresholds, device='cpu'):
+        """ `convert_wavs` in memory: int16 arrays -> filtered int16 arrays (thresholds: cf. `forward`, None => threshold cache) """
+        # same values as `torchaudio.load` (normalizes by 32768)
+        signals = [ torch.round(torch.from_numpy(np.asarray(audio, dtype=np.float32)) / 32768 * 32767) for audio in audios ]
+        thresholds = [ threshold_cache.thresholds_of_audio(audio, self.sampling_rate) if utt_thresholds is None and self.phi is not None
+                       else utt_thresholds for audio, utt_thresholds in zip(audios, thresholds) ]
+        lengths = [ len(signal) for signal in signals ]
+        batch = torch.zeros((len(signals), max(lengths)))
+        for b, signal in enumerate(signals):
+            batch[b,:len(signal)] = signal
+        signals_out = self.forward_batch(batch.to(device), lengths, thresholds)
+        return [ torch.round(signal_out).cpu().detach().numpy().astype('int16') for signal_out in signals_out ]
+
+
+class _ScaledSignal:
+    # lazily converted int16 audio, `torch.round(torchaudio.load(...)[0]*32767)` for slices
+
+    def __init__(self, audio):
+        self.audio = audio
+
+    def __len__(self):
+        return len(self.audio)
+
+    def __getitem__(self, index):
+        chunk = torch.from_numpy(np.asarray(self.audio[index], dtype=np.float32)) / 32768
+        return torch.round(chunk*32767)
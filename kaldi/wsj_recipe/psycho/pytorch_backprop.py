@@ -12,7 +12,9 @@ import numpy as np
 import torch
 torch.set_num_threads(1)
 
+from matrix_io import load_matrix, store_matrix
 from psycho import Psycho
+import threshold_cache
 
 KALDI_BASE = Path('/root/kaldi/wsj_recipe')
 THRESHS_TMP = KALDI_BASE.joinpath('exp/threshs_tmp')
@@ -45,35 +47,35 @@ def main(data_in_file, data_out_file, grad_file, threshs_file_id):
     #                 Path(f'/root/experiment/{threshs_file_id}_threshs.csv'))
     # time.sleep(1000)
 
-    data_in = np.genfromtxt(data_in_file, delimiter=',')
+    data_in = load_matrix(data_in_file)
     data_dim = data_in.shape  
     data_in = data_in.reshape(-1)
-    data_in = torch.Tensor(data_in)
 
-    gradient_in = np.genfromtxt(grad_file, delimiter=',')
+    gradient_in = load_matrix(grad_file)
     gradient_in_shape = gradient_in.shape
     gradient_in = gradient_in.reshape(-1)
-    gradient_in = torch.Tensor(gradient_in)
     log_signal_data("GRADIENT IN", gradient_in)
 
-    data_out = np.genfromtxt(data_out_file, delimiter=',')
+    data_out = load_matrix(data_out_file)
     data_out = data_out.reshape(-1)
-    data_out = torch.Tensor(data_out)
     log_signal_data("DATA OUT", data_out)
 
     if  PHI is None:
         gradient_out = gradient_in.reshape(gradient_in_shape)
 
     else:
-        threshs_file = THRESHS_TMP.joinpath(f'threshs_id.{threshs_file_id}.csv')
+        # thresholds of the first propagation of this job (@ pytorch_propagate.py)
+        key_file = THRESHS_TMP.joinpath(f'threshs_id.{threshs_file_id}.key')
+        thresholds = threshold_cache.thresholds_of_key(key_file.read_text().strip())
+        assert thresholds is not None, f'no cached thresholds for {key_file}'
         data_in.requires_grad = True
-        signal_out = Psycho(PHI).forward(data_in, threshs_file)
+        signal_out = Psycho(PHI).forward(data_in, thresholds)
         signal_out.backward(gradient_in)
         log_signal_data("SIGNAL OUT", signal_out)
         gradient_out = data_in.grad.reshape(gradient_in_shape)
 
     log_signal_data("GRADIENT OUT", gradient_out)
-    np.savetxt(grad_file, gradient_out, delimiter=',')
+    store_matrix(grad_file, gradient_out.detach().numpy())
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -7,13 +7,13 @@ os.environ["VECLIB_MAXIMUM_THREADS"] = "1"
 os.environ["NUMEXPR_NUM_THREADS"] = "1"
 import argparse
 from pathlib import Path
-from tempfile import mkstemp
 
 import numpy as np
 import torch
-from scipy.io import wavfile
 
+from matrix_io import load_matrix, store_matrix
 from psycho import Psycho
+import threshold_cache
 
 KALDI_BASE = Path('/root/kaldi/wsj_recipe')
 THRESHS_TMP = KALDI_BASE.joinpath('exp/threshs_tmp')
@@ -37,30 +37,31 @@ def main(data_file, threshs_file_id):
     print(f'    -> data file      : {data_file}')
     
     # load data 
-    data = np.genfromtxt(data_file, delimiter=',')
+    data = load_matrix(data_file)
     data_dim = data.shape
     data = data.reshape(-1)
-    data = torch.Tensor(data)
     log_signal_data('DATA IN', data)
     
     # pre-process
-    threshs_file = THRESHS_TMP.joinpath(f'threshs_id.{threshs_file_id}.csv')
-    if PHI is not None and not threshs_file.is_file():
-        fd_tmp_in, tmp_in = mkstemp()
-        input_signal_int16 = np.int16(np.round(data))
-        wavfile.write(tmp_in, 16000, input_signal_int16)
-        Psycho.calc_thresholds(tmp_in, out_file=threshs_file)
-        os.close(fd_tmp_in)
-        os.remove(tmp_in)
+    # -> the thresholds of a job are fixed by its first propagation,
+    #    the job only remembers the key of the audio in the threshold cache
+    thresholds = None
+    key_file = THRESHS_TMP.joinpath(f'threshs_id.{threshs_file_id}.key')
+    if PHI is not None and key_file.is_file():
+        thresholds = threshold_cache.thresholds_of_key(key_file.read_text().strip())
+    if PHI is not None and thresholds is None:
+        input_signal_int16 = np.int16(np.round(data.numpy()))
+        thresholds = threshold_cache.thresholds_of_audio(input_signal_int16)
+        key_file.write_text(threshold_cache.audio_key(input_signal_int16))
 
     # apply psychoacoustic thresholds
-    signal_out = Psycho(PHI).forward(data, threshs_file)
+    signal_out = Psycho(PHI).forward(data, thresholds)
     log_signal_data('DATA OUT', signal_out)
 
     # dump back to data file
     signal_out = signal_out.detach().numpy()
     signal_out = signal_out.reshape(data_dim)
-    np.savetxt(data_file, signal_out, delimiter=',')
+    store_matrix(data_file, signal_out)
     
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
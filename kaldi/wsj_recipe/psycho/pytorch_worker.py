@@ -0,0 +1,80 @@
+import os
+os.environ["OMP_NUM_THREADS"] = "1"
+os.environ["OPENBLAS_NUM_THREADS"] = "1"
+os.environ["MKL_NUM_THREADS"] = "1"
+os.environ["VECLIB_MAXIMUM_THREADS"] = "1"
+os.environ["NUMEXPR_NUM_THREADS"] = "1"
+import argparse
+import socket
+import sys
+import traceback
+from pathlib import Path
+
+import torch
+torch.set_num_threads(1)
+
+from pytorch_backprop import main as backprop
+from pytorch_propagate import main as propagate
+
+#
+# Long-lived counterpart of `pytorch_propagate.py` and `pytorch_backprop.py`.
+#
+# The `PytorchComponent` (@ kaldi/src/nnet2/nnet-component.cc) starts one worker
+# per `nnet-spoof-iter` job and sends its requests over a unix socket, i.e.,
+# python and torch are only loaded once per job.
+#
+# Protocol (one request per line, one response per line)
+#   propagate <data_file>                              -> ok | error <msg>
+#   backprop <data_in_file> <data_out_file> <grad_file> -> ok | error <msg>
+#
+# The worker terminates as soon as the component closes the connection.
+#
+
+def handle_request(request, threshs_file_id):
+    cmd, *args = request.split()
+    if cmd == 'propagate' and len(args) == 1:
+        propagate(Path(args[0]), threshs_file_id)
+    elif cmd == 'backprop' and len(args) == 3:
+        backprop(Path(args[0]), Path(args[1]), Path(args[2]), threshs_file_id)
+    else:
+        raise ValueError(f'unknown request "{request}"')
+
+def serve(connection, threshs_file_id):
+    with connection, connection.makefile('r') as requests:
+        for request in requests:
+            try:
+                handle_request(request.strip(), threshs_file_id)
+                response = 'ok'
+            except Exception as e:
+                traceback.print_exc()
+                response = f'error {type(e).__name__}: {e}'.replace('\n', ' ')
+            sys.stdout.flush()
+            connection.sendall(f'{response}\n'.encode())
+
+def main(socket_file, threshs_file_id, timeout):
+    print(f'[+] pytorch worker')
+    print(f"    -> threshs_file_id: {threshs_file_id}")
+    print(f'    -> socket         : {socket_file}')
+    sys.stdout.flush()
+
+    if socket_file.exists(): socket_file.unlink()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(str(socket_file))
+        server.listen(1)
+        # do not outlive the component if it never connects
+        server.settimeout(timeout)
+        try:
+            connection, _ = server.accept()
+            connection.settimeout(None)
+            serve(connection, threshs_file_id)
+        except socket.timeout:
+            print(f'[!] no connection after {timeout}s')
+        finally:
+            socket_file.unlink()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket_file', type=Path, required=True)
+    parser.add_argument('--threshs_file_id', type=int, required=True)
+    parser.add_argument('--timeout', type=int, default=600)
+    main(**vars(parser.parse_args()))
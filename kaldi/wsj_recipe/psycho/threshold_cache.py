@@ -0,0 +1,79 @@
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from . import hearing_thresholds
+except ImportError:
+    import hearing_thresholds
+
+#
+# Content-addressed cache for the hearing thresholds (dB).
+#
+# Thresholds are keyed by a hash of the int16 audio and stored as float32 .npy
+# files that are ready to use for `Psycho.get_psycho_mask`, i.e., without the
+# padded frames and with shape [win_length / 2, frames + 1]. The cache
+# directory is shared by all experiments (@ src/kaldi.py), files are
+# loaded memory-mapped and the most recent ones are kept in memory.
+#
+
+CACHE_DIR = Path(os.environ.get('THRESHS_CACHE', '/root/threshs_cache'))
+LRU_SIZE = 64
+
+_lru = OrderedDict()
+
+def _lru_get(key, load):
+    if key in _lru:
+        _lru.move_to_end(key)
+        return _lru[key]
+    thresholds = _lru[key] = load()
+    if len(_lru) > LRU_SIZE:
+        _lru.popitem(last=False)
+    return thresholds
+
+def audio_key(audio, sampling_rate=16000, win_length=512, hop_length=256, block_size=1 << 20):
+    key = hashlib.sha1(f'{sampling_rate}/{win_length}/{hop_length}/'.encode())
+    # hashed block by block => no copy of (memory-mapped) long recordings
+    for i in range(0, len(audio), block_size):
+        key.update(np.ascontiguousarray(audio[i:i+block_size], dtype=np.int16).tobytes())
+    return key.hexdigest()
+
+def _ready_to_use(rows):
+    # one row per STFT frame (frames + first padded frame at the end),
+    # only the first half of the (duplicated) columns
+    thresholds = rows[:, :256]
+    return np.ascontiguousarray(thresholds.T, dtype=np.float32)
+
+def thresholds_of_key(key):
+    """ cached thresholds of the audio with the given key (None if not cached) """
+    cache_file = CACHE_DIR.joinpath(f'{key}.npy')
+    if key not in _lru and not cache_file.is_file():
+        return None
+    return _lru_get(key, lambda: np.load(cache_file, mmap_mode='r'))
+
+def thresholds_of_audio(audio, sampling_rate=16000):
+    """ thresholds (dB) of int16 audio -> [256, frames + 1] """
+    key = audio_key(audio, sampling_rate)
+    thresholds = thresholds_of_key(key)
+    if thresholds is not None:
+        return thresholds
+    _, thresholds_dB = hearing_thresholds.calculate_hearing_threshold(
+        np.asarray(audio, dtype=np.int16) / 32768, sampling_rate, 512, 256)
+    thresholds = _ready_to_use(np.concatenate((thresholds_dB, thresholds_dB[-1:])))
+    # concurrent jobs may compute the same thresholds => atomic replace
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_file = CACHE_DIR.joinpath(f'{key}.{os.getpid()}.tmp.npy')
+    np.save(tmp_file, thresholds)
+    tmp_file.replace(CACHE_DIR.joinpath(f'{key}.npy'))
+    return _lru_get(key, lambda: thresholds)
+
+def thresholds_of_csv(threshs_file):
+    """ thresholds (dB) of a csv written by `calc_threshold` -> [256, frames + 1] """
+    stat = Path(threshs_file).stat()
+    key = (str(threshs_file), stat.st_mtime_ns, stat.st_size)
+    # remove padded frames (copies frames at end and beginning) except for the first one at the end
+    return _lru_get(key, lambda: _ready_to_use(
+        np.loadtxt(threshs_file, delimiter=',', dtype=np.float32, ndmin=2)[4:-3]))
@@ -198,7 +198,7 @@ find $datasp -name "wa" -delete
 
 python "steps/nnet2/adversarial/init_target.py" $experiment $nj $rdir $num_states
 
-find $dir -name "adversarial.csv" -delete
+find $dir -name "adversarial.npy" -delete
 rm -f "$dir/scoring_kaldi/wer_details/utt_itr"
 
 for i in `seq 1 $maxitr`; 
@@ -207,6 +207,20 @@ do
   # echo "$dir/scoring_kaldi/wer_details/utt_itr"
   echo "-> Iteration $i of $maxitr"
 
+  # only utterances that are not yet successful (@ find_all_correct.py) are optimized and decoded
+  awk '{print $1}' "$dir/scoring_kaldi/wer_details/utt_itr" 2>/dev/null | sort -u > $dir/utt_done
+  awk '{print $1}' $data/wav.scp | sort -u | comm -23 - $dir/utt_done > $dir/utt_todo
+  num_todo=$(wc -l < $dir/utt_todo)
+  if [ $num_todo -eq 0 ]; then
+    echo "-> all utterances successful"
+    break
+  fi
+  nj_todo=$(( $nj < $num_todo ? $nj : $num_todo ))
+  echo "-> $num_todo utterances left"
+  todo_data=data/adversarial_${experiment}_todo
+  rm -rf $todo_data
+  utils/subset_data_dir.sh --utt-list $dir/utt_todo data/adversarial_$experiment $todo_data || exit 1;
+
   if [ $stage -le 1 ]; then
     #mkdir -p "$dir/utterances"
 
@@ -256,25 +270,32 @@ do
     fi
   fi
 
-  # synthesize audio
+  # synthesize audio (successful utterances are unchanged)
   mkdir -p adversarial_examples/wavs
-  python steps/nnet2/adversarial/synthesize.py adversarial_examples/wavs ${net_dir}/adversarial_${experiment}/utterances/ data/${experiment}/wav.scp 16000 256 || exit 1;
+  python steps/nnet2/adversarial/synthesize.py adversarial_examples/wavs ${net_dir}/adversarial_${experiment}/utterances/ data/${experiment}/wav.scp 16000 256 --utt_list $dir/utt_todo || exit 1;
 
   if [ $attacker_type == "adaptive" ]; then
     # in case of the adaptive attacker, 
     # apply pre-processing prior to decoding
-    python3 psycho/pre-processing.py --encoding_dir adversarial_examples/wavs || exit 1;
+    # -> on copies, as pre-processing is lossy and not idempotent
+    rm -rf adversarial_examples/wavs_preprocessed
+    mkdir -p adversarial_examples/wavs_preprocessed
+    awk '{print $2}' $todo_data/wav.scp | xargs -I{} cp {} adversarial_examples/wavs_preprocessed/ || exit 1;
+    sed -i 's#adversarial_examples/wavs/#adversarial_examples/wavs_preprocessed/#' $todo_data/wav.scp
+    python3 psycho/pre-processing.py --encoding_dir adversarial_examples/wavs_preprocessed || exit 1;
     # remove hearing threshs
     rm -rf exp/threshs_tmp
   fi;
 
   # feature extraction
-  steps/make_time.sh --cmd "$train_cmd" --nj $nj data/adversarial_$experiment || exit 1;
-  steps/compute_cmvn_stats.sh data/adversarial_$experiment || exit 1;
+  steps/make_time.sh --cmd "$train_cmd" --nj $nj_todo $todo_data || exit 1;
+  steps/compute_cmvn_stats.sh $todo_data || exit 1;
 
   # decode adversarial examples
-  steps/nnet2/decode.sh --cmd "$decode_cmd" --nj $nj \
-    exp/tri4b/graph_bd_tgpr data/adversarial_$experiment ${net_dir}/decode_adversarial_$experiment
+  # -> scoring reads all lattices of the decode dir
+  rm -rf ${net_dir}/decode_adversarial_$experiment
+  steps/nnet2/decode.sh --cmd "$decode_cmd" --nj $nj_todo \
+    exp/tri4b/graph_bd_tgpr $todo_data ${net_dir}/decode_adversarial_$experiment
 
   python "steps/nnet2/adversarial/find_all_correct.py" adversarial_$experiment $experiment $i $rdir
 
@@ -283,15 +304,9 @@ do
   # reset log lcamp
   export LOG_CLAMP=$SAVED_LOG_CLAMP;
 
-  if [ $attacker_type == "adaptive" ]; then
-    # synthesize again, as pre-processing is lossy and not idempotent
-    rm -rf adversarial_examples/wavs 
-    mkdir -p adversarial_examples/wavs
-    python steps/nnet2/adversarial/synthesize.py adversarial_examples/wavs ${net_dir}/adversarial_${experiment}/utterances/ data/${experiment}/wav.scp 16000 256 || exit 1;
-  fi;
-
-
 done
 
+rm -rf adversarial_examples/wavs_preprocessed data/adversarial_${experiment}_todo
+
 
 exit 0;
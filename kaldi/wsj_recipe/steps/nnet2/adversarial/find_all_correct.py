@@ -23,14 +23,17 @@ def main():
     result_dir = root_dir + "exp/" + dir_name +"/decode_" + data_name + "/scoring_kaldi/wer_details/per_utt"
     itr_dir = root_dir + "exp/" + dir_name + "/adversarial_" + target_dir + "/scoring_kaldi/wer_details/utt_itr"
 
-    utt = []
+    utt = set()
     if os.path.isfile(itr_dir):
         with open(itr_dir) as f:
             for line in f:
                 line = line.split()
-                utt.append(line[0])
+                utt.add(line[0])
 
 
+    # correct, substitutions, insertions, deletions of the decoded utterances
+    csid = [0, 0, 0, 0]
+    decoded = set()
     with open(itr_dir, "a") as write_f:
 
         with open(result_dir) as f:
@@ -38,6 +41,8 @@ def main():
                 line = line.split()
 
                 if line[1] == "#csid":
+                    decoded.add(line[0])
+                    csid = [n + int(x) for n, x in zip(csid, line[2:6])]
                     if int(line[3]) == 0 and int(line[4]) == 0 and int(line[5]) == 0:
                         if not line[0] in utt:
                             write_f.write("{} {}\n".format(line[0], str(itr)))
@@ -45,7 +50,23 @@ def main():
     best_wer_file = Path(root_dir, "exp", dir_name, "decode_" + data_name, "scoring_kaldi", "best_wer").as_posix()
     with open(best_wer_file) as f:
         best_wer = f.readline().strip()
-        print("[+] %s" % best_wer)
+
+    # successful utterances of previous iterations are not decoded again (@ adversarial_mt.sh)
+    # => overall WER counts them as correct
+    skipped = utt - decoded
+    if skipped:
+        text_file = Path(root_dir, "data", data_name, "text").as_posix()
+        with open(text_file) as f:
+            for line in f:
+                line = line.split()
+                if line and line[0] in skipped:
+                    csid[0] += len(line) - 1
+        c, s, i, d = csid
+        errors = s + i + d
+        total = c + s + d
+        best_wer = "%WER {:.2f} [ {} / {}, {} ins, {} del, {} sub ] {}".format(
+            100.0 * errors / max(total, 1), errors, total, i, d, s, best_wer.split("]", 1)[-1].strip())
+    print("[+] %s" % best_wer)
 
     results_file = Path(root_dir, "exp", dir_name, data_name + '_wer.json').as_posix()
     if os.path.exists(results_file):
@@ -1,24 +1,49 @@
 import argparse
-import csv
 import os
-import shutil
-import subprocess
 from functools import partial
-from multiprocessing import Pool, TimeoutError
-from pathlib import Path
+from multiprocessing import Pool, cpu_count
 
 import numpy as np
 from scipy.io import wavfile
 
 
+def synthesize(job, adversarialdir, fs, winlen):
+    id, audiofile = job
+    in_file = os.path.join(adversarialdir, id, 'adversarial.npy')
+    out_file = audiofile + '.wav'
+    # the signal did not change since the last synthesis
+    if os.path.exists(out_file) and os.path.getmtime(out_file) >= os.path.getmtime(in_file):
+        return '[+] Unchanged  {}'.format(out_file)
+
+    # float32 [frames, winlen] written by nnet-spoof-iter
+    utterance = np.load(in_file, mmap_mode='r')
+    if utterance.ndim != 2 or utterance.shape[1] != winlen:
+        raise Exception('Wrong Shape for utterance: ' + in_file)
+    audio_flat = np.int16(np.round(utterance.reshape(-1)))
+
+    if os.path.exists(out_file):
+        _, audio_old = wavfile.read(out_file, mmap=True)
+        if np.array_equal(audio_old, audio_flat):
+            os.utime(out_file, None)
+            return '[+] Unchanged  {}'.format(out_file)
+    # write to a tmp file: other jobs may read the wav in the meantime
+    # (python 2, cf. adversarial_mt.sh => os.rename, which is atomic as well)
+    tmp_file = '{}.{}.tmp'.format(out_file, os.getpid())
+    wavfile.write(tmp_file, fs, audio_flat)
+    os.rename(tmp_file, out_file)
+    return '[+] Synthesize {}'.format(out_file)
+
+
 def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument('destdir', type=str, help='audiofile destination dir')
-    parser.add_argument('adversarialdir', type=str, help='adversarial .csv dir')
+    parser.add_argument('adversarialdir', type=str, help='adversarial .npy dir')
     parser.add_argument('datadir', type=str, help='data/folder to read wav.scp')
     parser.add_argument('fs', type=int, help='sampling frequency')
     parser.add_argument('winlen', type=int, help='sampling frequency')
+    parser.add_argument('--utt_list', type=str, help='only synthesize these utterances (one id per line)')
+    parser.add_argument('--workers', type=int, default=cpu_count(), help='number of parallel workers')
     args = parser.parse_args()
 
     destdir = args.destdir
@@ -38,18 +63,21 @@ def main():
             line = os.path.basename(line[1])
             audiofile.append(line.split('.')[0])
 
-    # read in .csv of each utternce, reshape and save as audio file
-    for i, id in enumerate(utt_id):
-        with open(os.path.join(adversarialdir, id, 'adversarial.csv'), 'r') as csvfile:
-            utterance = np.asarray(list(csv.reader(csvfile)))[:,:-1]
-            utterance = np.round(np.float32(utterance))
-            if utterance.shape[1] != winlen:
-                raise Exception('Wrong Shape for utterance: ' + os.path.join(adversarialdir, id, 'adversarial.csv'))
-
-            audio_flat = np.reshape(utterance, -1)
-            out_file = os.path.join(destdir, audiofile[i] + '.wav')
-            print('[+] Synthesize ' + out_file)
-            wavfile.write(out_file, fs, np.int16(audio_flat))
+    if args.utt_list:
+        with open(args.utt_list, 'r') as f:
+            utt_list = set(line.strip() for line in f if line.strip())
+    else:
+        utt_list = set(utt_id)
+
+    # read in .npy of each utterance, reshape and save as audio file
+    jobs = [ (id, os.path.join(destdir, audiofile[i])) for i, id in enumerate(utt_id) if id in utt_list ]
+    pool = Pool(max(1, min(args.workers, len(jobs))))
+    try:
+        for msg in pool.imap_unordered(partial(synthesize, adversarialdir=adversarialdir, fs=fs, winlen=winlen), jobs):
+            print(msg)
+    finally:
+        pool.close()
+        pool.join()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,9 +1,10 @@
 import argparse
+import csv
 import json
+import random
 import shutil
 import time
-from functools import partial
-from multiprocessing import Pool, cpu_count
+from multiprocessing import cpu_count
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
@@ -11,22 +12,25 @@ import numpy as np
 import pydng
 
 from datasets import Dataset
-from kaldi import Kaldi
+from kaldi import THRESHS_CACHE, Kaldi
 from kaldi_utils import KaldiLogger, parse_results_file
+from nmr import nmr_table
 from select_models import select_model
-from snr import snrseg
-from utils import plot_stats
+from snr import snrseg_table
+from utils import plot_stats_batch
 
 BASE_DIR = Path.home().joinpath('dompteur')
 
-def main(models, experiments, dataset_dir, inner_itr, max_itr, learning_rate, psycho_hiding_thresh, phi, low, high, attacker):
+def main(models, experiments, dataset_dir, inner_itr, max_itr, learning_rate, psycho_hiding_thresh, phi, low, high, attacker,
+         numjobs=None, dataset=None, inital_wer=None, plot_samples=None, quiet=False):
     # create kaldi instance
     model_dir = select_model(models, phi, low, high)
     kaldi = Kaldi.from_trained_model(model_dir=model_dir,
                                      base_dir=experiments.joinpath(f'{time.strftime("%Y-%m-%d")}_{pydng.generate_name()}'))
 
     # prepare dataset
-    dataset = Dataset(dataset_dir)
+    dataset = dataset if dataset else Dataset(dataset_dir)
+    numjobs = min(len(dataset), numjobs) if numjobs else len(dataset)
     kaldi_dataset_dir = kaldi.base_dir.joinpath("data", dataset.name)
     dataset.dump_as_kaldi_dataset(kaldi_dataset_dir, wavs_prefix=f'data/{dataset.name}')
 
@@ -53,8 +57,9 @@ def main(models, experiments, dataset_dir, inner_itr, max_itr, learning_rate, ps
         'max_outer_itr' : max_outer_itr
     }
 
-    # decode
-    wer, _ = kaldi.decode_wavs(data_dir=dataset.data_dir, text=dataset.target)
+    # decode (unless the WER is already known for this model, e.g., @ sweep.py)
+    wer = inital_wer if inital_wer is not None else \
+          kaldi.decode_wavs(data_dir=dataset.data_dir, text=dataset.target, numjobs=numjobs)[0]
     print(f'    -> inital WER: {wer:03.2f}%')
     kaldi.results['inital_wer'] = f'{wer:03.2f}%'
 
@@ -65,13 +70,13 @@ def main(models, experiments, dataset_dir, inner_itr, max_itr, learning_rate, ps
 
     # invoke adversarial examples script
     logger = KaldiLogger(kaldi.base_dir)
-    logger.log_ae(inner_itr, max_outer_itr)
+    logger.log_ae(inner_itr, max_outer_itr, quiet=quiet)
     try:
         running_time = kaldi.run_in_container(
             f'./compute_adversarial_examples.sh {dataset} {psycho_hiding_thresh} {inner_itr} '
-            f'{max_outer_itr} {len(dataset)} {len(dataset)} {attacker}',
+            f'{max_outer_itr} {numjobs} {numjobs} {attacker}',
             additional_cmds=[f'-v {kaldi_dataset_dir.joinpath("target_utterances")}:/root/kaldi/wsj_recipe/targets',
-                             f'-e NUMJOBS={len(dataset)}',  
+                             f'-e NUMJOBS={numjobs}',  
                              f'-e PHI={phi} -e LOG_CLAMP={log_clamp} -e LEARNING_RATE={learning_rate}']
         )
         logger.stop()
@@ -89,10 +94,13 @@ def main(models, experiments, dataset_dir, inner_itr, max_itr, learning_rate, ps
               stats_dir=kaldi.base_dir.joinpath(f"adversarial_examples/stats"),
               original_text=dataset.text,
               target_text=dataset.target,
-              phi=phi)
+              phi=phi,
+              numjobs=numjobs,
+              plot_samples=plot_samples)
+    return kaldi
 
 
-def score_AEs(kaldi, ae_dir, ref_dir, stats_dir, original_text, target_text, phi):
+def score_AEs(kaldi, ae_dir, ref_dir, stats_dir, original_text, target_text, phi, numjobs=None, plot_samples=None):
     print(f'\n[+] Score adversarial examples')
 
     # decode and score adversarial examples
@@ -102,101 +110,88 @@ def score_AEs(kaldi, ae_dir, ref_dir, stats_dir, original_text, target_text, phi
 
     kaldi.fix_permissions()
 
-    # -> preprocessing + decoding with target text
-    wer, meta = kaldi.decode_wavs(data_dir=ae_dir, text=target_text, phi=phi)
+    # -> preprocessing + decoding (once), scored with target text and original text
+    decode_dir, ((wer, meta), (wer_recovered, _)) = kaldi.decode_wavs_multi(
+        data_dir=ae_dir, texts=[target_text, original_text], phi=phi, numjobs=numjobs)
+    kaldi.fix_permissions()
     print(f'    -> WER             : {wer:03.2f}%')
-    kaldi.results['wer'] = wer
-
-    # -> preprocessing + decoding with original text
-    wer, _ = kaldi.decode_wavs(data_dir=ae_dir, text=original_text, phi=phi)
-    print(f'    -> WER Recovered   : {wer:03.2f}%')
-    kaldi.results['wer_recovered'] = wer
-
-    # copy successful AEs
-    successful_AEs = [ ae['wav_name'] for ae in meta if ae['wer'] == 0 ]
-    successful_AEs_dir = stats_dir.joinpath("successful_AEs")
-    successful_AEs_dir.mkdir(parents=True)
-    for successful_AE in successful_AEs:
-        shutil.copy(ae_dir.joinpath(successful_AE).with_suffix('.wav'),
-                    successful_AEs_dir.joinpath(successful_AE).with_suffix('.wav'))
-    print(f'    -> Successful AEs  : {len(successful_AEs)} / {len(meta)}')
-    kaldi.results['successful_AEs', 'count'] = len(successful_AEs)
-
-    if len(successful_AEs) > 0: 
-        # SNRseg
-        snrs = snrseg(successful_AEs_dir, ref_dir)
-        print(f'       SNRseg          : {np.mean(snrs):02.2f} (+-{np.std(snrs):02.2f})')
-        kaldi.results['successful_AEs', 'snrseg'] = f'{np.mean(snrs):02.2f} (+-{np.std(snrs):02.2f})'
-
-        # spectograms
-        plots_dir = successful_AEs_dir.joinpath("plots")
-        plots_dir.mkdir()
-        with TemporaryDirectory() as kaldi_dir:
-            tmp_data_dir = Path(kaldi_dir).joinpath('tmp_data')
-            tmp_data_dir.mkdir()
-            for successful_AE in successful_AEs:
-                shutil.copyfile(
-                    src=ae_dir.joinpath(f'{successful_AE}.wav'),
-                    dst=tmp_data_dir.joinpath(f'{successful_AE}_ae.wav')
-                )
-                shutil.copyfile(
-                    src=ref_dir.joinpath(f'{successful_AE}.wav'),
-                    dst=tmp_data_dir.joinpath(f'{successful_AE}_ref.wav')
-                )
-            kaldi_tmp = Kaldi(Path(kaldi_dir))
-            running_time = kaldi_tmp.run_in_container(
-                f'python3 psycho/pre-processing.py --encoding_dir /root/tmp_data',
-                additional_cmds=[f'-v {tmp_data_dir}:/root/tmp_data', 
-                                f'-e PHI={phi}',                            
-                                f'-e NUMJOBS={cpu_count()}']
+    print(f'    -> WER Recovered   : {wer_recovered:03.2f}%')
+    with kaldi.results.batch():
+        kaldi.results['wer'] = wer
+        kaldi.results['wer_recovered'] = wer_recovered
+
+    with TemporaryDirectory() as kaldi_dir:
+        # preprocessing of the references for the spectograms 
+        # (the AEs are already preprocessed @ <decode_dir>/wavs)
+        tmp_data_dir = Path(kaldi_dir).joinpath('tmp_data')
+        tmp_data_dir.mkdir()
+        for ae in meta:
+            shutil.copyfile(
+                src=ref_dir.joinpath(f'{ae["wav_name"]}.wav'),
+                dst=tmp_data_dir.joinpath(f'{ae["wav_name"]}_ref.wav')
             )
-            shutil.copytree(tmp_data_dir, plots_dir.joinpath('data'))
-        with Pool(len(successful_AEs)) as p:
-            plot_func = partial(plot_stats, phi, plots_dir)
-            list(p.imap(plot_func, successful_AEs))
-
-    # copy unsuccessful AEs
-    unsuccessful_AEs = [ ae['wav_name'] for ae in meta if ae['wer'] != 0 ]
-    unsuccessful_AEs_dir = stats_dir.joinpath("unsuccessful_AEs")
-    unsuccessful_AEs_dir.mkdir(parents=True)
-    for unsuccessful_AE in unsuccessful_AEs:
-        shutil.copy(ae_dir.joinpath(unsuccessful_AE).with_suffix('.wav'),
-                    unsuccessful_AEs_dir.joinpath(unsuccessful_AE).with_suffix('.wav'))
-    print(f'    -> Unsuccessful AEs: {len(unsuccessful_AEs)} / {len(meta)}')
-    kaldi.results['unsuccessful_AEs', 'count'] = len(unsuccessful_AEs)
-
-    if len(unsuccessful_AEs) > 0: 
-        # SNRseg
-        snrs = snrseg(unsuccessful_AEs_dir, ref_dir)
-        print(f'       SNRseg          : {np.mean(snrs):02.2f} (+-{np.std(snrs):02.2f})')
-        kaldi.results['unsuccessful_AEs', 'snrseg'] = f'{np.mean(snrs):02.2f} (+-{np.std(snrs):02.2f})'
-
-        # spectograms
-        plots_dir = unsuccessful_AEs_dir.joinpath("plots")
-        plots_dir.mkdir()
-        with TemporaryDirectory() as kaldi_dir:
-            tmp_data_dir = Path(kaldi_dir).joinpath('tmp_data')
-            tmp_data_dir.mkdir()
-            for unsuccessful_AE in unsuccessful_AEs:
-                shutil.copyfile(
-                    src=ae_dir.joinpath(f'{unsuccessful_AE}.wav'),
-                    dst=tmp_data_dir.joinpath(f'{unsuccessful_AE}_ae.wav')
+        if len(meta) > 0:
+            with Kaldi(Path(kaldi_dir)) as kaldi_tmp:
+                kaldi_tmp.run_in_container(
+                    f'python3 psycho/pre-processing.py --encoding_dir /root/tmp_data',
+                    additional_cmds=[f'-v {tmp_data_dir}:/root/tmp_data', 
+                                     f'-e PHI={phi}',                            
+                                     f'-e NUMJOBS={cpu_count()}']
                 )
-                shutil.copyfile(
-                    src=ref_dir.joinpath(f'{unsuccessful_AE}.wav'),
-                    dst=tmp_data_dir.joinpath(f'{unsuccessful_AE}_ref.wav')
-                )
-            kaldi_tmp = Kaldi(Path(kaldi_dir))
-            running_time = kaldi_tmp.run_in_container(
-                f'python3 psycho/pre-processing.py --encoding_dir /root/tmp_data',
-                additional_cmds=[f'-v {tmp_data_dir}:/root/tmp_data', 
-                                f'-e PHI={phi}',                            
-                                f'-e NUMJOBS={cpu_count()}']
-            )
-            shutil.copytree(tmp_data_dir, plots_dir.joinpath('data'))
-        with Pool(len(unsuccessful_AEs)) as p:
-            plot_func = partial(plot_stats, phi, plots_dir)
-            list(p.imap(plot_func, unsuccessful_AEs))
+                kaldi_tmp.fix_permissions()
+
+        # SNRseg and NMR of all AEs (at once, NMR only with the cached thresholds of the references)
+        snr_table = snrseg_table(ae_dir, ref_dir)
+        snrs = dict(zip(snr_table['name'], snr_table['snrseg']))
+        nmr = nmr_table(ae_dir, ref_dir, THRESHS_CACHE, phi)
+        nmrs = dict(zip(nmr['name'], nmr['nmr']))
+        stats_dir.mkdir(parents=True)
+        with open(stats_dir.joinpath('perceptibility.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['wav_name', 'wer', 'snrseg', 'nmr', 'audible'] + 
+                            [ f'nmr_{low}-{high}Hz' for low, high in zip(nmr['band_edges'][:-1], nmr['band_edges'][1:]) ])
+            nmr_rows = { name: [ nmr['nmr'][idx], nmr['audible'][idx], *nmr['bands'][idx] ] for idx, name in enumerate(nmr['name']) }
+            for ae in meta:
+                writer.writerow([ ae['wav_name'], ae['wer'], snrs[ae['wav_name']] ] + nmr_rows.get(ae['wav_name'], []))
+
+        for name, label, AEs in [('successful_AEs', 'Successful AEs', [ ae['wav_name'] for ae in meta if ae['wer'] == 0 ]),
+                                 ('unsuccessful_AEs', 'Unsuccessful AEs', [ ae['wav_name'] for ae in meta if ae['wer'] != 0 ])]:
+            # copy AEs
+            AEs_dir = stats_dir.joinpath(name)
+            AEs_dir.mkdir(parents=True)
+            for AE in AEs:
+                shutil.copy(ae_dir.joinpath(AE).with_suffix('.wav'),
+                            AEs_dir.joinpath(AE).with_suffix('.wav'))
+            print(f'    -> {label:<16}: {len(AEs)} / {len(meta)}')
+            with kaldi.results.batch():
+                kaldi.results[name, 'count'] = len(AEs)
+                if len(AEs) > 0:
+                    # SNRseg
+                    AE_snrs = [ snrs[AE] for AE in AEs ]
+                    print(f'       SNRseg          : {np.mean(AE_snrs):02.2f} (+-{np.std(AE_snrs):02.2f})')
+                    kaldi.results[name, 'snrseg'] = f'{np.mean(AE_snrs):02.2f} (+-{np.std(AE_snrs):02.2f})'
+                    # NMR
+                    AE_nmrs = [ nmrs[AE] for AE in AEs if AE in nmrs ]
+                    if len(AE_nmrs) > 0:
+                        print(f'       NMR             : {np.mean(AE_nmrs):02.2f}dB (+-{np.std(AE_nmrs):02.2f})')
+                        kaldi.results[name, 'nmr'] = f'{np.mean(AE_nmrs):02.2f} (+-{np.std(AE_nmrs):02.2f})'
+
+            if len(AEs) > 0:
+                # spectograms (optionally only for a random subset)
+                plotted_AEs = AEs if plot_samples is None else sorted(random.Random(0).sample(AEs, min(plot_samples, len(AEs))))
+                plots_dir = AEs_dir.joinpath("plots")
+                plots_data_dir = plots_dir.joinpath('data')
+                plots_data_dir.mkdir(parents=True)
+                for AE in plotted_AEs:
+                    for src, dst in [ (decode_dir.joinpath('wavs', f'{AE}.original.wav'), f'{AE}_ae.original.wav'),
+                                      (decode_dir.joinpath('wavs', f'{AE}.wav'), f'{AE}_ae.wav'),
+                                      (decode_dir.joinpath('wavs', f'{AE}.csv'), f'{AE}_ae.csv'),
+                                      (tmp_data_dir.joinpath(f'{AE}_ref.original.wav'), f'{AE}_ref.original.wav'),
+                                      (tmp_data_dir.joinpath(f'{AE}_ref.wav'), f'{AE}_ref.wav'),
+                                      (tmp_data_dir.joinpath(f'{AE}_ref.csv'), f'{AE}_ref.csv') ]:
+                        if src.is_file():
+                            shutil.copyfile(src, plots_data_dir.joinpath(dst))
+                plot_stats_batch(phi, plots_dir, plotted_AEs)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -223,6 +218,8 @@ if __name__ == "__main__":
                         help='Type of attacker.')
     parser.add_argument('--psycho_hiding_thresh', default="-1",
                         help='Margin "lambda" in dB for psychoacoustic hiding. Disabled for -1.')
+    parser.add_argument('--plot_samples', default=None, type=int,
+                        help='Number of AEs with spectograms (per successful / unsuccessful AEs). All for None.')
 
     try:
         Kaldi.build_container(BASE_DIR)
@@ -1,23 +1,89 @@
+import hashlib
 import json
+import os
 import random
 import shutil
+import wave
 from collections import OrderedDict
 from pathlib import Path
 
 
 class Dataset:
 
+    # wavs, transcripts and the manifest are loaded on first use
     def __init__(self, data_dir, name=None):
         self.data_dir = Path(data_dir)
         self.name = name if name else self.data_dir.name 
-        self.wavs = sorted([wav.stem for wav in self.data_dir.glob("*.wav")
-                                     if not wav.stem.startswith('._')])
+        self._wavs = None
+        self._text = None
+        self._target = None
+        self._manifest = None
+
+    @property
+    def wavs(self):
+        if self._wavs is None:
+            self._wavs = sorted([wav.stem for wav in self.data_dir.glob("*.wav")
+                                          if not wav.stem.startswith('._')])
+        return self._wavs
+
+    @property
+    def text(self):
         # check if texts are available
-        text_file = self.data_dir.joinpath('text.json')
-        self.text = json.loads(text_file.read_text()) if text_file.is_file() else {}
+        if self._text is None:
+            text_file = self.data_dir.joinpath('text.json')
+            self._text = json.loads(text_file.read_text()) if text_file.is_file() else {}
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+
+    @property
+    def target(self):
         # check if targets are available
-        target_file = self.data_dir.joinpath('target.json')
-        self.target = json.loads(target_file.read_text()) if target_file.is_file() else {}     
+        if self._target is None:
+            target_file = self.data_dir.joinpath('target.json')
+            self._target = json.loads(target_file.read_text()) if target_file.is_file() else {}
+        return self._target
+
+    @target.setter
+    def target(self, target):
+        self._target = target
+
+    @property
+    def manifest(self):
+        """
+        { utt: {'path', 'duration', 'samples', 'sha1'} } @ <data_dir>/manifest.json
+        Built once, afterwards only new or changed wavs (mtime, size) are read again.
+        """
+        if self._manifest is None:
+            manifest_file = self.data_dir.joinpath('manifest.json')
+            manifest = json.loads(manifest_file.read_text()) if manifest_file.is_file() else {}
+            updated = {}
+            for utt in self.wavs:
+                wav_file = self.data_dir.joinpath(f'{utt}.wav')
+                stat = wav_file.stat()
+                entry = manifest.get(utt)
+                if entry is None or entry['stat'] != [stat.st_mtime_ns, stat.st_size]:
+                    with wave.open(str(wav_file), 'rb') as wav:
+                        samples, fs = wav.getnframes(), wav.getframerate()
+                    sha1 = hashlib.sha1()
+                    with open(wav_file, 'rb') as f:
+                        for block in iter(lambda: f.read(1 << 20), b''):
+                            sha1.update(block)
+                    entry = { 'path': wav_file.name, 'duration': samples / fs, 'samples': samples,
+                              'sha1': sha1.hexdigest(), 'stat': [stat.st_mtime_ns, stat.st_size] }
+                updated[utt] = entry
+            if updated != manifest:
+                tmp_file = manifest_file.with_name(f'.manifest.json.{os.getpid()}')
+                try:
+                    tmp_file.write_text(json.dumps(updated, indent=4))
+                    os.replace(tmp_file, manifest_file)
+                except OSError:
+                    # e.g., read-only dataset
+                    pass
+            self._manifest = updated
+        return self._manifest
 
     def __repr__(self):
         return self.name
@@ -39,10 +105,22 @@ class Dataset:
         Path(dataset_dir, 'target.json').write_text(json.dumps(target, indent=4))
         Path(dataset_dir, 'text.json').write_text(json.dumps(text, indent=4))
 
+    @staticmethod
+    def link_tree(src, dst):
+        # hardlinks instead of copies (e.g., within docker, symlinks would point outside of the mounts);
+        # the recipe only replaces wavs (rename + new file), i.e., the dataset itself is never modified
+        def link_or_copy(src, dst):
+            try:
+                os.link(src, dst)
+            except OSError:
+                # e.g., another file system
+                shutil.copy2(src, dst)
+        shutil.copytree(src, dst, copy_function=link_or_copy)
+
     def dump_as_kaldi_dataset(self, out_dir, wavs_prefix, target_idx=None):
         out_dir = Path(out_dir); out_dir.mkdir()
-        # copy data
-        shutil.copytree(self.data_dir, out_dir.joinpath('wavs'))
+        # link data
+        Dataset.link_tree(self.data_dir, out_dir.joinpath('wavs'))
         # dump targets
         target_utterances = list(set(self.target.values()))
         targets_dir = out_dir.joinpath('target_utterances')
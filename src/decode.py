@@ -11,25 +11,27 @@ from select_models import select_model
 
 BASE_DIR = Path.home().joinpath('dompteur')
 
-def main(models, experiments, dataset_dir, phi, low, high):
+def main(models, experiments, dataset_dir, phi, low, high, numjobs=None, dataset=None):
     # create kaldi instance
     model_dir = select_model(models, phi, low, high)
     kaldi = Kaldi.from_trained_model(model_dir=model_dir,
                                      base_dir=experiments.joinpath(f'{time.strftime("%Y-%m-%d")}_{pydng.generate_name()}'))
 
     # prepare dataset
-    dataset = Dataset(dataset_dir)
+    dataset = dataset if dataset else Dataset(dataset_dir)
     kaldi_dataset_dir = kaldi.base_dir.joinpath("data", dataset.name)
     dataset.dump_as_kaldi_dataset(kaldi_dataset_dir, wavs_prefix=f'data/{dataset.name}')
 
     # decode
-    wer, meta = kaldi.decode_wavs(data_dir=dataset.data_dir, text=dataset.text)
+    wer, meta = kaldi.decode_wavs(data_dir=dataset.data_dir, text=dataset.text, numjobs=numjobs)
     print(f'\n[+] WER {dataset}: {wer:03.2f}%')
     for utt in meta:
         print(f"\n[+] {utt['wav_name']}")
         print(f"    REF: {utt['ref']}")
         print(f"    HYP: {utt['hyp']}")
         print(f"    WER: {utt['wer']*100:5.2f}%")
+    kaldi.results['wer'] = wer
+    return kaldi
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
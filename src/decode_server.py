@@ -0,0 +1,94 @@
+import atexit
+import json
+import socket
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.io import wavfile
+
+
+class DecodeServer:
+
+    """
+    Client of a resident decoder within a Kaldi instance (@ kaldi/wsj_recipe/decode_server.py).
+    The model and the graph are loaded once, concurrent requests are decoded as one batch.
+
+    Init:
+        server = kaldi.decode_server(phi)
+
+    Decode:
+        server.decode({'utt1': <int16 array>, 'utt2': <path to wav>}, text={'utt1': ..., 'utt2': ...})
+        server.decode([<path to wav>, ...])
+        -> [ {'wav_name': ..., 'ref': ..., 'hyp': ..., 'wer': ...}, ... ] in the order of the wavs (cf. `parse_per_utt_file`)
+    """
+
+    def __init__(self, kaldi, phi=None, lmwt=10, wip=0.0, timeout=600):
+        self.kaldi = kaldi
+        self.phi = phi
+        self.socket_file = kaldi.base_dir.joinpath('decode_server.sock')
+        server_socket_file = self.socket_file if kaldi.backend == 'local' else '/root/experiment/decode_server.sock'
+        if self.socket_file.exists():
+            self.socket_file.unlink()
+        # the server runs until `close` (in a thread, as any other command of the instance)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True, args=(
+            f'. ./path.sh && python3 decode_server.py --socket_file {server_socket_file} --lmwt {lmwt} --wip {wip}',))
+        self.thread.start()
+        start = time.time()
+        while not self.socket_file.exists():
+            if not self.thread.is_alive():
+                raise RuntimeError(f'Decode server failed to start ({self.error}). See `kaldi_log.txt` for more details.')
+            if time.time() - start > timeout:
+                raise TimeoutError(f'Decode server did not start within {timeout}s')
+            time.sleep(0.1)
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run(self, cmd):
+        try:
+            # local backend: the recipe is locked until the server is started (cf. `Kaldi.run_local`)
+            self.kaldi.run_in_container(cmd, additional_cmds=[f'-e PHI={self.phi}'], started=self.socket_file.exists)
+        except RuntimeError as e:
+            self.error = e
+
+    def _request(self, request, payload=b''):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(str(self.socket_file))
+            connection.sendall(json.dumps(request).encode() + b'\n' + payload)
+            with connection.makefile('rb') as responses:
+                response = responses.readline()
+        if not response:
+            raise RuntimeError('Decode server closed the connection. See `kaldi_log.txt` for more details.')
+        response = json.loads(response)
+        if 'error' in response:
+            raise RuntimeError(f'Decode server: {response["error"]}')
+        return response
+
+    def decode(self, wavs, text=None):
+        # wavs: {utt: int16 array | wav path} or [wav path, ...] (utt = stem)
+        if not isinstance(wavs, dict):
+            wavs = { Path(wav).stem: wav for wav in wavs }
+        utts, payload = [], []
+        for utt, audio in wavs.items():
+            if not isinstance(audio, np.ndarray):
+                fs, audio = wavfile.read(audio)
+                assert fs == 16000, f'{utt}: expected 16kHz, got {fs}Hz'
+            audio = np.ascontiguousarray(audio, dtype='<i2')
+            utts.append({ 'name': utt, 'samples': len(audio),
+                          'ref': text[utt] if text else "DATA WITH NO SPOKEN CONTENT" })
+            payload.append(audio.tobytes())
+        response = self._request({ 'utts': utts }, b''.join(payload))
+        results = { result['wav_name']: result for result in response['utts'] }
+        return [ results[utt['name']] for utt in utts ]
+
+    def close(self):
+        if self.thread.is_alive():
+            self._request({ 'cmd': 'shutdown' })
+            self.thread.join()
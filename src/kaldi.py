@@ -1,77 +1,273 @@
+import fcntl
+import hashlib
 import json
 import os
-import random
-import re
 import secrets
+import shlex
 import shutil
+import threading
 import time
+import weakref
+from functools import partial
 from multiprocessing import cpu_count
 from pathlib import Path
-from subprocess import run
+from subprocess import DEVNULL, PIPE, Popen, run
 from tempfile import TemporaryDirectory
 
 from datasets import Dataset
+from decode_server import DecodeServer
 from kaldi_utils import *
+from scoring import parse_best_wer
 from snr import *
 from utils import *
 
+# hearing thresholds are shared by all experiments (@ kaldi/wsj_recipe/psycho/threshold_cache.py)
+THRESHS_CACHE = Path(os.environ.get('DOMPTEUR_THRESHS_CACHE', Path.home().joinpath('.cache/dompteur/threshs')))
+
+# how commands are executed
+#   docker : one container per command
+#   session: one long-lived container per Kaldi instance (`docker exec`)
+#   local  : no docker, within an already built environment (recipe @ DOMPTEUR_RECIPE_DIR)
+BACKEND = os.environ.get('DOMPTEUR_BACKEND', 'docker')
+RECIPE_DIR = Path(os.environ.get('DOMPTEUR_RECIPE_DIR', '/root/kaldi/wsj_recipe'))
+
 
 class Kaldi:
 
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, backend=BACKEND):
+        assert backend in ['docker', 'session', 'local'], f'unknown backend "{backend}"'
         self.base_dir = Path(base_dir)
         base_dir.mkdir(exist_ok=True, parents=True)
         self.log_file = self.base_dir.joinpath('kaldi_log.txt')
-        self.results = PersistentDefaultDict(self.base_dir.joinpath(f'results.json'))
+        self.results = PersistentDefaultDict(self.base_dir.joinpath(f'results.json'), journal=True)
+        self.backend = backend
+        self.session = None
+        # container of the last command per thread (e.g., decode servers run in their own thread)
+        self.container_names = {}
+        self.decode_servers = {}
+        self.timings = []
         self.fix_permissions()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def fingerprint(base_dir):
+        # build context of the image (@ Dockerfile), stat-based => no need to read the files
+        fingerprint = hashlib.sha1()
+        for path in [ 'Dockerfile', 'requirements.txt', '.dockerignore', 'kaldi', 'hearing_thresholds' ]:
+            path = base_dir.joinpath(path)
+            files = sorted(path.rglob('*')) if path.is_dir() else [path]
+            for f in files:
+                if '__pycache__' in f.parts or not f.is_file():
+                    continue
+                stat = f.stat()
+                fingerprint.update(f'{f.relative_to(base_dir)} {stat.st_size} {stat.st_mtime_ns}\n'.encode())
+        return fingerprint.hexdigest()
+
+    @staticmethod
+    def image_fingerprint():
+        result = run("docker image inspect --format '{{ index .Config.Labels \"dompteur.fingerprint\" }}' dompteur",
+                     stdout=PIPE, stderr=DEVNULL, shell=True)
+        return result.stdout.decode().strip() if result.returncode == 0 else None
+
     @staticmethod
     def build_container(base_dir):
-        docker_log = base_dir.joinpath('docker.log.txt')
-        while docker_log.is_file():
-            # we use the log as a lock for building
-            # => wait for a few seconds and try again
-            r = random.randint(5, 30)
-            print(f"[!] docker.log.txt exists.\n    -> wait for {r}s")
-            time.sleep(r)
-        print('[+] build container')
-        print(f'    log @ {docker_log}')
-        with open(docker_log, 'w') as log_file:
-            if run(f"docker build -t dompteur {base_dir}", 
-                   stdout=log_file, stderr=log_file, shell=True).returncode != 0:
-                print(f'    -> Container failed to build')
-                raise RuntimeError(f"Container failed to build\n{' '*14}log @ {docker_log}")
-        docker_log.unlink()
-
-    def run_in_container(self, cmd, additional_cmds=[]):
-        ## Step 1: build command
-        # base within container
-        container_name = f'dompteur_{secrets.token_hex(4)}'
-        full_cmd = f'docker run '\
-            f"--rm  --name {container_name} "\
-            f'-v {self.base_dir}:/root/experiment/ '\
-            f'-v {self.base_dir.joinpath("exp")}:/root/kaldi/wsj_recipe/exp '\
-            f'-v {self.base_dir.joinpath("data")}:/root/kaldi/wsj_recipe/data '\
-            f'-v {self.base_dir.joinpath("adversarial_examples")}:/root/kaldi/wsj_recipe/adversarial_examples '\
-            f'{" ".join(additional_cmds)} '\
-            f'dompteur '\
-            f'/bin/bash -c "cd /root/kaldi/wsj_recipe/ && {cmd} && chown -R {os.geteuid()}:{os.geteuid()} /root/experiment"'
+        if BACKEND == 'local':
+            return
+        fingerprint = Kaldi.fingerprint(base_dir)
+        if Kaldi.image_fingerprint() == fingerprint:
+            return
+        # only one build at a time, parallel runs wait for it (and reuse the image)
+        with open(base_dir.joinpath('docker.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if Kaldi.image_fingerprint() == fingerprint:
+                return
+            docker_log = base_dir.joinpath('docker.log.txt')
+            print('[+] build container')
+            print(f'    log @ {docker_log}')
+            with open(docker_log, 'w') as log_file:
+                if run(f"docker build --label dompteur.fingerprint={fingerprint} -t dompteur {base_dir}", 
+                       stdout=log_file, stderr=log_file, shell=True).returncode != 0:
+                    print(f'    -> Container failed to build')
+                    raise RuntimeError(f"Container failed to build\n{' '*14}log @ {docker_log}")
+            docker_log.unlink()
+
+    def run_in_container(self, cmd, additional_cmds=[], started=None):
+        ## Step 1: split options
+        # `-e KEY=VALUE` are set per command, all other options (mounts, gpus) belong to the container
+        env, options = Kaldi.parse_options(additional_cmds)
+        options = self.base_options() + options
         ## Step 2: execute
         start = time.time()
         with open(self.log_file, 'a+') as log_file:
-            log_file.write(f'\n{"#"*100}\n{cmd}\n{"#"*100}\n{full_cmd}\n{"#"*100}\n\n')
+            log_file.write(f'\n{"#"*100}\n{cmd}\n{"#"*100}\n')
+            log_file.flush()
             try:
-                if run(full_cmd, stdout=log_file, stderr=log_file, shell=True).returncode != 0:
-                    raise RuntimeError('Container returned statuscode != 0. See `kaldi_log.txt` for more details.')
+                if self.backend == 'docker':
+                    returncode = self.run_docker(cmd, env, options, log_file)
+                elif self.backend == 'session':
+                    returncode = self.run_session(cmd, env, options, log_file)
+                else:
+                    returncode = self.run_local(cmd, env, options, log_file, started)
             except KeyboardInterrupt as e:
-                run(f'docker kill {container_name}', stdout=log_file, stderr=log_file, shell=True)
+                self.kill(log_file)
                 raise e
-        end = time.time()
-        running_time = int(end - start)
-        return running_time
-            
+            running_time = time.time() - start
+            self.timings.append({'cmd': cmd, 'backend': self.backend,
+                                 'running_time': round(running_time, 3), 'returncode': returncode})
+            log_file.write(f'\n{"#"*100}\n[{self.backend}] completed in {running_time:.1f}s (returncode {returncode})\n')
+        if returncode != 0:
+            raise RuntimeError('Container returned statuscode != 0. See `kaldi_log.txt` for more details.')
+        return int(running_time)
+
+    @staticmethod
+    def parse_options(additional_cmds):
+        tokens = shlex.split(' '.join(additional_cmds))
+        assert len(tokens) % 2 == 0, f'expected pairs of options: {tokens}'
+        env, options = {}, []
+        for flag, value in zip(tokens[::2], tokens[1::2]):
+            if flag == '-e':
+                key, _, value = value.partition('=')
+                env[key] = value
+            else:
+                options.append((flag, value))
+        return env, options
+
+    @staticmethod
+    def format_options(options):
+        return ' '.join(f'{flag} {shlex.quote(value)}' for flag, value in options)
+
+    @staticmethod
+    def format_env(env):
+        return ' '.join(f'-e {shlex.quote(key + "=" + value)}' for key, value in env.items())
+
+    def base_options(self):
+        THRESHS_CACHE.mkdir(parents=True, exist_ok=True)
+        return [('-v', f'{self.base_dir}:/root/experiment/'),
+                ('-v', f'{self.base_dir.joinpath("exp")}:/root/kaldi/wsj_recipe/exp'),
+                ('-v', f'{self.base_dir.joinpath("data")}:/root/kaldi/wsj_recipe/data'),
+                ('-v', f'{self.base_dir.joinpath("adversarial_examples")}:/root/kaldi/wsj_recipe/adversarial_examples'),
+                ('-v', f'{THRESHS_CACHE}:/root/threshs_cache')]
+
+    def bash_cmd(self, cmd):
+        return f'/bin/bash -c "cd /root/kaldi/wsj_recipe/ && {cmd} && chown -R {os.geteuid()}:{os.geteuid()} /root/experiment"'
+
+    def run_docker(self, cmd, env, options, log_file):
+        # one container per command
+        container_name = self.container_names[threading.get_ident()] = f'dompteur_{secrets.token_hex(4)}'
+        full_cmd = f'docker run '\
+            f"--rm  --name {container_name} "\
+            f'{Kaldi.format_options(options)} '\
+            f'{Kaldi.format_env(env)} '\
+            f'dompteur '\
+            f'{self.bash_cmd(cmd)}'
+        log_file.write(f'{full_cmd}\n{"#"*100}\n\n')
+        log_file.flush()
+        return run(full_cmd, stdout=log_file, stderr=log_file, shell=True).returncode
+
+    def run_session(self, cmd, env, options, log_file):
+        # one long-lived container per instance, commands are executed via `docker exec`
+        # => restart the container (with all options so far) if the command needs a new mount
+        if self.session is None or not set(options) <= set(self.session['options']):
+            session_options = options if self.session is None else \
+                self.session['options'] + [ o for o in options if o not in self.session['options'] ]
+            self.start_session(session_options, log_file)
+        full_cmd = f'docker exec '\
+            f'{Kaldi.format_env(env)} '\
+            f'{self.session["name"]} '\
+            f'{self.bash_cmd(cmd)}'
+        log_file.write(f'{full_cmd}\n{"#"*100}\n\n')
+        log_file.flush()
+        return run(full_cmd, stdout=log_file, stderr=log_file, shell=True).returncode
+
+    def start_session(self, options, log_file):
+        self.stop_session()
+        name = f'dompteur_{secrets.token_hex(4)}'
+        full_cmd = f'docker run -d --rm --init --name {name} '\
+            f'{Kaldi.format_options(options)} '\
+            f'dompteur sleep infinity'
+        log_file.write(f'[session] {full_cmd}\n')
+        log_file.flush()
+        if run(full_cmd, stdout=log_file, stderr=log_file, shell=True).returncode != 0:
+            raise RuntimeError('Container failed to start. See `kaldi_log.txt` for more details.')
+        # stop container if the instance is garbage collected or python exits
+        self.session = {'name': name, 'options': options,
+                        'finalizer': weakref.finalize(self, Kaldi.stop_container, name)}
+
+    def stop_session(self):
+        # decode servers run within the session container => shut down, restarted on their next use
+        self.close_decode_servers()
+        if self.session is not None:
+            self.session['finalizer']()
+            self.session = None
+
+    @staticmethod
+    def stop_container(name):
+        run(f'docker rm -f {name}', stdout=DEVNULL, stderr=DEVNULL, shell=True)
+
+    def run_local(self, cmd, env, options, log_file, started=None):
+        # no docker: the recipe @ RECIPE_DIR is already built (e.g., within the image)
+        # => mounts are emulated by symlinks, i.e., only one command per recipe at a time
+        # => resident commands (e.g., decode servers) only hold the recipe until `started()`
+        env = {**os.environ, **env, 'THRESHS_CACHE': str(THRESHS_CACHE)}
+        with open(RECIPE_DIR.joinpath('.dompteur.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            for flag, value in options:
+                if flag == '-v':
+                    src, dst = value.split(':')[:2]
+                    if dst.rstrip('/') in ['/root/experiment', '/root/threshs_cache']:
+                        continue
+                    try:
+                        dst = RECIPE_DIR.joinpath(Path(dst).relative_to('/root/kaldi/wsj_recipe'))
+                    except ValueError:
+                        dst = Path(dst)
+                    Kaldi.link(Path(src), dst)
+                elif flag == '--gpus':
+                    env['CUDA_VISIBLE_DEVICES'] = value.split('=')[-1]
+                else:
+                    log_file.write(f'[!] option {flag} {value} ignored\n')
+            log_file.write(f'[local] cd {RECIPE_DIR} && {cmd}\n{"#"*100}\n\n')
+            log_file.flush()
+            process = Popen(f'cd {RECIPE_DIR} && {cmd}', stdout=log_file, stderr=log_file, shell=True,
+                            env=env, executable='/bin/bash')
+            if started is None:
+                return process.wait()
+            while process.poll() is None and not started():
+                time.sleep(0.1)
+        return process.wait()
+
+    @staticmethod
+    def link(src, dst):
+        if dst.is_symlink():
+            dst.unlink()
+        elif dst.exists():
+            raise RuntimeError(f'Cannot mount {src} @ {dst} (already exists)')
+        src.mkdir(parents=True, exist_ok=True)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.symlink_to(src.resolve())
+
+    def kill(self, log_file):
+        if self.backend == 'docker' and threading.get_ident() in self.container_names:
+            run(f'docker kill {self.container_names[threading.get_ident()]}', stdout=log_file, stderr=log_file, shell=True)
+        elif self.backend == 'session':
+            self.stop_session()
+
+    def close_decode_servers(self):
+        for server in self.decode_servers.values():
+            server.close()
+        self.decode_servers = {}
+
+    def close(self):
+        self.stop_session()
+        self.results.close()
+
     def fix_permissions(self):
-        self.run_in_container('true')
+        if self.backend != 'local':
+            self.run_in_container('true')
             
     def cleanup(self):
         self.fix_permissions()
@@ -119,8 +315,9 @@ class Kaldi:
             print(f'\n[!] Kaldi instance "{base_dir.name}" already exists')
             return
         else:
-            print(f'\n[+] Copy {model_dir.name} to {base_dir.name}')
-            shutil.copytree(src=str(model_dir), dst=str(base_dir), symlinks=True)
+            print(f'\n[+] Link {model_dir.name} to {base_dir.name}')
+            shutil.copytree(src=str(model_dir), dst=str(base_dir), symlinks=True,
+                            copy_function=partial(Kaldi.link_or_copy, model_dir=Path(model_dir)))
         # create kaldi instance
         kaldi = Kaldi(base_dir)
         if cleanup:
@@ -128,31 +325,65 @@ class Kaldi:
             kaldi.cleanup()
         return kaldi
 
+    @staticmethod
+    def link_or_copy(src, dst, model_dir):
+        # trained models are shared read-only by all experiments
+        # => hardlink model files, only the top-level files (results, logs) are
+        #    written by the experiment and thus copied
+        #    (as well as all files if the experiment is on another file system)
+        if Path(src).parent != model_dir:
+            try:
+                os.link(src, dst)
+            except OSError:
+                return shutil.copy2(src, dst)
+            os.chmod(dst, os.stat(dst).st_mode & ~0o222)
+            return dst
+        return shutil.copy2(src, dst)
+
+    def decode_server(self, phi=None):
+        # resident decoder (started once per phi, stopped on `close`)
+        if phi not in self.decode_servers:
+            self.decode_servers[phi] = DecodeServer(self, phi)
+        return self.decode_servers[phi]
+
     def decode_wav(self, wav, phi=None):
-        wav = Path(wav)
-        with TemporaryDirectory() as data_dir:
-            shutil.copyfile(wav, Path(data_dir).joinpath(wav.name))
-            _, decoding_meta = self.decode_wavs(data_dir, None, phi) 
-        return ' '.join(decoding_meta.pop()['hyp'].split())
+        return self.decode_server(phi).decode([wav]).pop()['hyp']
+
+    def decode_wavs(self, data_dir, text, phi=None, numjobs=None):
+        _, (results,) = self.decode_wavs_multi(data_dir, [text], phi=phi, numjobs=numjobs)
+        return results
 
-    def decode_wavs(self, data_dir, text, phi=None):
+    def decode_wavs_multi(self, data_dir, texts, phi=None, numjobs=None):
+        """
+        Decodes the wavs once and scores the hypotheses against each reference of `texts`.
+        -> decode dir (with the preprocessed wavs @ <decode dir>/wavs), [ (best_wer, decoding_meta) for each text ]
+        """
         data_dir = Path(data_dir)
         # create decode dir
         decode_name = f'decode_job_{data_dir.name}_{int(time.time())}'
         decode_dir = self.base_dir.joinpath(f"exp/nnet5d_gpu_time/{decode_name}")
         # create kaldi dataset
         dataset = Dataset(data_dir, name=decode_name)
-        dataset.text = text
+        dataset.text = texts[0]
         dataset.dump_as_kaldi_dataset(decode_dir, wavs_prefix=f"exp/nnet5d_gpu_time/{decode_name}")
+        # additional references (scored with the lattices of the decode dir)
+        scoring_dirs = [decode_dir]
+        for idx, text in enumerate(texts[1:], start=1):
+            scoring_dirs.append(decode_dir.joinpath(f'reference_{idx}'))
+            scoring_dirs[-1].mkdir()
+            scoring_dirs[-1].joinpath('text').write_text("\n".join(f'{utt} {text[utt]}' for utt in dataset.wavs) + "\n")
         # invoke decode script in container
         self.run_in_container(
-            f'./decode_wavs.sh exp/nnet5d_gpu_time/{decode_name}',
-            additional_cmds=[f'-e NUMJOBS={min(len(dataset), cpu_count())}',
+            f'./decode_wavs.sh exp/nnet5d_gpu_time/{decode_name} ' +
+            " ".join(f'exp/nnet5d_gpu_time/{decode_name}/{d.name}' for d in scoring_dirs[1:]),
+            additional_cmds=[f'-e NUMJOBS={min(len(dataset), numjobs or cpu_count())}',
                              f'-e PHI={phi} -e LOG_CLAMP=0']
         )
-        # get best_wer
-        best_wer = open(f'{decode_dir}/scoring_kaldi/best_wer').read().strip()
-        best_wer = float(re.findall(r'%WER (.*) \[', best_wer)[0])
-        # get decoding meta
-        decoding_meta = parse_per_utt_file(decode_dir)
-        return best_wer, decoding_meta
+        results = []
+        for scoring_dir in scoring_dirs:
+            # get best_wer
+            best_wer = parse_best_wer(scoring_dir.joinpath('scoring_kaldi', 'best_wer'))
+            # get decoding meta
+            decoding_meta = parse_per_utt_file(scoring_dir)
+            results.append((best_wer, decoding_meta))
+        return decode_dir, results
@@ -3,53 +3,158 @@ import re
 import sys
 import threading
 import time
+from collections import deque
 from pathlib import Path
 
 from colorama import Fore, Style
 from tqdm import tqdm
 
+from scoring import parse_per_utt, parse_utt_itr, parse_wer_history
 
-def parse_per_utt_file(decode_dir):
-    per_utt = Path(decode_dir).joinpath('scoring_kaldi', 'wer_details', 'per_utt').read_text()
-
-    utterances = list(set([ line.split(' ')[0] for line in per_utt.splitlines() ]))
-
-    entries = []
-    for utt in utterances:
-        ref, hyp, op, csid = [ line for line in per_utt.splitlines() 
-                                    if line.startswith(utt)           ]
-        
-        hyp = hyp.split('hyp')[-1].strip()
-        ref = ref.split('ref')[-1].strip()
-
-        N = len(ref.split('ref')[-1].strip().split())
-        c, s, i, d = csid.split(' ')[-4:]
-
-        wer = (int(s) + int(i) + int(d))/N
-
-        entries.append({
-            'wav_name' : utt,
-            'ref' : ref,
-            'hyp' : hyp,
-            'wer' : wer
-        })
 
-    return list(sorted(entries, key=lambda e: e['wer']))
+def parse_per_utt_file(decode_dir):
+    return parse_per_utt(Path(decode_dir).joinpath('scoring_kaldi', 'wer_details', 'per_utt')).entries()
 
 def parse_results_file(base_dir):
     results_files = list(base_dir.joinpath('exp/nnet5d_gpu_time/').glob('*.json'))
     if len(results_files) > 1:
         print('    More than one results file exists')
         return []
-    return [f'{float(result.split(" ")[1]):>6.2f}%' for result in json.loads(results_files[0].read_text())]
+    return [f'{result:>6.2f}%' for result in parse_wer_history(results_files[0])]
+
+class LogTailer:
+
+    """
+    Incremental reader of the logs of an experiment. Only new (complete) lines of `kaldi_log.txt` and
+    the `adversarial.*.log` files are parsed; the resulting events are appended to `events.jsonl`
+    (one JSON object per line, e.g., `tail -f events.jsonl`). The file is kept across loggers of the
+    same experiment (e.g., the stages of `train.py`), `reset=True` starts a new one:
+
+        {"time": ..., "event": "stage", "name": "[+] train model"}
+        {"time": ..., "event": "train_itr", "itr": 12}
+        {"time": ..., "event": "decode_start"}
+        {"time": ..., "event": "decode_end"}
+        {"time": ..., "event": "iteration", "itr": 3, "wer": 12.5}
+        {"time": ..., "event": "utt_start", "log": "adversarial.1.log", "utt": "..."}
+        {"time": ..., "event": "spoof_itr", "log": "adversarial.1.log", "utt": "...", "itr": 7}
+        {"time": ..., "event": "utt_done", "log": "adversarial.1.log", "utt": "...", "itr": 50}
+        {"time": ..., "event": "finished_aes", "count": 4}
+    """
+
+    utt_pattern = re.compile(r"LOG \(nnet-spoof-iter\[5\.5\]:DecodableAmNnetSpoofIter\(\):nnet2\/decodable-am-nnet\.h:517\) (.*)")
+
+    def __init__(self, base_dir, reset=False):
+        self.base_dir = Path(base_dir)
+        self.exp_dir = self.base_dir.joinpath('exp/nnet5d_gpu_time/')
+        self.events_file = self.base_dir.joinpath('events.jsonl')
+        if reset:
+            self.events_file.write_text('')
+        self.offsets = {}
+        # state of the experiment (after the last `poll`)
+        self.last_lines = deque(maxlen=3)
+        self.stages = set()
+        self.train_itr = 0
+        self.decoding = 0
+        self.results_files = 0
+        self.wers = []
+        self.finished_aes = None
+        self.utts = {}
+
+    def _read_lines(self, path):
+        # complete lines appended since the last call (from the start if the file was truncated or replaced)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return False, []
+        inode, offset = self.offsets.get(path, (stat.st_ino, 0))
+        truncated = inode != stat.st_ino or stat.st_size < offset
+        if truncated:
+            offset = 0
+        if stat.st_size == offset:
+            return truncated, []
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(stat.st_size - offset)
+        end = data.rfind(b'\n') + 1
+        self.offsets[path] = (stat.st_ino, offset + end)
+        return truncated, data[:end].decode(errors='replace').splitlines()
+
+    def poll(self):
+        events = []
+        event = lambda event, **kwargs: events.append({ 'time': time.time(), 'event': event, **kwargs })
+
+        # kaldi log
+        for line in self._read_lines(self.base_dir.joinpath('kaldi_log.txt'))[1]:
+            if line.strip():
+                self.last_lines.append(line.strip())
+            if "Training neural net" in line:
+                self.train_itr += 1
+                event('train_itr', itr=self.train_itr)
+            elif line.startswith("[+] Start decoding AEs"):
+                self.decoding += 1
+                event('decode_start')
+            elif line.startswith("[+] End decoding AEs"):
+                self.decoding -= 1
+                event('decode_end')
+            elif line.startswith("[+] "):
+                self.stages.add(line.strip())
+                event('stage', name=line.strip())
+
+        # WERs of the outer iterations
+        results_files = list(self.exp_dir.glob('*.json'))
+        self.results_files = len(results_files)
+        if len(results_files) == 1:
+            try:
+                results = parse_wer_history(results_files[0]).tolist()
+            except ValueError:
+                # partially written
+                results = self.wers
+            for itr in range(len(self.wers), len(results)):
+                event('iteration', itr=itr + 1, wer=results[itr])
+            self.wers = results
+
+        adversarial_dirs = [e for e in self.exp_dir.glob('adversarial*') if e.is_dir()]
+        if len(adversarial_dirs) > 0:
+            # finished AEs
+            utt_itr_file = adversarial_dirs[0].joinpath('scoring_kaldi/wer_details/utt_itr')
+            if utt_itr_file.is_file():
+                finished_aes = len(parse_utt_itr(utt_itr_file)[0])
+                if finished_aes != self.finished_aes:
+                    self.finished_aes = finished_aes
+                    event('finished_aes', count=finished_aes)
+
+            # inner iterations (the log of an utterance is truncated by each outer iteration)
+            for log_file in sorted(adversarial_dirs[0].joinpath('log').glob('adversarial.*.log')):
+                truncated, lines = self._read_lines(log_file)
+                if truncated or log_file.name not in self.utts:
+                    self.utts[log_file.name] = { 'utt': "", 'itr': 0, 'done': False }
+                utt = self.utts[log_file.name]
+                for line in lines:
+                    uttr_name = self.utt_pattern.findall(line)
+                    if len(uttr_name) > 0 and not utt['utt']:
+                        utt['utt'] = uttr_name[0]
+                        event('utt_start', log=log_file.name, utt=utt['utt'])
+                    if "SPOOF_ITERATION" in line:
+                        utt['itr'] += 1
+                        event('spoof_itr', log=log_file.name, utt=utt['utt'], itr=utt['itr'])
+                    done = "Ended" in line
+                    if done and not utt['done']:
+                        event('utt_done', log=log_file.name, utt=utt['utt'], itr=utt['itr'])
+                    utt['done'] = done
+
+        if events:
+            with open(self.events_file, 'a') as f:
+                f.writelines(json.dumps(e) + '\n' for e in events)
+        return events
 
 class KaldiLogger:
 
     _loggers = []
 
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, reset=False):
         KaldiLogger._loggers.append(self)
         self.base_dir = base_dir
+        self.tailer = LogTailer(base_dir, reset=reset)
 
     @staticmethod
     def stop_all():
@@ -60,18 +165,16 @@ class KaldiLogger:
         self.stop_flag = True
         time.sleep(3)
 
-    @property
-    def kaldi_log(self):
-        return self.base_dir.joinpath('kaldi_log.txt').read_text()
-
     @property
     def train_itr(self):
-        return len([ l for l in self.kaldi_log.splitlines() if "Training neural net" in l ])
+        self.tailer.poll()
+        return self.tailer.train_itr
 
-    def log_ae(self, max_inner_itr=50, max_outer_itr=10):
+    def log_ae(self, max_inner_itr=50, max_outer_itr=10, quiet=False):
+        # quiet: no console output (e.g., concurrent runs @ sweep.py), only `events.jsonl`
         time.sleep(5)
         self.stop_flag = False
-        logger_thread = threading.Thread(target=self._log_ae, args=(max_inner_itr, max_outer_itr))
+        logger_thread = threading.Thread(target=self._log_events if quiet else self._log_ae, args=(max_inner_itr, max_outer_itr))
         logger_thread.start()
 
     def log_training(self, max_itr=920):
@@ -82,7 +185,8 @@ class KaldiLogger:
     def wait_for_log_entry(self, entry):
         start = time.time()
         while not self.stop_flag:
-            if entry in self.kaldi_log:
+            self.tailer.poll()
+            if entry in self.tailer.stages:
                 break
             time.sleep(1)
         running_time = int(time.time() - start)
@@ -127,11 +231,18 @@ class KaldiLogger:
 
                 time.sleep(1)
 
+    def _log_events(self, *args):
+        while not self.stop_flag:
+            self.tailer.poll()
+            time.sleep(1)
+        self.tailer.poll()
+
     def _log_ae(self, max_inner_itr=50, max_outer_itr=10):
         self.current_itr = 0
         self.tic = time.time()
         self.running_time = 0
         while not self.stop_flag:
+            self.tailer.poll()
             no_of_lines = self._print_ae_status(max_inner_itr, max_outer_itr)
             time.sleep(1)
             erase_line(no_of_lines)
@@ -142,12 +253,11 @@ class KaldiLogger:
         print(f'\n    {self.base_dir.name.upper()}\n')
 
         # WERs
-        try:
-            results_files = list(self.base_dir.joinpath('exp/nnet5d_gpu_time/').glob('*.json'))
-            if len(results_files) > 1:
-                print('    More than one results file exists')
-                return no_of_lines + 1
-            results = [float(result.split(' ')[1]) for result in json.loads(results_files[0].read_text())]
+        if self.tailer.results_files > 1:
+            print('    More than one results file exists')
+            return no_of_lines + 1
+        results = self.tailer.wers
+        if len(results) > 0:
             min_wer, min_wer_idx = min(results), results.index(min(results)) + 1
             last_results = [f'{results[idx]:>6.2f}%' for idx in range(max(len(results)-5,0), len(results))]
             current_itr = len(results)
@@ -156,63 +266,37 @@ class KaldiLogger:
             print(f'    -> BEST   : {min_wer:>6.2f}% @ {min_wer_idx}')
             print(f'    -> LAST   : {" -> ".join(last_results)}\n')
             no_of_lines += 5
-        except:
-            pass
 
         # finished AEs
-        try:
-            adversarial_log_dir = [e for e in self.base_dir.joinpath('exp/nnet5d_gpu_time/').glob('adversarial*') if e.is_dir()][0]
-            utt_itr = len(adversarial_log_dir.joinpath('scoring_kaldi/wer_details/utt_itr').read_text().splitlines())
-            print(f"    FINISHED AEs: {utt_itr}\n")
+        if self.tailer.finished_aes is not None:
+            print(f"    FINISHED AEs: {self.tailer.finished_aes}\n")
             no_of_lines += 2
-        except:
-            pass
 
         # kaldi log
-        try:
-            print('    KALDI LOG'); no_of_lines += 1
-            kaldi_log = self.base_dir.joinpath('kaldi_log.txt').read_text().splitlines()
-            for idx in range(-3, 0):
-                l = kaldi_log[idx].strip()
-                if len(l) > 50:
-                    print(f'    {l[:25]} ... {l[-25:]}')
-                else:
-                    print(f'    {l}')
-                no_of_lines += 1
-            print(); no_of_lines += 1
-        except:
-            pass
+        print('    KALDI LOG'); no_of_lines += 1
+        for l in self.tailer.last_lines:
+            if len(l) > 50:
+                print(f'    {l[:25]} ... {l[-25:]}')
+            else:
+                print(f'    {l}')
+            no_of_lines += 1
+        print(); no_of_lines += 1
 
         # progress bars
-        try:
-            adversarial_log_dir = [e for e in self.base_dir.joinpath('exp/nnet5d_gpu_time/').glob('adversarial*') if e.is_dir()][0]
-            adversarial_log_files = sorted(adversarial_log_dir.joinpath('log').glob('adversarial.*.log'))
-            itrs = []
-            if len(adversarial_log_files) > 0:
-                in_progress = []
-                for adversarial_log_file in adversarial_log_files:
-                    adversarial_log = adversarial_log_file.read_text().splitlines()
-                    itr = len([l for l in adversarial_log if "SPOOF_ITERATION" in l ]) 
-                    
-                    uttr_name = re.findall("LOG \(nnet-spoof-iter\[5\.5\]:DecodableAmNnetSpoofIter\(\):nnet2\/decodable-am-nnet\.h:517\) (.*)", "\n".join(adversarial_log))
-                    if len(uttr_name) > 0:
-                        uttr_name = uttr_name[0]
-                    else:
-                        uttr_name = ""                
-
-                    if "Ended" not in adversarial_log[-1]:
-                        in_progress.append((uttr_name, itr))
-                        itrs.append(itr)
-
-                no_of_pbars = 3
-                for uttr_name, itr in in_progress[:no_of_pbars]:
-                    print(f'    {uttr_name:>8} [{itr:02}/{max_inner_itr} {"#"*(itr//2)+" "*((max_inner_itr-itr)//2)}]')    
-                    no_of_lines += 1
-
-                if len(in_progress) > no_of_pbars:
-                    print(f"    ... {len(in_progress)-no_of_pbars} more")
-                    no_of_lines += 1        
+        if len(self.tailer.utts) > 0:
+            in_progress = [ (utt['utt'], utt['itr']) for utt in self.tailer.utts.values() if not utt['done'] ]
+            itrs = [ itr for _, itr in in_progress ]
+
+            no_of_pbars = 3
+            for uttr_name, itr in in_progress[:no_of_pbars]:
+                print(f'    {uttr_name:>8} [{itr:02}/{max_inner_itr} {"#"*(itr//2)+" "*((max_inner_itr-itr)//2)}]')    
+                no_of_lines += 1
+
+            if len(in_progress) > no_of_pbars:
+                print(f"    ... {len(in_progress)-no_of_pbars} more")
+                no_of_lines += 1        
 
+            if len(itrs) > 0:
                 if self.current_itr < min(itrs):
                     self.running_time = int(time.time() - self.tic)
                     self.tic = time.time()
@@ -220,28 +304,23 @@ class KaldiLogger:
 
                 if min(itrs) == 0:
                     self.current_itr = 0
-                
-                print(f'\n         last     {(self.running_time % 3600) // 60:>2}m {(self.running_time % 60):>2}s')
-                remaining = self.running_time * (max_inner_itr - self.current_itr)
-                print(f'    remaining {remaining // 3600:>2}h {(remaining % 3600) // 60:>2}m {(remaining % 60):>2}s')
-                no_of_lines += 3
-               
-        except:
-            pass
+
+            print(f'\n         last     {(self.running_time % 3600) // 60:>2}m {(self.running_time % 60):>2}s')
+            remaining = self.running_time * (max_inner_itr - self.current_itr)
+            print(f'    remaining {remaining // 3600:>2}h {(remaining % 3600) // 60:>2}m {(remaining % 60):>2}s')
+            no_of_lines += 3
 
         return no_of_lines
 
     def _ae_decoding(self):
-        decoding_start = "[+] Start decoding AEs"
-        decoding_end = "[+] End decoding AEs"
-        kaldi_log = self.base_dir.joinpath('kaldi_log.txt').read_text()
         print()
-        while kaldi_log.count(decoding_start) > kaldi_log.count(decoding_end):
+        self.tailer.poll()
+        while self.tailer.decoding > 0 and not self.stop_flag:
             print(Fore.RED + "    DECODING" + Style.RESET_ALL)
             time.sleep(0.5); erase_line(1)
             print("            ")
             time.sleep(0.5); erase_line(1)
-            kaldi_log = self.base_dir.joinpath('kaldi_log.txt').read_text()
+            self.tailer.poll()
         erase_line(1)
 
 def erase_line(n=1):
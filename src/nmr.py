@@ -0,0 +1,91 @@
+import hashlib
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+
+import numpy as np
+from scipy.io import wavfile
+
+# STFT of the psychoacoustic filter (@ kaldi/wsj_recipe/psycho/psycho.py)
+SAMPLING_RATE = 16000
+WIN_LENGTH = 512
+HOP_LENGTH = 256
+BANDS = [0, 500, 1000, 2000, 4000, 8000]
+
+
+def threshs_key(audio, sampling_rate=SAMPLING_RATE):
+    # key of the threshold cache (= `audio_key` @ kaldi/wsj_recipe/psycho/threshold_cache.py, cf. tests/test_nmr.py)
+    key = hashlib.sha1(f'{sampling_rate}/{WIN_LENGTH}/{HOP_LENGTH}/'.encode())
+    key.update(np.ascontiguousarray(audio, dtype=np.int16).tobytes())
+    return key.hexdigest()
+
+def magnitude(audio):
+    # |STFT| w/o offset -> [256, frames] (cf. `torch.stft(..., pad_mode='constant')` + `Psycho.get_magnitude`)
+    signal = np.pad(np.asarray(audio, dtype=np.float32), WIN_LENGTH // 2)
+    num_frames = 1 + (len(signal) - WIN_LENGTH) // HOP_LENGTH
+    frames = np.lib.stride_tricks.as_strided(signal, shape=(num_frames, WIN_LENGTH),
+                                             strides=(signal.strides[0] * HOP_LENGTH, signal.strides[0]))
+    window = np.hamming(WIN_LENGTH + 1)[:-1]
+    return np.abs(np.fft.rfft(frames * window, axis=1)).T[1:]
+
+def _nmr(ae_file, ref_file, threshs_cache, phi, band_idx):
+    _, ae = wavfile.read(ae_file, mmap=True)
+    _, ref = wavfile.read(ref_file, mmap=True)
+    n = min(len(ae), len(ref))
+    ae, ref = ae[:n], ref[:n]
+    # thresholds (dB) of the reference, i.e., the signal that masks the perturbation
+    threshs_file = Path(threshs_cache).joinpath(f'{threshs_key(ref)}.npy')
+    if not threshs_file.is_file():
+        return None
+    H = np.load(threshs_file, mmap_mode='r')
+    # perturbation in dB (same scale as the masking of the filter)
+    ref_magnitude = magnitude(ref)
+    noise = magnitude(ae.astype(np.float32) - ref.astype(np.float32))
+    frames = min(noise.shape[1], H.shape[1])
+    m_max = max(ref_magnitude.max(), 1e-20)
+    N = 20*np.log10(np.maximum(noise[:, :frames], 1e-20) / m_max)
+    # excess over the scaled thresholds (> 0 => audible)
+    excess = N - (H[:, :frames] - 95 + phi)
+    ratio = np.power(10, excess / 10)
+    bands = [ 10*np.log10(np.mean(ratio[idx])) if len(idx) > 0 else np.nan for idx in band_idx ]
+    return 10*np.log10(np.mean(ratio)), float(np.mean(excess > 0)), bands
+
+def _nmr_chunk(pairs, threshs_cache, phi, band_idx):
+    return [ _nmr(ae_file, ref_file, threshs_cache, phi, band_idx) for ae_file, ref_file in pairs ]
+
+def nmr_table(ae_dir, ref_dir, threshs_cache, phi=0, bands=BANDS, workers=None, chunksize=256):
+    """
+    Noise-to-mask ratio (dB) of all wavs in `ae_dir`: the perturbation (AE - reference) relative to
+    the hearing thresholds of the reference scaled with `phi`. Thresholds are only taken from the
+    threshold cache (i.e., computed by the psychoacoustic filter before), missing ones are skipped.
+    -> {'name': [...], 'nmr': array, 'audible': array (fraction of bins above the thresholds),
+        'bands': array [files, bands], 'band_edges': bands, 'missing': [...],
+        'count': ..., 'mean': ..., 'std': ..., 'min': ..., 'max': ...}
+    """
+    phi = 0 if phi in [None, "None"] else int(phi)
+    # frequency of each bin (w/o offset)
+    frequencies = np.arange(1, WIN_LENGTH // 2 + 1) * SAMPLING_RATE / WIN_LENGTH
+    band_idx = [ np.where((frequencies > low) & (frequencies <= high))[0] for low, high in zip(bands[:-1], bands[1:]) ]
+    ae_files = sorted(Path(ae_dir).glob('*.wav'))
+    pairs = [ (ae_file, Path(ref_dir).joinpath(ae_file.name)) for ae_file in ae_files ]
+    chunks = [ pairs[i:i+chunksize] for i in range(0, len(pairs), chunksize) ]
+    workers = min(len(chunks), workers or cpu_count())
+    args = (threshs_cache, phi, band_idx)
+    if workers > 1:
+        with Pool(workers) as p:
+            results = [ result for chunk in p.starmap(_nmr_chunk, [ (chunk, *args) for chunk in chunks ]) for result in chunk ]
+    else:
+        results = _nmr_chunk(pairs, *args)
+    found = [ idx for idx, result in enumerate(results) if result is not None ]
+    nmrs = np.array([ results[idx][0] for idx in found ], dtype=np.float64)
+    table = {
+        'name': [ ae_files[idx].stem for idx in found ],
+        'nmr': nmrs,
+        'audible': np.array([ results[idx][1] for idx in found ], dtype=np.float64),
+        'bands': np.array([ results[idx][2] for idx in found ], dtype=np.float64).reshape(-1, len(band_idx)),
+        'band_edges': bands,
+        'missing': [ ae_file.stem for ae_file, result in zip(ae_files, results) if result is None ],
+        'count': len(nmrs)
+    }
+    for stat in ['mean', 'std', 'min', 'max']:
+        table[stat] = float(getattr(np, stat)(nmrs)) if len(nmrs) > 0 else None
+    return table
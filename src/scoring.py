@@ -0,0 +1,89 @@
+import json
+import re
+from functools import wraps
+from pathlib import Path
+
+import numpy as np
+
+
+def cached(parse):
+    # parsed outputs are reused until the file changes (mtime and size)
+    cache = {}
+
+    @wraps(parse)
+    def cached_parse(path):
+        path = Path(path)
+        stat = path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        if path not in cache or cache[path][0] != key:
+            cache[path] = (key, parse(path))
+        return cache[path][1]
+    return cached_parse
+
+
+class PerUtt:
+
+    """
+    Columnar view of `scoring_kaldi/wer_details/per_utt`.
+
+        per_utt = parse_per_utt(<decode_dir>/scoring_kaldi/wer_details/per_utt)
+        per_utt.names, per_utt.ref, per_utt.hyp   -> lists (one entry per utterance)
+        per_utt.csid                              -> array (utterances x [correct, sub, ins, del])
+        per_utt.wer                               -> array
+        per_utt.entries()                         -> [ {'wav_name': ..., 'ref': ..., 'hyp': ..., 'wer': ...}, ... ]
+    """
+
+    def __init__(self, names, ref, hyp, csid):
+        self.names = names
+        self.ref = ref
+        self.hyp = hyp
+        self.csid = np.array(csid, dtype=int).reshape(-1, 4)
+        # normalized by the length of the aligned reference (i.e., including insertions)
+        words = np.array([ len(r.split()) for r in ref ])
+        self.wer = self.csid[:, 1:].sum(axis=1) / np.maximum(words, 1)
+
+    def __len__(self):
+        return len(self.names)
+
+    def entries(self):
+        # sorted by WER
+        return [ { 'wav_name': self.names[idx], 'ref': self.ref[idx], 'hyp': self.hyp[idx], 'wer': float(self.wer[idx]) }
+                 for idx in np.argsort(self.wer, kind='stable') ]
+
+
+@cached
+def parse_per_utt(path):
+    rows = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split(None, 2)
+            if len(fields) < 2:
+                continue
+            rows.setdefault(fields[0], {})[fields[1]] = fields[2].strip() if len(fields) > 2 else ''
+    names = list(rows)
+    return PerUtt(names,
+                  [ rows[name].get('ref', '') for name in names ],
+                  [ rows[name].get('hyp', '') for name in names ],
+                  [ rows[name]['#csid'].split()[:4] for name in names ])
+
+@cached
+def parse_best_wer(path):
+    # e.g., "%WER 4.88 [ 9 / 184, 1 ins, 1 del, 7 sub ] exp/.../wer_10_0.0"
+    return float(re.findall(r'%WER (.*) \[', Path(path).read_text())[0])
+
+@cached
+def parse_utt_itr(path):
+    # successful utterances and the iteration in which they were found (@ find_all_correct.py)
+    names, itrs = [], []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2:
+                names.append(fields[0])
+                itrs.append(int(fields[1]))
+    return names, np.array(itrs, dtype=int)
+
+@cached
+def parse_wer_history(path):
+    # WER after each outer iteration of an attack (`<exp_dir>/<dataset>_wer.json`)
+    return np.array([ float(result.split(' ')[1]) for result in json.loads(Path(path).read_text()) ])
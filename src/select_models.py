@@ -1,21 +1,64 @@
+import json
+import os
 import re
 from pathlib import Path
 
 
+def index_model(model_dir):
+    training_log = model_dir.joinpath('training.log.txt')
+    wer = [float(re.findall(r'%WER (.*) \[', l)[0]) for l in training_log.read_text().splitlines() if l.startswith('%WER')]
+    if len(wer) != 1:
+        raise ValueError(f'expected one %WER in {training_log}, found {len(wer)}')
+    phi, low, high = re.findall(r'phi\.(.*)_bandpass\.(.*)-(.*)$', model_dir.name)[0]
+    return {
+        'phi' : phi,
+        'low' : low,
+        'high': high,
+        'wer' : wer.pop(),
+        'size': sum(f.stat().st_size for f in model_dir.rglob('*') if f.is_file() and not f.is_symlink()),
+        'created' : training_log.stat().st_mtime,
+        # the entry is refreshed if the training log changes
+        'log' : [training_log.stat().st_mtime_ns, training_log.stat().st_size]
+    }
+
+def load_registry(models):
+    """
+    Index of all trained models @ <models>/registry.json: { <model name>: {'phi', 'low', 'high', 'wer', 'size', 'created'} }
+    Only new or changed models (i.e., their training log) are indexed, removed models are dropped.
+    Models that cannot be indexed (e.g., unfinished training) are kept with 'wer': None.
+    """
+    registry_file = Path(models).joinpath('registry.json')
+    registry = json.loads(registry_file.read_text()) if registry_file.is_file() else {}
+    updated = {}
+    for model_dir in Path(models).glob('*phi.*_bandpass.*-*'):
+        try:
+            stat = model_dir.joinpath('training.log.txt').stat()
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        entry = registry.get(model_dir.name)
+        if entry is None or entry['log'] != [stat.st_mtime_ns, stat.st_size]:
+            try:
+                entry = index_model(model_dir)
+            except (ValueError, OSError) as e:
+                print(f'[!] Skip model {model_dir.name}: {e}')
+                entry = { 'wer': None, 'log': [stat.st_mtime_ns, stat.st_size] }
+        updated[model_dir.name] = entry
+    if updated != registry:
+        tmp_file = registry_file.with_name(f'.registry.json.{os.getpid()}')
+        try:
+            tmp_file.write_text(json.dumps(updated, indent=4))
+            os.replace(tmp_file, registry_file)
+        except OSError:
+            # e.g., read-only models directory
+            pass
+    return updated
+
 def select_model(models, phi, low, high, model_idx=0):
-    # get all models for parameters
-    model_dirs = [ model_dir for model_dir in models.glob(f'*phi.{phi}_bandpass.{low}-{high}')
-                             if model_dir.joinpath('training.log.txt').is_file()                ]
-    # get WER for each model
-    wers = []
-    for model_dir in model_dirs:
-        wer = [float(re.findall(r'%WER (.*) \[', l)[0]) for l in model_dir.joinpath('training.log.txt').read_text().splitlines() if l.startswith('%WER')]
-        assert len(wer) == 1
-        wer = wer.pop()
-        wers.append((model_dir, wer))
+    # get all models for parameters (sorted by WER)
+    wers = sorted([ (models.joinpath(name), entry['wer']) for name, entry in load_registry(models).items()
+                    if name.endswith(f'phi.{phi}_bandpass.{low}-{high}') and entry['wer'] is not None ], key=lambda x: x[1])
     # assert that we found at least one model
     assert len(wers) != 0
-    wers = sorted(wers, key=lambda x: x[1])
     # return the i'th model
     model, _ = wers[model_idx]
     return model
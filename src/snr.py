@@ -1,3 +1,4 @@
+from multiprocessing import Pool, cpu_count
 from pathlib import Path
 
 import numpy as np
@@ -12,33 +13,55 @@ def numel(array):
     return n
 
 def _snrseg(noisy_file, clean_file, tf=0.05):
-    # read wav
-    fs, clean_signal = wavfile.read(clean_file)
-    _, noisy_signal = wavfile.read(noisy_file)
-    r = clean_signal.astype(np.float32, order='C') / 32768.0
-    s = noisy_signal.astype(np.float32, order='C') / 32768.0
+    # read wav (memory-mapped, only the overlapping part is touched)
+    fs, clean_signal = wavfile.read(clean_file, mmap=True)
+    _, noisy_signal = wavfile.read(noisy_file, mmap=True)
+    return _snrseg_signals(noisy_signal, clean_signal, fs, tf)
+
+def _snrseg_signals(noisy_signal, clean_signal, fs, tf=0.05):
     # snr
     snmax = 100
-    nr = min(r.shape[0], s.shape[0])
+    nr = min(clean_signal.shape[0], noisy_signal.shape[0])
     kf = round(tf * fs)
     ifr = np.arange(kf, nr, kf)
     ifl = int(ifr[len(ifr)-1])
     nf = numel(ifr)
-    ef = np.sum(np.reshape(np.square((s[0:ifl] - r[0:ifl])), (kf, nf), order='F'), 0)
-    rf = np.sum(np.reshape(np.square(r[0:ifl]), (kf, nf), order='F'), 0)
+    r = clean_signal[0:ifl].astype(np.float32, order='C') / 32768.0
+    s = noisy_signal[0:ifl].astype(np.float32, order='C') / 32768.0
+    # frames (kf samples each) as rows
+    ef = np.sum(np.reshape(np.square(s - r), (nf, kf)), 1)
+    rf = np.sum(np.reshape(np.square(r), (nf, kf)), 1)
     em = ef == 0
     rm = rf == 0
     snf = 10 * np.log10((rf + rm) / (ef + em))
     snf[rm] = -snmax
     snf[em] = snmax
-    temp = np.ones(nf)
-    vf = temp == 1
-    seg = np.mean(snf[vf])
+    seg = np.mean(snf)
     return seg
 
+def _snrseg_chunk(pairs):
+    return [ _snrseg(noisy_file, clean_file) for noisy_file, clean_file in pairs ]
+
+def snrseg_table(noisy_dir, clean_dir, workers=None, chunksize=256):
+    """
+    Segmental SNR of all wavs in `noisy_dir` (against the wavs with the same name in `clean_dir`).
+    Chunks of files are processed in parallel (`workers` processes, default: all cores).
+    -> {'name': [...], 'snrseg': array, 'count': ..., 'mean': ..., 'std': ..., 'min': ..., 'max': ...}
+    """
+    noisy_files = sorted(Path(noisy_dir).glob('*.wav'))
+    pairs = [ (noisy_file, Path(clean_dir).joinpath(noisy_file.name)) for noisy_file in noisy_files ]
+    chunks = [ pairs[i:i+chunksize] for i in range(0, len(pairs), chunksize) ]
+    workers = min(len(chunks), workers or cpu_count())
+    if workers > 1:
+        with Pool(workers) as p:
+            snrs = [ snr for chunk in p.imap(_snrseg_chunk, chunks) for snr in chunk ]
+    else:
+        snrs = _snrseg_chunk(pairs)
+    snrs = np.array(snrs, dtype=np.float64)
+    table = { 'name': [ noisy_file.stem for noisy_file in noisy_files ], 'snrseg': snrs, 'count': len(snrs) }
+    for stat in ['mean', 'std', 'min', 'max']:
+        table[stat] = float(getattr(np, stat)(snrs)) if len(snrs) > 0 else None
+    return table
+
 def snrseg(noisy_dir, clean_dir):
-    snrs = []
-    for noisy_file in Path(noisy_dir).glob('*.wav'):
-        clean_file = Path(clean_dir).joinpath(noisy_file.name)
-        snrs.append(_snrseg(noisy_file, clean_file))
-    return snrs
+    return list(snrseg_table(noisy_dir, clean_dir)['snrseg'])
@@ -0,0 +1,183 @@
+import argparse
+import csv
+import itertools
+import threading
+import time
+import traceback
+from multiprocessing import cpu_count
+from pathlib import Path
+
+import attack
+import decode
+from datasets import Dataset
+from kaldi import Kaldi
+from kaldi_utils import KaldiLogger
+from select_models import select_model
+
+BASE_DIR = Path.home().joinpath('dompteur')
+
+FIELDS = ['task', 'phi', 'low', 'high', 'attacker', 'learning_rate', 'model', 'experiment', 'cores',
+          'status', 'running_time', 'wer', 'inital_wer', 'wer_recovered', 'successful_AEs', 'snrseg']
+
+
+def grid(task, phis, bandpasses, attackers, learning_rates):
+    # one run per configuration (attacker and learning rate only for attacks)
+    if task == 'decode':
+        attackers, learning_rates = [None], [None]
+    return [ {'task': task, 'phi': phi, 'low': low, 'high': high, 'attacker': attacker, 'learning_rate': learning_rate}
+             for phi, (low, high), attacker, learning_rate in itertools.product(phis, bandpasses, attackers, learning_rates) ]
+
+def run_cost(run):
+    # relative cost of a run: dominated by the psychoacoustic filter (pre-processing of
+    # each decoding, every step of the adaptive attacker incl. the decoding of its AEs)
+    if run['task'] == 'decode':
+        return 1 if run['phi'] in [None, 'None'] else 2
+    return 2 if run['attacker'] == 'adaptive' else 1
+
+def size_runs(runs, cores, max_cores):
+    # cores proportional to the cost of a run (all runs at once if the budget allows it), at most `max_cores`
+    unit = max(1, cores // sum(run_cost(run) for run in runs))
+    for run in runs:
+        run['cores'] = max(1, min(run_cost(run) * unit, max_cores))
+    return runs
+
+def schedule(runs, cores, execute):
+    """
+    Runs `execute(run)` for all runs on a budget of `cores` (first-fit decreasing):
+    the largest pending run that fits into the free cores is started next, i.e., small
+    runs fill the cores that are left over by large ones (cf. `size_runs`).
+    """
+    pending = sorted(runs, key=lambda run: run['cores'], reverse=True)
+    free = [cores]
+    condition = threading.Condition()
+
+    def execute_and_release(run):
+        try:
+            execute(run)
+        finally:
+            with condition:
+                free[0] += run['cores']
+                condition.notify_all()
+
+    threads = []
+    with condition:
+        while pending:
+            run = next((run for run in pending if run['cores'] <= free[0]), None)
+            if run is None:
+                condition.wait()
+                continue
+            pending.remove(run)
+            free[0] -= run['cores']
+            threads.append(threading.Thread(target=execute_and_release, args=(run,)))
+            threads[-1].start()
+    for thread in threads:
+        thread.join()
+
+
+class ResultsTable:
+
+    # one row per run, appended as soon as the run is completed
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w', newline='') as f:
+            csv.DictWriter(f, fieldnames=FIELDS).writeheader()
+
+    def add(self, row):
+        with self.lock, open(self.path, 'a', newline='') as f:
+            csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore').writerow(row)
+
+
+def main(models, experiments, dataset_dir, task, phi, bandpass, attacker, learning_rate,
+         inner_itr, max_itr, psycho_hiding_thresh, cores, max_cores_per_run, plot_samples):
+    # shared preparation: dataset and model selection
+    dataset = Dataset(dataset_dir)
+    runs = grid(task, phi, [ tuple(b.split('-')) for b in bandpass ], attacker, learning_rate)
+    for run in runs:
+        run['model'] = select_model(models, run['phi'], run['low'], run['high'])
+    # more than one core per utterance is not used
+    max_cores = min(len(dataset), cores, max_cores_per_run or cores)
+    size_runs(runs, cores, max_cores)
+
+    sweep_dir = experiments.joinpath(f'sweep_{time.strftime("%Y-%m-%d_%H-%M-%S")}')
+    table = ResultsTable(sweep_dir.joinpath('results.csv'))
+    print(f'[+] sweep: {len(runs)} {task} runs on {cores} cores')
+    print(f'    dataset "{dataset}": {len(dataset)} utterances, {sum(e["duration"] for e in dataset.manifest.values()) / 60:.1f} min')
+    print(f'    results @ {table.path}')
+
+    # attacks: the initial WER of a model does not depend on the attack => decode once per model
+    inital_wers = {}
+    if task == 'attack':
+        def decode_target(run):
+            kaldi = Kaldi.from_trained_model(run['model'], sweep_dir.joinpath(f'inital_wer_{run["model"].name}'))
+            inital_wers[run['model']] = kaldi.decode_wavs(dataset.data_dir, dataset.target, numjobs=run['cores'])[0]
+            kaldi.close()
+        models_to_decode = { run['model']: { **run, 'task': 'decode' } for run in runs }
+        schedule(size_runs(list(models_to_decode.values()), cores, max_cores), cores, decode_target)
+
+    def execute(run):
+        start = time.time()
+        kwargs = dict(models=models, experiments=experiments, dataset_dir=dataset_dir,
+                      phi=run['phi'], low=run['low'], high=run['high'], numjobs=run['cores'], dataset=dataset)
+        try:
+            if task == 'decode':
+                kaldi = decode.main(**kwargs)
+            else:
+                kaldi = attack.main(**kwargs, inner_itr=inner_itr, max_itr=max_itr, learning_rate=run['learning_rate'],
+                                    psycho_hiding_thresh=psycho_hiding_thresh, attacker=run['attacker'],
+                                    inital_wer=inital_wers.get(run['model']), plot_samples=plot_samples, quiet=True)
+            results = kaldi.results
+            run.update(status='done', experiment=kaldi.base_dir.name,
+                       wer=results['wer'], inital_wer=results['inital_wer'] if task == 'attack' else None,
+                       wer_recovered=results['wer_recovered'] if task == 'attack' else None)
+            if task == 'attack':
+                run.update(successful_AEs=results['successful_AEs']['count'],
+                           snrseg=results['successful_AEs']['snrseg'] or None)
+            kaldi.close()
+        except Exception:
+            traceback.print_exc()
+            run['status'] = 'failed'
+        run['running_time'] = int(time.time() - start)
+        table.add({ **run, 'model': run['model'].name })
+
+    schedule(runs, cores, execute)
+    print(f'\n[+] sweep completed')
+    print(f'    results @ {table.path}')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', type=Path, default=BASE_DIR.joinpath('models'),
+                        help='Directory with trained models.')
+    parser.add_argument('--experiments', type=Path, default=BASE_DIR.joinpath('experiments'),
+                        help='Output directory for experiments.')
+    parser.add_argument('--dataset_dir', type=Path, default=BASE_DIR.joinpath('datasets', 'speech_10'),
+                        help='Path to dataset.')
+    parser.add_argument('--task', default='decode', choices=['decode', 'attack'],
+                        help='Runs of the sweep.')
+    parser.add_argument('--phi', nargs='+', default=["None"],
+                        help='Scaling factors for the psychoacoustic filter.')
+    parser.add_argument('--bandpass', nargs='+', default=["None-None"],
+                        help='Band-pass filters (<low>-<high>).')
+    parser.add_argument('--attacker', nargs='+', default=['adaptive'], choices=['baseline', 'adaptive'],
+                        help='Types of attacker.')
+    parser.add_argument('--learning_rate', nargs='+', default=['0.05'],
+                        help='Learning rates for the attack.')
+    parser.add_argument('--inner_itr', default=50, type=int,
+                        help='Number of optimization steps in inner loop.')
+    parser.add_argument('--max_itr', default=2000, type=int,
+                        help='Maximum number of optimization steps.')
+    parser.add_argument('--psycho_hiding_thresh', default="-1",
+                        help='Margin "lambda" in dB for psychoacoustic hiding. Disabled for -1.')
+    parser.add_argument('--plot_samples', default=None, type=int,
+                        help='Number of AEs with spectograms per attack (per successful / unsuccessful AEs). All for None.')
+    parser.add_argument('--cores', default=cpu_count(), type=int,
+                        help='Core budget for all runs.')
+    parser.add_argument('--max_cores_per_run', default=None, type=int,
+                        help='Upper bound of cores for a single run (default: dataset size).')
+
+    try:
+        Kaldi.build_container(BASE_DIR)
+        main(**vars(parser.parse_args()))
+    finally:
+        KaldiLogger.stop_all()
@@ -1,12 +1,18 @@
+import atexit
 import json
+import os
 import warnings
 from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from multiprocessing import Pool, cpu_count
 from pathlib import Path
 
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
 import scipy.signal
-import torch
 from scipy.io import wavfile
 
 
@@ -17,34 +23,99 @@ class PersistentDefaultDict:
 
     Init: 
         results = PersistentDefaultDict(<path_to_results_file>)
+        results = PersistentDefaultDict(<path_to_results_file>, journal=True)
 
     Add result:
         results['key1', 'key2'] = <result>
+
+    Group results (written at once):
+        with results.batch():
+            results['key1'] = <result>
+            results['key2'] = <result>
+
+    In journal mode, each result is appended as one line to `<path_to_results_file>.journal`.
+    The journal is merged into the results file with `compact` (e.g., on `close`).
     """    
 
-    def __init__(self, path_to_dict):
+    def __init__(self, path_to_dict, journal=False):
         self.path = Path(path_to_dict)
+        self.journal = journal
+        self.journal_path = self.path.with_name(f'{self.path.name}.journal')
+        self.pending = []
+        self.batches = 0
         if self.path.is_file():
             stored_data = json.loads(self.path.read_text())
             self.data = PersistentDefaultDict.redefault_dict(stored_data)
         else:
             self.data = defaultdict(PersistentDefaultDict.rec_default_dict)
+        # replay updates that were not compacted yet (a partial last line is from a crash)
+        if self.journal_path.is_file():
+            for line in self.journal_path.read_text().splitlines():
+                try:
+                    update = json.loads(line)
+                except ValueError:
+                    break
+                self.set(update['keys'], update['item'])
+            self.compact()
+        if self.journal:
+            atexit.register(self.close)
 
     def __str__(self):
         return str(json.dumps(self.data, indent=4))
+
+    def set(self, keys, item):
+        d = self.data
+        for key in keys[:-1]:
+            d = d[key]
+        d[keys[-1]] = PersistentDefaultDict.redefault_dict(item)
             
     def __setitem__(self, keys, item):
-        d = self.data
         if isinstance(keys, str):
-            d[keys] = item
-        elif isinstance(keys, tuple):
-            for key in keys[:-1]:
-                d = d[key]
-            d[keys[-1]] = item
-        else:
+            keys = (keys,)
+        elif not isinstance(keys, tuple):
             raise NotImplementedError()
+        self.set(keys, item)
+        self.pending.append({ 'keys': list(keys), 'item': item })
+        if self.batches == 0:
+            self.flush()
+
+    @contextmanager
+    def batch(self):
+        self.batches += 1
+        try:
+            yield self
+        finally:
+            self.batches -= 1
+            if self.batches == 0:
+                self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.journal:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_path, 'a') as f:
+                f.writelines(json.dumps(update) + '\n' for update in self.pending)
+        else:
+            self.compact()
+        self.pending = []
+
+    def compact(self):
+        # atomic rewrite of the results file, afterwards the journal is obsolete
         self.path.parent.mkdir(parents=True, exist_ok=True)
-        self.path.write_text(json.dumps(self.data, indent=4))
+        tmp_path = self.path.with_name(f'.{self.path.name}.tmp')
+        tmp_path.write_text(json.dumps(self.data, indent=4))
+        os.replace(tmp_path, self.path)
+        if self.journal_path.is_file():
+            self.journal_path.unlink()
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        if self.journal_path.is_file():
+            self.compact()
+        if self.journal:
+            atexit.unregister(self.close)
 
     def __getitem__(self, key):
         return self.data[key]
@@ -63,23 +134,25 @@ class PersistentDefaultDict:
         else:
             return data
 
+@lru_cache(maxsize=32)
+def _load_threshs(threshs_file, mtime_ns, size):
+    # remove padded frames (copies frames at end and beginning) except for the first one at the end
+    thresholds = np.loadtxt(threshs_file, delimiter=',', dtype=np.float32, ndmin=2)[4:-3,:256]
+    return np.ascontiguousarray(thresholds.T)
+
 def get_threshs(threshs_file):
     assert threshs_file.is_file()
-    # read in hearing thresholds
-    thresholds = Path(threshs_file).read_text()
-    thresholds = [row.split(',') for row in thresholds.split('\n')]
-    # remove padded frames (copies frames at end and beginning)
-    thresholds = np.array(thresholds[4:-4], dtype=float)[:,:256]
-    thresholds = torch.tensor(thresholds, dtype=torch.float32).to('cpu')
-    thresholds = thresholds.permute((1,0))
-    return thresholds
+    # read in hearing thresholds (cached until the file changes)
+    stat = Path(threshs_file).stat()
+    return _load_threshs(str(threshs_file), stat.st_mtime_ns, stat.st_size)
 
 def plot_stats(phi, data_dir, filename):
 
     cmap = plt.get_cmap('viridis')
 
-    def set_spectogram(axis, signal, sample_rate, colorbar=False):
-        frequencies, times, spectrogram = scipy.signal.spectrogram(signal, sample_rate)
+    def set_spectogram(axis, signal, sample_rate, colorbar=False, spectrogram=None):
+        # spectrogram: already computed (frequencies, times, spectrogram) of the signal, e.g., the reference
+        frequencies, times, spectrogram = spectrogram or scipy.signal.spectrogram(signal, sample_rate)
         im = axis.pcolormesh(times, frequencies, np.log(spectrogram), shading='auto', cmap=cmap, vmin=vmin, vmax=vmax)
         fig.colorbar(im, ax=axis)
         # if colorbar:
@@ -91,6 +164,11 @@ def plot_stats(phi, data_dir, filename):
         data_dir = Path(data_dir).joinpath('data')
         sample_rate = 16000
 
+        # already rendered (and the data did not change since)
+        plot_file = data_dir.parent.joinpath(f'{filename}.png')
+        if plot_file.is_file() and all(plot_file.stat().st_mtime >= f.stat().st_mtime for f in data_dir.glob(f'{filename}_*')):
+            return
+
         _, ae = wavfile.read(data_dir.joinpath(f'{filename}_ae.original.wav'))
         _, ae_filtered = wavfile.read(data_dir.joinpath(f'{filename}_ae.wav'))
 
@@ -101,14 +179,15 @@ def plot_stats(phi, data_dir, filename):
 
         fig, axs = plt.subplots(2, 3, figsize=(12,8))
 
-        _, _, spectrogram = scipy.signal.spectrogram(ref, sample_rate)
-        vmin = np.log(spectrogram.min())
-        vmax = np.log(spectrogram.max())
+        # reference: color scale and its plot
+        ref_spectrogram = scipy.signal.spectrogram(ref, sample_rate)
+        vmin = np.log(ref_spectrogram[2].min())
+        vmax = np.log(ref_spectrogram[2].max())
 
         axs[0, 0].set_title('Reference')
         axs[0, 1].set_title('+ Adv. Noise')
         axs[0, 2].set_title('= Adv. Example')
-        set_spectogram(axs[0, 0], ref, sample_rate, colorbar=True)
+        set_spectogram(axs[0, 0], ref, sample_rate, colorbar=True, spectrogram=ref_spectrogram)
         set_spectogram(axs[0, 1], ae-ref, sample_rate)
         set_spectogram(axs[0, 2], ae, sample_rate)
 
@@ -124,4 +203,15 @@ def plot_stats(phi, data_dir, filename):
         # for ax in axs.flat:
         #     ax.label_outer()
         
-        fig.savefig(data_dir.parent.joinpath(f'{filename}.png'))
+        fig.savefig(plot_file)
+        plt.close(fig)
+
+def plot_stats_batch(phi, data_dir, filenames, workers=None):
+    # bounded number of processes (instead of one per AE)
+    workers = min(len(filenames), workers or cpu_count())
+    if workers <= 1:
+        for filename in filenames:
+            plot_stats(phi, data_dir, filename)
+        return
+    with Pool(workers) as p:
+        list(p.imap_unordered(partial(plot_stats, phi, data_dir), filenames, chunksize=max(1, len(filenames) // (4 * workers))))
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# flat imports as in the scripts: host side (@ src/) first, the recipe (e.g., the `psycho` package) after it
+sys.path.insert(0, str(ROOT.joinpath('src')))
+sys.path.append(str(ROOT.joinpath('kaldi', 'wsj_recipe')))
@@ -0,0 +1,63 @@
+from pathlib import Path
+from subprocess import run
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from psycho import hearing_thresholds
+
+ROOT = Path(__file__).resolve().parents[1]
+REFERENCE_WAV = ROOT.joinpath('datasets', 'speech_10', '440c040j.wav')
+
+# compiled MATLAB implementation (@ Dockerfile)
+RUN_CALC_THRESHOLD = Path('/root/hearing_thresholds/run_calc_threshold.sh')
+MATLAB_RUNTIME = '/usr/local/MATLAB/MATLAB_Runtime/v96'
+
+# csvwrite keeps 5 significant digits => thresholds (dB) agree within
+RTOL, ATOL = 1e-4, 1e-2
+
+
+def matlab_fft_analysis(x, n):
+    # FFT_Analysis.m (n: 1-based offset of the block)
+    N, overlap, size = len(x), hearing_thresholds.FFT_OVERLAP, hearing_thresholds.FFT_SIZE
+    s = x[max(1, n - overlap) - 1:min(N, n + size - overlap - 1)]
+    if n - overlap < 1:
+        s = np.concatenate((np.zeros(overlap - n + 1), s))
+    if N < n - overlap + size - 1:
+        s = np.concatenate((s, np.zeros(n - overlap + size - 1 - N)))
+    h = np.sqrt(8 / 3) * 0.5 * (1 - np.cos(2 * np.pi * np.arange(1, size + 1) / (size + 1)))
+    with np.errstate(divide='ignore'):
+        return np.maximum(20 * np.log10(np.abs(np.fft.fft(s * h)) / size), hearing_thresholds.MIN_POWER)
+
+
+@pytest.mark.parametrize('length', [385, 1000, 16000, 44101])
+def test_fft_analysis_blocks(length):
+    x = np.random.default_rng(length).standard_normal(length)
+    X = hearing_thresholds.fft_analysis(x)
+    # for OFFSET = 1:384:length(x)-384 (@ raw_thresholds.m)
+    offsets = range(1, length - hearing_thresholds.FFT_SHIFT + 1, hearing_thresholds.FFT_SHIFT)
+    assert X.shape == (len(offsets), hearing_thresholds.FFT_SIZE + 1)
+    for block, offset in enumerate(offsets):
+        np.testing.assert_allclose(X[block, 1:], matlab_fft_analysis(x, offset), rtol=1e-12, atol=1e-9)
+
+
+def test_thresholds_shape():
+    fs, audio = wavfile.read(REFERENCE_WAV)
+    thresholds, thresholds_dB = hearing_thresholds.calculate_hearing_threshold(audio / 32768, fs, 512, 256)
+    # one row per STFT frame (w/o offset)
+    assert thresholds.shape == thresholds_dB.shape
+    assert thresholds.shape[1] == 256
+    assert np.isfinite(thresholds_dB).all()
+
+
+@pytest.mark.skipif(not RUN_CALC_THRESHOLD.is_file(), reason='MATLAB Runtime not available (cf. Dockerfile)')
+def test_matches_matlab(tmp_path):
+    wav_files = tmp_path.joinpath('wav.scp')
+    wav_files.write_text(f'ref {REFERENCE_WAV}\n')
+    run([str(RUN_CALC_THRESHOLD), MATLAB_RUNTIME, str(wav_files), '512', '256', f'{tmp_path}/matlab/'], check=True)
+    hearing_thresholds.calc_threshold(wav_files, 512, 256, tmp_path.joinpath('native'))
+    matlab = np.loadtxt(tmp_path.joinpath('matlab', 'ref_dB.csv'), delimiter=',', ndmin=2)
+    native = np.loadtxt(tmp_path.joinpath('native', 'ref_dB.csv'), delimiter=',', ndmin=2)
+    assert native.shape == matlab.shape
+    np.testing.assert_allclose(native, matlab, rtol=RTOL, atol=ATOL)
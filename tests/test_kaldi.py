@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+for module in [ 'colorama', 'tqdm', 'matplotlib' ]:
+    pytest.importorskip(module)
+
+import kaldi
+from kaldi import Kaldi
+
+
+@pytest.fixture
+def context(tmp_path):
+    # build context of the image (cf. .dockerignore)
+    for path in [ 'Dockerfile', 'requirements.txt', '.dockerignore', 'kaldi/wsj_recipe/run.sh', 'hearing_thresholds/calc.m' ]:
+        tmp_path.joinpath(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(path).write_text(path)
+    return tmp_path
+
+def test_fingerprint_of_build_context(context):
+    fingerprint = Kaldi.fingerprint(context)
+    assert Kaldi.fingerprint(context) == fingerprint
+    # not part of the build context
+    context.joinpath('models').mkdir()
+    context.joinpath('models/final.mdl').write_text('model')
+    context.joinpath('kaldi/wsj_recipe/__pycache__').mkdir()
+    context.joinpath('kaldi/wsj_recipe/__pycache__/x.pyc').write_text('cache')
+    assert Kaldi.fingerprint(context) == fingerprint
+    # changed / new files of the build context
+    run_sh = context.joinpath('kaldi/wsj_recipe/run.sh')
+    os.utime(run_sh, ns=(0, run_sh.stat().st_mtime_ns + 1))
+    assert Kaldi.fingerprint(context) != fingerprint
+    fingerprint = Kaldi.fingerprint(context)
+    context.joinpath('hearing_thresholds/new.m').write_text('')
+    assert Kaldi.fingerprint(context) != fingerprint
+
+@pytest.mark.parametrize('image', [ 'matching', 'outdated', None ])
+def test_build_container_skipped_for_matching_image(context, monkeypatch, image):
+    builds = []
+    fingerprint = Kaldi.fingerprint(context)
+    monkeypatch.setattr(kaldi, 'BACKEND', 'docker')
+    monkeypatch.setattr(Kaldi, 'image_fingerprint', staticmethod(lambda: fingerprint if image == 'matching' else image))
+    monkeypatch.setattr(kaldi, 'run', lambda cmd, **kwargs: builds.append(cmd) or type('Result', (), { 'returncode': 0 }))
+    Kaldi.build_container(context)
+    if image == 'matching':
+        assert builds == []
+    else:
+        assert len(builds) == 1 and f'--label dompteur.fingerprint={fingerprint}' in builds[0]
+
+def test_decode_wavs_multi_decodes_once(tmp_path, monkeypatch):
+    data_dir = tmp_path.joinpath('data')
+    data_dir.mkdir()
+    for utt in [ 'utt1', 'utt2' ]:
+        data_dir.joinpath(f'{utt}.wav').write_bytes(b'')
+    hyp = { 'utt1': 'open the door', 'utt2': 'hello world' }
+    target = { 'utt1': 'open the door', 'utt2': 'hello there' }
+    original = { 'utt1': 'close the window', 'utt2': 'hello world' }
+
+    commands = []
+    def decode_wavs(cmd, additional_cmds=[]):
+        # scoring of the hypotheses (same for all references) @ decode_wavs.sh
+        commands.append(cmd)
+        for scoring_dir in cmd.split()[1:]:
+            scoring_dir = experiment.base_dir.joinpath(scoring_dir)
+            ref = dict(line.split(' ', 1) for line in scoring_dir.joinpath('text').read_text().splitlines())
+            per_utt, errors = [], 0
+            for utt in hyp:
+                sub = sum(r != h for r, h in zip(ref[utt].split(), hyp[utt].split()))
+                errors += sub
+                per_utt += [ f'{utt} ref {ref[utt]}', f'{utt} hyp {hyp[utt]}', f'{utt} #csid {len(ref[utt].split()) - sub} {sub} 0 0' ]
+            scoring_dir.joinpath('scoring_kaldi/wer_details').mkdir(parents=True)
+            scoring_dir.joinpath('scoring_kaldi/wer_details/per_utt').write_text("\n".join(per_utt) + "\n")
+            scoring_dir.joinpath('scoring_kaldi/best_wer').write_text(f'%WER {100 * errors / 5:.2f} [ {errors} / 5, 0 ins, 0 del, {errors} sub ]\n')
+
+    experiment = Kaldi(tmp_path.joinpath('experiment'), backend='local')
+    experiment.base_dir.joinpath('exp/nnet5d_gpu_time').mkdir(parents=True)
+    monkeypatch.setattr(experiment, 'run_in_container', decode_wavs)
+    decode_dir, results = experiment.decode_wavs_multi(data_dir, [target, original])
+    experiment.close()
+    assert len(commands) == 1
+    assert decode_dir.joinpath('wavs/utt1.wav').is_file()
+    assert [ best_wer for best_wer, _ in results ] == [20.0, 40.0]
+    assert [ entry['wav_name'] for entry in results[1][1] ] == ['utt2', 'utt1']
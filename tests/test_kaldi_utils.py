@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+pytest.importorskip('colorama')
+pytest.importorskip('tqdm')
+
+from kaldi_utils import LogTailer
+
+
+def events(base_dir):
+    return [ json.loads(line)['event'] for line in base_dir.joinpath('events.jsonl').read_text().splitlines() ]
+
+def test_events_kept_across_tailers(tmp_path):
+    log = tmp_path.joinpath('kaldi_log.txt')
+    log.write_text("[+] prepare data\n")
+    LogTailer(tmp_path).poll()
+    # e.g., the next stage of `train.py` => new logger
+    tailer = LogTailer(tmp_path)
+    with open(log, 'a') as f:
+        f.write("Training neural net\n")
+    tailer.poll()
+    assert events(tmp_path)[0] == 'stage'
+    assert events(tmp_path)[-1] == 'train_itr'
+
+def test_reset_starts_new_file(tmp_path):
+    tmp_path.joinpath('kaldi_log.txt').write_text("[+] prepare data\n")
+    LogTailer(tmp_path).poll()
+    LogTailer(tmp_path, reset=True)
+    assert events(tmp_path) == []
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+import nmr
+from psycho import threshold_cache
+
+
+@pytest.mark.parametrize('length', [0, 1, 16000, 40001])
+def test_threshs_key_matches_threshold_cache(length):
+    audio = np.random.default_rng(length).integers(-2**15, 2**15, length).astype(np.int16)
+    assert nmr.threshs_key(audio) == threshold_cache.audio_key(audio)
+    # hashed block by block
+    assert nmr.threshs_key(audio) == threshold_cache.audio_key(audio, block_size=1000)
+    # other sampling rates / dtypes of the same samples
+    assert nmr.threshs_key(audio, 8000) == threshold_cache.audio_key(audio, 8000)
+    assert nmr.threshs_key(audio.astype(np.int32)) == threshold_cache.audio_key(audio.astype(np.int32))
+
+def test_nmr_table_uses_cached_thresholds(tmp_path, monkeypatch):
+    monkeypatch.setattr(threshold_cache, 'CACHE_DIR', tmp_path.joinpath('cache'))
+    rng = np.random.default_rng(0)
+    for name in ['a', 'b']:
+        ref = (rng.standard_normal(8000) * 3000).astype(np.int16)
+        ae = ref + (rng.standard_normal(8000) * 30).astype(np.int16)
+        for directory, audio in [('ref', ref), ('ae', ae)]:
+            tmp_path.joinpath(directory).mkdir(exist_ok=True)
+            wavfile.write(tmp_path.joinpath(directory, f'{name}.wav'), 16000, audio)
+        if name == 'a':
+            threshold_cache.thresholds_of_audio(ref)
+    table = nmr.nmr_table(tmp_path.joinpath('ae'), tmp_path.joinpath('ref'), tmp_path.joinpath('cache'), phi=0, workers=1)
+    assert table['name'] == ['a']
+    assert table['missing'] == ['b']
+    assert np.isfinite(table['nmr']).all() and table['bands'].shape == (1, len(nmr.BANDS) - 1)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torchaudio')
+
+from psycho.psycho import Psycho
+
+PHI = 12
+# samples are in the int16 range => absolute tolerance (float32 STFT/ISTFT of one vs. many utterances)
+ATOL = 1e-2
+
+
+def signal(length, seed):
+    return torch.round(torch.from_numpy(np.random.RandomState(seed).randn(length).astype(np.float32)) * 3000)
+
+def thresholds(length, seed):
+    # [256, frames] (frames of `torch.stft` with center=True), mixed mask
+    return np.random.RandomState(seed).uniform(0, 100, (256, length // 256 + 1)).astype(np.float32)
+
+def test_forward_batch_matches_forward():
+    psycho = Psycho(PHI)
+    lengths = [ 16000, 4000, 12345, 513 ]
+    signals = [ signal(length, seed) for seed, length in enumerate(lengths) ]
+    threshs = [ thresholds(length, seed) for seed, length in enumerate(lengths) ]
+    batch = torch.zeros((len(signals), max(lengths)))
+    for b, utt_signal in enumerate(signals):
+        batch[b,:len(utt_signal)] = utt_signal
+    for utt_signal, utt_thresholds, signal_out in zip(signals, threshs, psycho.forward_batch(batch, lengths, threshs)):
+        expected = psycho.forward(utt_signal, utt_thresholds)
+        assert signal_out.shape == expected.shape
+        np.testing.assert_allclose(signal_out.numpy(), expected.numpy(), rtol=0, atol=ATOL)
+
+def test_forward_batch_without_phi():
+    batch = torch.stack([ signal(1000, 0), signal(1000, 1) ])
+    signals_out = Psycho(None).forward_batch(batch, [1000, 600], [None, None])
+    assert [ len(signal_out) for signal_out in signals_out ] == [1000, 600]
+    assert torch.equal(signals_out[1], batch[1,:600])
+
+@pytest.mark.parametrize('length', [ 16000, 12345, 2048 ])
+@pytest.mark.parametrize('chunk_frames', [ 1, 7, 1024 ])
+def test_forward_chunked_identical(length, chunk_frames):
+    psycho = Psycho(PHI)
+    utt_signal, utt_thresholds = signal(length, 0), thresholds(length, 0)
+    signal_out = torch.cat(list(psycho.forward_chunked(utt_signal, utt_thresholds, chunk_frames)))
+    assert torch.equal(signal_out, psycho.forward(utt_signal, utt_thresholds))
+
+def test_forward_chunked_without_phi():
+    utt_signal = signal(5000, 0)
+    chunks = list(Psycho(None).forward_chunked(utt_signal, None, chunk_frames=4))
+    assert [ len(chunk) for chunk in chunks ] == [1024] * 4 + [904]
+    assert torch.equal(torch.cat(chunks), utt_signal)
+
+def test_convert_wav_chunked_identical(tmp_path):
+    in_file, threshs_file = tmp_path.joinpath('in.wav'), tmp_path.joinpath('threshs.npy')
+    wavfile.write(in_file, 16000, signal(20000, 0).numpy().astype(np.int16))
+    np.save(threshs_file, thresholds(20000, 0))
+    psycho = Psycho(PHI)
+    psycho.convert_wav(in_file, np.load(threshs_file), tmp_path.joinpath('full.wav'))
+    psycho.convert_wav_chunked(in_file, threshs_file, tmp_path.joinpath('chunked.wav'), chunk_frames=10)
+    assert np.array_equal(wavfile.read(tmp_path.joinpath('chunked.wav'))[1], wavfile.read(tmp_path.joinpath('full.wav'))[1])
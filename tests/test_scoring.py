@@ -0,0 +1,62 @@
+import json
+import os
+
+import numpy as np
+
+from scoring import parse_best_wer, parse_per_utt, parse_utt_itr, parse_wer_history
+
+PER_UTT = """\
+utt1 ref  this is  *** a test
+utt1 hyp  this was an  a test
+utt1 op   C    S   I   C C
+utt1 #csid 3 1 1 0
+utt2 ref  hello world
+utt2 hyp  hello world
+utt2 op   C C
+utt2 #csid 2 0 0 0
+utt3 ref  ***
+utt3 hyp  ***
+utt3 op
+utt3 #csid 0 0 0 0
+"""
+
+
+def test_parse_per_utt(tmp_path):
+    path = tmp_path.joinpath('per_utt')
+    path.write_text(PER_UTT)
+    per_utt = parse_per_utt(path)
+    assert per_utt.names == ['utt1', 'utt2', 'utt3']
+    assert per_utt.ref[0] == 'this is  *** a test' and per_utt.hyp[1] == 'hello world'
+    assert per_utt.csid.tolist() == [[3, 1, 1, 0], [2, 0, 0, 0], [0, 0, 0, 0]]
+    # normalized by the aligned reference (incl. insertions)
+    np.testing.assert_allclose(per_utt.wer, [2 / 5, 0, 0])
+    assert [ entry['wav_name'] for entry in per_utt.entries() ] == ['utt2', 'utt3', 'utt1']
+
+def test_parse_best_wer(tmp_path):
+    path = tmp_path.joinpath('best_wer')
+    path.write_text("%WER 4.88 [ 9 / 184, 1 ins, 1 del, 7 sub ] exp/nnet5d_gpu_time/decode/wer_10_0.0\n")
+    assert parse_best_wer(path) == 4.88
+
+def test_parse_utt_itr(tmp_path):
+    path = tmp_path.joinpath('utt_itr')
+    path.write_text("utt1 3\nutt2 10\n\nbroken\n")
+    names, itrs = parse_utt_itr(path)
+    assert names == ['utt1', 'utt2']
+    assert itrs.tolist() == [3, 10]
+
+def test_parse_wer_history(tmp_path):
+    path = tmp_path.joinpath('test_wer.json')
+    # best WER of each outer iteration (@ find_all_correct.py)
+    path.write_text(json.dumps([ f"%WER {wer} [ 0 / 8, 0 ins, 0 del, 0 sub ] exp/adversarial/wer_10_0.0" for wer in ["85.00", "42.50", "0.00"] ]))
+    assert parse_wer_history(path).tolist() == [85.0, 42.5, 0.0]
+
+def test_cache_invalidated_by_changes(tmp_path):
+    path = tmp_path.joinpath('best_wer')
+    path.write_text("%WER 4.88 [ 9 / 184, 1 ins, 1 del, 7 sub ]\n")
+    assert parse_best_wer(path) == 4.88
+    assert parse_best_wer(path) is parse_best_wer(path)
+    # same size, new mtime
+    mtime = path.stat().st_mtime_ns
+    path.write_text("%WER 5.43 [ 9 / 184, 1 ins, 1 del, 7 sub ]\n")
+    os.utime(path, ns=(mtime + 1, mtime + 1))
+    assert parse_best_wer(path) == 5.43
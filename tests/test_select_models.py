@@ -0,0 +1,52 @@
+import json
+import os
+
+import select_models
+from select_models import load_registry, select_model
+
+
+def train(models, name, log="%WER 10.00 [ 1 / 10, 0 ins, 0 del, 1 sub ]\n"):
+    model_dir = models.joinpath(name)
+    model_dir.mkdir(exist_ok=True)
+    model_dir.joinpath('final.mdl').write_text('model')
+    model_dir.joinpath('training.log.txt').write_text(log)
+    return model_dir
+
+def test_registry_reindexes_changed_models(tmp_path, monkeypatch):
+    train(tmp_path, '2020_phi.12_bandpass.None-None')
+    model = train(tmp_path, '2021_phi.12_bandpass.None-None', "%WER 20.00 [ 2 / 10, 0 ins, 0 del, 2 sub ]\n")
+    registry = load_registry(tmp_path)
+    assert registry[model.name]['wer'] == 20.0
+    assert json.loads(tmp_path.joinpath('registry.json').read_text()) == registry
+    assert select_model(tmp_path, '12', 'None', 'None').name == '2020_phi.12_bandpass.None-None'
+
+    # unchanged models are not indexed again
+    indexed = []
+    index_model = select_models.index_model
+    monkeypatch.setattr(select_models, 'index_model', lambda model_dir: indexed.append(model_dir.name) or index_model(model_dir))
+    assert load_registry(tmp_path) == registry
+    assert indexed == []
+
+    # changed training log => new entry
+    model.joinpath('training.log.txt').write_text("%WER 5.00 [ 1 / 20, 0 ins, 0 del, 1 sub ]\n")
+    stat = model.joinpath('training.log.txt').stat()
+    os.utime(model.joinpath('training.log.txt'), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert load_registry(tmp_path)[model.name]['wer'] == 5.0
+    assert indexed == [model.name]
+    assert select_model(tmp_path, '12', 'None', 'None') == model
+
+    # removed model => dropped
+    os.remove(model.joinpath('training.log.txt'))
+    assert model.name not in load_registry(tmp_path)
+
+def test_registry_skips_models_that_cannot_be_indexed(tmp_path, capsys):
+    model = train(tmp_path, '2020_phi.None_bandpass.100-7000')
+    # unfinished training (no WER yet)
+    unfinished = train(tmp_path, '2021_phi.None_bandpass.100-7000', "Training neural net\n")
+    registry = load_registry(tmp_path)
+    assert registry[unfinished.name]['wer'] is None
+    assert f'[!] Skip model {unfinished.name}' in capsys.readouterr().out
+    assert select_model(tmp_path, 'None', '100', '7000') == model
+    # not indexed again as long as the log does not change
+    load_registry(tmp_path)
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,47 @@
+import threading
+import time
+
+import pytest
+
+for module in [ 'colorama', 'tqdm', 'matplotlib', 'pydng' ]:
+    pytest.importorskip(module)
+
+from sweep import schedule, size_runs
+
+
+def execute_all(runs, cores):
+    started, busy, peak = [], [0], [0]
+    lock = threading.Lock()
+    def execute(run):
+        with lock:
+            started.append(run['name'])
+            busy[0] += run['cores']
+            peak[0] = max(peak[0], busy[0])
+        time.sleep(run['duration'])
+        with lock:
+            busy[0] -= run['cores']
+    schedule(runs, cores, execute)
+    return started, peak[0]
+
+def test_schedule_first_fit_decreasing():
+    # the small run fills the core that is left over by the first large one
+    runs = [ { 'name': name, 'cores': cores, 'duration': 0.2 } for name, cores in [('a', 3), ('b', 3), ('c', 1)] ]
+    started, peak = execute_all(runs, cores=4)
+    assert sorted(started[:2]) == ['a', 'c'] and started[2] == 'b'
+    assert peak == 4
+
+def test_schedule_budget():
+    runs = [ { 'name': i, 'cores': cores, 'duration': 0.01 * (i % 3) } for i, cores in enumerate([1, 2, 4, 2, 1, 3, 1, 1]) ]
+    started, peak = execute_all(runs, cores=4)
+    assert sorted(started) == list(range(len(runs)))
+    assert peak <= 4
+    # the largest run first (it takes all cores, nothing else can start before it)
+    assert runs[started[0]]['cores'] == 4
+
+def test_size_runs():
+    runs = [ { 'task': 'decode', 'phi': None }, { 'task': 'decode', 'phi': '12' },
+             { 'task': 'attack', 'attacker': 'adaptive' }, { 'task': 'attack', 'attacker': 'static' } ]
+    assert [ run['cores'] for run in size_runs(runs, cores=12, max_cores=12) ] == [2, 4, 4, 2]
+    assert [ run['cores'] for run in size_runs(runs, cores=12, max_cores=3) ] == [2, 3, 3, 2]
+    # budget smaller than the total cost => one unit per cost (the runs are queued by `schedule`)
+    assert [ run['cores'] for run in size_runs(runs, cores=2, max_cores=2) ] == [1, 2, 2, 1]
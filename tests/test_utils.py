@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+pytest.importorskip('matplotlib')
+
+from utils import PersistentDefaultDict
+
+
+def test_journal_replay(tmp_path):
+    path = tmp_path.joinpath('results.json')
+    results = PersistentDefaultDict(path, journal=True)
+    results['a', 'b'] = 1
+    with results.batch():
+        results['c'] = [1, 2]
+        results['a', 'd'] = { 'e': 'f' }
+    # e.g., killed before `close` => only the journal is written
+    assert not path.is_file()
+    assert len(results.journal_path.read_text().splitlines()) == 3
+    # partial line of the crash
+    with open(results.journal_path, 'a') as f:
+        f.write('{"keys": ["g"], "it')
+    replayed = PersistentDefaultDict(path)
+    assert replayed['a']['b'] == 1 and replayed['a']['d']['e'] == 'f' and replayed['c'] == [1, 2]
+    assert 'g' not in replayed.data
+    # replayed updates are compacted into the results file
+    assert not replayed.journal_path.is_file()
+    assert json.loads(path.read_text()) == { 'a': { 'b': 1, 'd': { 'e': 'f' } }, 'c': [1, 2] }
+    results.close()
+
+def test_close_compacts(tmp_path):
+    path = tmp_path.joinpath('results.json')
+    path.write_text(json.dumps({ 'a': { 'b': 0 } }))
+    results = PersistentDefaultDict(path, journal=True)
+    results['a', 'c'] = 1
+    results['a', 'b'] = 2
+    results.close()
+    assert not results.journal_path.is_file()
+    assert json.loads(path.read_text()) == { 'a': { 'b': 2, 'c': 1 } }
+
+def test_batch_written_at_once(tmp_path):
+    path = tmp_path.joinpath('results.json')
+    results = PersistentDefaultDict(path)
+    with results.batch():
+        results['a'] = 1
+        results['b', 'c'] = 2
+        assert not path.is_file()
+    assert json.loads(path.read_text()) == { 'a': 1, 'b': { 'c': 2 } }
+    assert not results.journal_path.is_file()